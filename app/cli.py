@@ -0,0 +1,66 @@
+import click
+
+from app.default_group import DefaultGroup
+from app.utils.config_utils import (is_first_run,
+                                    display_setup_guide,
+                                    complete_first_run,
+                                    load_prebuilt_macros)
+
+# Command modules are imported on first use so `tm <macro>` only pays for `exec`
+COMMANDS = {
+    "new": "app.commands.new:NewCommand",
+    "ls": "app.commands.list:ListCommand",
+    "cancel": "app.commands.cancel:CancelCommand",
+    "save": "app.commands.save:SaveCommand",
+    "find": "app.commands.find:FindCommand",
+    "desc": "app.commands.desc:DescCommand",
+    "del": "app.commands.delete:DelCommand",
+    "edit": "app.commands.edit:EditCommand",
+    "exec": "app.commands.exec:ExecCommand",
+    "remote": "app.commands.remote:RemoteCommand",
+    "stats": "app.commands.stats:StatsCommand",
+    "hook": "app.commands.hook:HookCommand",
+    "cache": "app.commands.cache:CacheCommand",
+    "completion": "app.commands.completion:CompletionCommand",
+    "daemon": "app.commands.daemon:DaemonCommand",
+    "export": "app.commands.export:ExportCommand",
+    "import": "app.commands.import_:ImportCommand",
+    "watch": "app.commands.watch:WatchCommand",
+    "log": "app.commands.log:LogCommand",
+    "diff": "app.commands.diff:DiffCommand",
+    "rollback": "app.commands.rollback:RollbackCommand",
+}
+
+
+def _profile_self(ctx, param, path):
+    if not path:
+        return
+    # Imported and started here, before the command is even looked up, so CLI dispatch is included
+    from app.utils.hooks import HOOKS
+    from app.utils.tracing import SelfProfiler
+    profiler = SelfProfiler(path)
+    HOOKS.register(profiler)
+    profiler.start()
+    ctx.call_on_close(profiler.stop)
+
+
+@click.group(cls=DefaultGroup,
+             default_if_no_args=False,
+             help="Pass command to run or just macro name to 'exec' given macro",
+             default="exec",
+             lazy_commands=COMMANDS)
+@click.option("--profile-self", type=click.Path(dir_okay=False), is_eager=True, expose_value=False,
+              callback=_profile_self,
+              help="Write a cProfile of termo's own work (not the steps it runs) to PATH")
+def cli():
+    if is_first_run():
+        load_prebuilt_macros()
+        display_setup_guide()
+        complete_first_run()
+    pass
+
+
+def load_all_commands():
+    """Import every command module up front, as the daemon does before it forks."""
+    for name in cli.list_commands(None):
+        cli.get_command(None, name)
@@ -0,0 +1,99 @@
+"""Entry point of `tm`: forwards the invocation to the termo daemon when one is running.
+
+This module is imported on every invocation, so it must only use the standard library
+and stay cheap to import. Without a daemon it falls back to running the CLI in-process.
+"""
+import json
+import os
+import signal
+import socket
+import struct
+import sys
+
+DAEMON_SOCKET = os.path.join(os.path.expanduser("~"), ".termo", "daemon.sock")
+
+# These need the controlling terminal (editors, sudo prompts), which a daemon cannot
+# share with the caller, or manage the daemon itself
+LOCAL_COMMANDS = {"new", "edit", "daemon"}
+LOCAL_OPTIONS = {"--admin", "-a"}
+# Commands that never run macro steps. Anything else runs steps: `exec`, `remote`, `watch`,
+# or a macro name, which runs `exec`. Steps started from a terminal stay local, as the
+# daemon cannot give them the terminal to be suspended with Ctrl-Z or follow its size.
+STEPLESS_COMMANDS = {"ls", "cancel", "save", "find", "desc", "del", "stats", "hook", "cache",
+                     "completion", "export", "import", "log", "diff", "rollback"}
+
+FORWARDED_SIGNALS = (signal.SIGINT, signal.SIGTERM, signal.SIGHUP, signal.SIGQUIT)
+
+HEADER = struct.Struct("!I")
+# Replies from the daemon: b"P" + pid once the request runs, b"X" + exit code when done
+REPLY = struct.Struct("!ci")
+
+
+def _should_forward(argv):
+    if os.environ.get("TERMO_DAEMON") == "0" or not argv:
+        return False
+    if argv[0] in LOCAL_COMMANDS or LOCAL_OPTIONS.intersection(argv):
+        return False
+    if argv[0] not in STEPLESS_COMMANDS and os.isatty(0):
+        return False
+    return os.path.exists(DAEMON_SOCKET)
+
+
+def _read_reply(connection):
+    data = b""
+    while len(data) < REPLY.size:
+        chunk = connection.recv(REPLY.size - len(data))
+        if not chunk:
+            return None, None
+        data += chunk
+    kind, value = REPLY.unpack(data)
+    return kind, value
+
+
+def forward(argv):
+    """Run argv in the daemon with our stdio and return its exit code, or None if no daemon answered."""
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        connection.connect(DAEMON_SOCKET)
+        request = json.dumps({"argv": argv, "cwd": os.getcwd(), "env": dict(os.environ)}).encode()
+        socket.send_fds(connection, [HEADER.pack(len(request)) + request], [0, 1, 2])
+        kind, pid = _read_reply(connection)
+    except OSError:
+        connection.close()
+        return None
+    if kind != b"P":
+        connection.close()
+        return None
+
+    # The terminal signals our process group only; pass them on to the request's group
+    def relay(signum, frame):
+        try:
+            os.killpg(pid, signum)
+        except ProcessLookupError:
+            pass
+
+    for signum in FORWARDED_SIGNALS:
+        signal.signal(signum, relay)
+    try:
+        while True:
+            try:
+                kind, code = _read_reply(connection)
+                break
+            except InterruptedError:
+                continue
+    except OSError:
+        kind, code = None, None
+    finally:
+        connection.close()
+    return code if kind == b"X" else 1
+
+
+def main():
+    argv = sys.argv[1:]
+    if _should_forward(argv):
+        code = forward(argv)
+        if code is not None:
+            sys.exit(code)
+
+    from app.cli import cli
+    cli()
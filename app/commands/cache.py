@@ -0,0 +1,39 @@
+import time
+
+import click
+
+from app.commands.base_command import Command
+from app.utils.step_cache import StepCache
+
+
+def _age(timestamp):
+    seconds = time.time() - timestamp
+    for unit, size in (("d", 86400), ("h", 3600), ("m", 60)):
+        if seconds >= size:
+            return f"{int(seconds // size)}{unit} ago"
+    return "just now"
+
+
+class CacheCommand(Command):
+    def __init__(self):
+        super().__init__(name="cache",
+                         help_text="List (ls) or clear the cached results of steps that declare outputs, "
+                                   "for all macros or one macro",
+                         arguments=[click.Argument(["action"], type=click.Choice(["ls", "clear"])),
+                                    click.Argument(["name"], required=False)])
+
+    def execute(self, action, name):
+        cache = StepCache()
+        if action == "clear":
+            removed = cache.clear(name)
+            click.echo(f"Removed {removed} cached step result(s).")
+            return
+
+        rows = list(cache.entries(name))
+        if not rows:
+            click.echo(click.style("No cached step results", fg='blue'))
+            return
+        for key, macro, step, command, outputs, last_used in rows:
+            click.echo(f"{click.style(key[:12], fg='yellow')}  {macro}:{step}  {outputs} output(s)  "
+                       f"used {_age(last_used)}")
+            click.echo(f"    {command}")
@@ -2,6 +2,7 @@ import click
 
 from app.commands.base_command import Command
 from app.utils.config_utils import load_head, clear_head
+from app.utils.shell_hooks import clear_journal, current_session
 
 
 class CancelCommand(Command):
@@ -16,4 +17,6 @@ class CancelCommand(Command):
             return
 
         clear_head()
+        if current_session():
+            clear_journal(current_session())
         click.echo("Macro recording aborted.")
@@ -0,0 +1,30 @@
+import os
+
+import click
+
+from app.commands.base_command import Command
+from app.utils.completion import COMPLETION_SCRIPTS, completion_script
+from app.utils.config_utils import refresh_completion_cache
+
+
+class CompletionCommand(Command):
+    def __init__(self):
+        super().__init__(name="completion",
+                         help_text="Print the tab completion script for your shell, e.g. add "
+                                   "`eval \"$(tm completion zsh)\"` to ~/.zshrc. "
+                                   "`tm completion refresh` rebuilds the macro names it reads",
+                         arguments=[click.Argument(["shell"], required=False,
+                                                   type=click.Choice(sorted(COMPLETION_SCRIPTS) + ["refresh"]))])
+
+    def execute(self, shell):
+        if shell == "refresh":
+            refresh_completion_cache()
+            return
+
+        shell = shell or os.path.basename(os.environ.get("SHELL", "zsh"))
+        group = click.get_current_context().parent.command
+        try:
+            click.echo(completion_script(shell, group.list_commands(None)), nl=False)
+        except ValueError as e:
+            click.echo(click.style(str(e), fg="red"), err=True)
+            raise SystemExit(1)
@@ -0,0 +1,65 @@
+import os
+import signal
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import click
+
+from app.client import DAEMON_SOCKET
+from app.commands.base_command import Command
+from app.daemon import DAEMON_LOG_FILE, read_pid
+
+START_TIMEOUT = 10
+# The directory containing the `app` package, so `python -m app.daemon` finds it
+PACKAGE_ROOT = Path(__file__).resolve().parents[2]
+
+
+class DaemonCommand(Command):
+    def __init__(self):
+        super().__init__(name="daemon",
+                         help_text="Start, stop or check the background daemon that keeps termo loaded "
+                                   "so `tm` calls skip Python startup work. It stops by itself when idle. "
+                                   "Commands that run macro steps (exec, remote, watch or a macro name) "
+                                   "still run locally when started from a terminal",
+                         arguments=[click.Argument(["action"], type=click.Choice(["start", "stop", "status"]))])
+
+    def execute(self, action):
+        getattr(self, f"_{action}")()
+
+    def _start(self):
+        if read_pid():
+            click.echo(f"The daemon is already running (pid {read_pid()}).")
+            return
+        with open(DAEMON_LOG_FILE, "a") as log:
+            subprocess.Popen([sys.executable, "-m", "app.daemon"],
+                             cwd=PACKAGE_ROOT,
+                             stdin=subprocess.DEVNULL, stdout=log, stderr=log,
+                             start_new_session=True)
+        deadline = time.monotonic() + START_TIMEOUT
+        while time.monotonic() < deadline:
+            if read_pid() and os.path.exists(DAEMON_SOCKET):
+                click.echo(f"Daemon started (pid {read_pid()}).")
+                return
+            time.sleep(0.05)
+        click.echo(click.style(f"The daemon did not start, see {DAEMON_LOG_FILE}", fg="red"))
+        raise SystemExit(1)
+
+    def _stop(self):
+        pid = read_pid()
+        if not pid:
+            click.echo("The daemon is not running.")
+            return
+        os.kill(pid, signal.SIGTERM)
+        deadline = time.monotonic() + START_TIMEOUT
+        while read_pid() and time.monotonic() < deadline:
+            time.sleep(0.05)
+        click.echo(f"Daemon stopped (pid {pid}).")
+
+    def _status(self):
+        pid = read_pid()
+        if pid:
+            click.echo(f"The daemon is running (pid {pid}), listening on {DAEMON_SOCKET}.")
+        else:
+            click.echo("The daemon is not running.")
@@ -2,7 +2,7 @@ import click
 
 from app.commands.base_command import Command
 from app.utils.click_utils import get_argument
-from app.utils.config_utils import load_macros, save_macros
+from app.utils.config_utils import get_store
 
 
 class DelCommand(Command):
@@ -12,16 +12,20 @@ class DelCommand(Command):
                          arguments=[get_argument(["name"])])
 
     def execute(self, name):
-        macros = load_macros()
-        if name not in macros:
+        store = get_store()
+        if not store.contains(name):
             click.echo(f"No macro found with the name '{name}'")
             return
 
+        users = store.dependants(name)
+        if users:
+            click.echo(click.style(f"Macro '{name}' is used by: {', '.join(users)}. "
+                                   f"They will fail to run until it is saved again.", fg='yellow'))
+
         # Confirm deletion
         confirmation = input(f"Are you sure you want to delete the macro '{name}'? (y/n): ").strip().lower()
         if confirmation == "y":
-            del macros[name]
-            save_macros(macros)
+            store.delete(name)
             click.echo(f"Macro '{name}' has been deleted.")
         else:
             click.echo(f"Macro '{name}' was not deleted.")
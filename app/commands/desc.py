@@ -2,7 +2,9 @@ import click
 
 from app.commands.base_command import Command
 from app.utils.click_utils import get_argument
-from app.utils.config_utils import load_macros
+from app.utils.config_utils import get_store
+from app.utils.composition import CompositionError
+from app.utils.templates import collect_defaults, placeholder_label
 
 
 class DescCommand(Command):
@@ -12,11 +14,24 @@ class DescCommand(Command):
                          arguments=[get_argument(["name"])])
 
     def execute(self, name):
-        macros = load_macros()
-        if name in macros:
+        commands = get_store().get(name)
+        if commands is not None:
             click.echo(click.style(f"Macro '{name}' runs commands in following order:", fg='blue'))
-            for index, value in enumerate(macros[name]):
+            for index, value in enumerate(commands):
                 click.echo(f"{index + 1}: {value}")
+
+            try:
+                # Parameters of `@` steps' macros that are passed through are listed too
+                templates = get_store().get_templates(name)
+            except CompositionError as e:
+                click.echo(click.style(f"\nError: {e}", fg='red'))
+                return
+            params = {key: None for template in templates for key, _ in template.placeholders()}
+            params.update(collect_defaults(templates))
+            if params:
+                click.echo(click.style("\nParameters:", fg='blue'))
+                for key, default in params.items():
+                    click.echo(f"  {placeholder_label(key)}" + (f" (default: {default})" if default is not None else ""))
         else:
             click.echo(f"No macro with this name was found")
             click.echo(click.style(f"\nNOTE: use `tm ls` command to see all saved macros", fg='blue'))
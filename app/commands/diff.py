@@ -0,0 +1,36 @@
+import click
+
+from app.commands.base_command import Command
+from app.utils.click_utils import VersionType, echo_diff
+from app.utils.config_utils import get_store
+
+
+class DiffCommand(Command):
+    def __init__(self):
+        super().__init__(name="diff",
+                         help_text="Show what changed in a macro between two versions, by default "
+                                   "between the previous and the current one",
+                         arguments=[click.Argument(["name"]),
+                                    click.Argument(["old"], type=VersionType(), required=False),
+                                    click.Argument(["new"], type=VersionType(), required=False)])
+
+    def execute(self, name, old, new):
+        versions = {version.number: version for version in get_store().versions(name)}
+        if not versions:
+            click.echo(f"No history recorded for '{name}'")
+            return
+        new = max(versions) if new is None else new
+        old = new - 1 if old is None else old
+        for number in (old, new):
+            if number not in versions:
+                click.echo(click.style(f"Error: Macro '{name}' has no version v{number}", fg='red'))
+                return
+
+        for sign, number, color in (("---", old, 'red'), ("+++", new, 'green')):
+            deleted = " (deleted)" if versions[number].deleted else ""
+            click.echo(click.style(f"{sign} {name} v{number}{deleted}", fg=color))
+        before, after = versions[old].commands or [], versions[new].commands or []
+        if before == after:
+            click.echo("No differences")
+            return
+        echo_diff(before, after, context=3)
@@ -2,7 +2,8 @@ import click
 
 from app.commands.base_command import Command
 from app.utils.click_utils import get_argument
-from app.utils.config_utils import load_macros, save_macros
+from app.utils.composition import CompositionError
+from app.utils.config_utils import get_store
 import tempfile
 import os
 from pathlib import Path
@@ -15,8 +16,9 @@ class EditCommand(Command):
                          arguments=[get_argument(["name"])])
 
     def execute(self, name):
-        macros = load_macros()
-        if name not in macros:
+        store = get_store()
+        commands = store.get(name)
+        if commands is None:
             click.echo(f"No macro found with the name '{name}'")
             return
 
@@ -29,7 +31,7 @@ class EditCommand(Command):
             # Write the macro to the file with comments
             temp_file.write("# Edit the macro commands below.\n")
             temp_file.write("# Lines starting with '#' will be ignored.\n")
-            temp_file.writelines(f"{cmd}\n" for cmd in macros[name])
+            temp_file.writelines(f"{cmd}\n" for cmd in commands)
             temp_file.flush()
 
         original_mtime = temp_file_path_obj.stat().st_mtime
@@ -52,6 +54,9 @@ class EditCommand(Command):
 
         os.unlink(temp_file_path)
 
-        macros[name] = updated_commands
-        save_macros(macros)
+        try:
+            store.put(name, updated_commands)
+        except CompositionError as e:
+            click.echo(click.style(f"Error: {e}. The macro was not changed.", fg='red'))
+            return
         click.echo(f"Macro '{name}' has been updated.")
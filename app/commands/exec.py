@@ -1,30 +1,48 @@
-import os
-import platform
-import re
-import subprocess
+from itertools import chain
 
 import click
 
 from app.commands.base_command import Command
-from app.utils.click_utils import get_argument, get_param
-from app.utils.config_utils import load_macros
+from app.utils.checkpoints import Checkpoint
+from app.utils.click_utils import DurationType, get_argument, get_param
+from app.utils.composition import CompositionError
+from app.utils.config_utils import get_store
+from app.utils.dag_runner import DagRunner
+from app.utils.hooks import HOOKS, Run, start_trace
+from app.utils.runner import SequentialRunner
+from app.utils.step_cache import StepCache, is_cacheable
+from app.utils.steps import StepError, expand_steps
+from app.utils.telemetry import RunTimer
+from app.utils.templates import TemplateError, bind_params
+from app.utils.timeouts import Deadline, echo_timing_summary
 
 
-def _run_as_admin(cmd):
-    """Run a command with administrative privileges."""
-    system = platform.system()
+def run_steps(name, steps, admin=False, jobs=1, no_cache=False, checkpoint=None, deadline=None):
+    """Run a macro's parsed steps, record the run and return the step results.
 
+    With a checkpoint, completed steps are recorded as they finish and steps it already
+    holds are skipped. With a deadline, no step runs past it.
+    """
+    # The cache database is only opened for macros with steps that declare outputs
+    cache = StepCache(name, reuse=not no_cache) if any(is_cacheable(step) for step in steps) else None
+
+    HOOKS.load_plugins()
+    run = Run(name) if HOOKS.active else None
+    if run is not None:
+        HOOKS.emit("macro_start", run)
+    results = None
     try:
-        if system in ["Darwin"]:
-            # Use 'sudo' on Linux/macOS
-            click.echo(click.style(f"Running as admin: {cmd}", fg="yellow"))
-            subprocess.run(["sudo", "sh", "-c", cmd], check=True)
+        timer = RunTimer()
+        if jobs > 1:
+            results = DagRunner(steps, [step.command for step in steps], jobs, cache, run, checkpoint,
+                                deadline).run()
         else:
-            click.echo(click.style("Unsupported platform for admin execution.", fg="red"))
-    except subprocess.CalledProcessError as e:
-        click.echo(click.style(f"Error: Command failed with error: {e}", fg="red"))
-    except Exception as e:
-        click.echo(click.style(f"Error: Unable to elevate privileges: {e}", fg="red"))
+            results = SequentialRunner(steps, admin, cache, run, checkpoint, deadline).run()
+        timer.record(name, results)
+    finally:
+        if run is not None:
+            HOOKS.emit("macro_end", run, results)
+    return results
 
 
 class ExecCommand(Command):
@@ -33,35 +51,106 @@ class ExecCommand(Command):
                          help_text="Execute a saved macro, can take positional params for commands",
                          arguments=[get_argument(["name"]),
                                     get_argument(["params"], True),
-                                    get_param(["--admin", "-a"], True, "Run the macro with administrative privileges")
+                                    get_param(["--admin", "-a"], True, "Run the macro with administrative privileges"),
+                                    click.Option(["--set", "-S", "assignments"], multiple=True,
+                                                 help="Set a named parameter, as name=value"),
+                                    click.Option(["--jobs", "-j"], default=1, type=int,
+                                                 help="Run independent steps in parallel, up to N at a time"),
+                                    get_param(["--no-cache"], True,
+                                              "Run every step even if its cached outputs are up to date"),
+                                    click.Option(["--each", "each"], type=click.File("r"),
+                                                 help="Run once per line of FILE (- for stdin); each line "
+                                                      "holds positional params and name=value pairs"),
+                                    click.Option(["--matrix", "-m"], multiple=True,
+                                                 help="Run once per value, as name=v1,v2; repeat to run "
+                                                      "every combination. With --each or --matrix, "
+                                                      "--jobs is the number of rows run at a time"),
+                                    click.Option(["--trace"], type=click.Path(dir_okay=False),
+                                                 help="Append the run as OpenTelemetry spans (OTLP JSON, "
+                                                      "one trace per line) to FILE"),
+                                    get_param(["--resume"], True,
+                                              "Skip the steps a previous failed run with the same "
+                                              "params completed, and continue from there"),
+                                    click.Option(["--timeout", "-t"], type=DurationType(),
+                                                 help="Stop the macro after this long, e.g. 90s, 5m or 1h; "
+                                                      "with --each or --matrix, each row")
                                     ])
 
-    def execute(self, name, params, admin):
-        macros = load_macros()
-        if name not in macros:
+    def execute(self, name, params, admin, assignments, jobs, no_cache, each, matrix, trace, resume, timeout):
+        try:
+            templates = get_store().get_templates(name)
+        except CompositionError as e:
+            click.echo(click.style(f"Error: {e}", fg='red'))
+            raise SystemExit(1)
+        if templates is None:
             click.echo(f"No macro found with the name '{name}'")
             click.echo(click.style(f"\nNOTE: use `tm find <keyword>` command to search macros", fg='blue'))
             return
 
-        param_dict = {str(i + 1): param for i, param in enumerate(params)}
-
-        for cmd in macros[name]:
-            try:
-                formatted_cmd = re.sub(
-                    r"\{(\d+)\}",
-                    lambda match: param_dict.get(match.group(1), f"{{{match.group(1)}}}"),
-                    cmd
-                )
-
-                click.echo(click.style(f"→ {formatted_cmd}", fg='green'))
-                if admin:
-                    _run_as_admin(formatted_cmd)
-                else:
-                    os.system(formatted_cmd)
-                click.echo("")
-            except KeyError as e:
-                click.echo(click.style(f"Error: Missing parameter for placeholder '{e.args[0]}'", fg='red'))
-                return
-            except IndexError as e:
-                click.echo(click.style(f"Error: Invalid formatting in command '{cmd}': {e}", fg='red'))
+        if each is not None or matrix:
+            if trace or resume:
+                option = "--trace" if trace else "--resume"
+                click.echo(click.style(f"Error: {option} cannot be combined with --each or --matrix", fg='red'))
                 return
+            self._execute_batch(name, templates, params, assignments, jobs, admin, each, matrix, timeout)
+            return
+
+        # Every parameter is checked before the first step runs
+        try:
+            steps = expand_steps(templates, bind_params(params, assignments))
+        except (StepError, TemplateError) as e:
+            click.echo(click.style(f"Error: {e}", fg='red'))
+            return
+
+        if jobs > 1 and admin:
+            click.echo(click.style("Error: --admin cannot be combined with --jobs", fg='red'))
+            return
+
+        checkpoint = Checkpoint(name, get_store().current_version(name), steps, resume)
+        if resume and not checkpoint.resumed:
+            click.echo(click.style("No checkpoint to resume from, running every step", fg='blue'))
+        tracer = start_trace(trace) if trace else None
+        deadline = Deadline(timeout) if timeout else None
+        try:
+            results = run_steps(name, steps, admin, jobs, no_cache, checkpoint, deadline)
+            checkpoint.finish(results)
+        finally:
+            checkpoint.close()
+            if tracer is not None:
+                HOOKS.unregister(tracer)
+        echo_timing_summary(results, deadline)
+
+        failed = [result for result in results if not result.succeeded]
+        if failed:
+            click.echo(click.style("\nMacro did not complete:", fg='red'))
+            for result in failed:
+                click.echo(f"- {result.step.id}: {result.status}")
+        if failed and checkpoint.completed:
+            click.echo(click.style("\nNOTE: run the same command with --resume to continue from the first "
+                                   "incomplete step", fg='blue'))
+        # An incomplete run must not pass for a success in scripts and CI
+        if failed:
+            raise SystemExit(1)
+
+    def _execute_batch(self, name, templates, params, assignments, jobs, admin, each, matrix, timeout):
+        # Imported here so running a single macro does not pay for the worker pool
+        from app.utils.batch import BatchRunner, generate_rows, print_batch_summary
+
+        if admin:
+            click.echo(click.style("Error: --admin cannot be combined with --each or --matrix", fg='red'))
+            return
+        try:
+            rows = generate_rows(each, matrix)
+            # Fail on a malformed --matrix before any row starts
+            rows = chain([next(rows)], rows)
+        except StopIteration:
+            click.echo(click.style("No parameter rows to run", fg='blue'))
+            return
+        except (TemplateError, ValueError) as e:
+            click.echo(click.style(f"Error: {e}", fg='red'))
+            return
+
+        results = BatchRunner(name, templates, rows, jobs, params, assignments, timeout).run()
+        print_batch_summary(results)
+        if any(not result.ok for result in results):
+            raise SystemExit(1)
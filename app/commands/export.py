@@ -0,0 +1,30 @@
+import click
+
+from app.commands.base_command import Command
+from app.utils.config_utils import get_store
+from app.utils.macro_io import open_output, write_ndjson
+
+
+class ExportCommand(Command):
+    def __init__(self):
+        super().__init__(name="export",
+                         help_text="Export macros (all, or the given names) as NDJSON, one macro per line",
+                         arguments=[click.Argument(["names"], nargs=-1),
+                                    click.Option(["-o", "--output"], default="-", show_default=True,
+                                                 help="File to write, or - for stdout"),
+                                    click.Option(["-z", "--gzip", "compress"], is_flag=True, default=None,
+                                                 help="Compress with gzip (default for .gz files)")])
+
+    def execute(self, names, output, compress):
+        store = get_store()
+        missing = [name for name in names if not store.contains(name)]
+        if missing:
+            click.echo(click.style(f"Macro(s) not found: {', '.join(missing)}", fg='red'), err=True)
+            raise SystemExit(1)
+
+        # Macros are streamed from the store one at a time rather than loaded up front
+        items = ((name, store.get(name)) for name in names) if names else store.items()
+        with open_output(output, compress) as stream:
+            count = write_ndjson(stream, items)
+        if output != "-":
+            click.echo(f"Exported {count} macro(s) to {output}")
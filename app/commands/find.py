@@ -2,22 +2,28 @@ import click
 
 from app.commands.base_command import Command
 from app.utils.click_utils import get_argument
-from app.utils.config_utils import load_macros
+from app.utils.config_utils import get_store
+from app.utils.search_index import highlight, matching_lines
+
+MATCHING_LINES_SHOWN = 2
 
 
 class FindCommand(Command):
     def __init__(self):
         super().__init__(name="find",
-                         help_text="Search for a macro by keyword",
-                         arguments=[get_argument(["keyword"])]
+                         help_text="Search macros by name and commands",
+                         arguments=[get_argument(["keyword"]),
+                                    click.Option(["--limit", "-n"], default=20, type=int,
+                                                 help="Maximum number of macros to show")]
                          )
 
-    def execute(self, keyword):
-        macros = load_macros()
-        results = [macro for macro in macros if keyword.lower() in macro.lower()]
+    def execute(self, keyword, limit):
+        results = get_store().search(keyword, limit)
         if results:
-            click.echo(f"Macros found containing '{keyword}':")
-            for result in results:
-                click.echo(f"- {result}")
+            click.echo(f"Macros matching '{keyword}':")
+            for name, commands in results:
+                click.echo(f"- {highlight(name, keyword)}")
+                for command in matching_lines(commands, keyword)[:MATCHING_LINES_SHOWN]:
+                    click.echo(f"    {highlight(command, keyword)}")
         else:
             click.echo(f"No macros found containing '{keyword}'.")
@@ -0,0 +1,23 @@
+import os
+
+import click
+
+from app.commands.base_command import Command
+from app.utils.shell_hooks import HOOK_SCRIPTS, hook_script
+
+
+class HookCommand(Command):
+    def __init__(self):
+        super().__init__(name="hook",
+                         help_text="Print shell hooks that record commands live while a macro is being recorded. "
+                                   "Add `eval \"$(tm hook zsh)\"` to ~/.zshrc (or bash/fish equivalent)",
+                         arguments=[click.Argument(["shell"], required=False,
+                                                   type=click.Choice(sorted(HOOK_SCRIPTS)))])
+
+    def execute(self, shell):
+        shell = shell or os.path.basename(os.environ.get("SHELL", "zsh"))
+        try:
+            click.echo(hook_script(shell), nl=False)
+        except ValueError as e:
+            click.echo(click.style(str(e), fg="red"), err=True)
+            raise SystemExit(1)
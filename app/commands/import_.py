@@ -0,0 +1,54 @@
+import click
+
+from app.commands.base_command import Command
+from app.utils.click_utils import echo_diff
+from app.utils.composition import CompositionError
+from app.utils.config_utils import get_store
+from app.utils.macro_io import STRATEGIES, ImportFormatError, ImportPlan, open_input, read_ndjson
+
+
+def _print_action(action, name, target, current, commands):
+    if action == "add":
+        click.echo(click.style(f"+ {name}", fg='green'))
+    elif action == "skip":
+        click.echo(click.style(f"= {name} (exists, skipped)", fg='blue'))
+    elif action == "rename":
+        click.echo(click.style(f"+ {name} -> {target}", fg='green'))
+    elif action == "overwrite":
+        click.echo(click.style(f"~ {name}", fg='yellow'))
+        # None when an earlier macro in the file claimed the name
+        if current is not None:
+            echo_diff(current, commands, indent="    ")
+
+
+class ImportCommand(Command):
+    def __init__(self):
+        super().__init__(name="import",
+                         help_text="Import macros from an NDJSON export (plain or gzipped, - for stdin)",
+                         arguments=[click.Argument(["path"]),
+                                    click.Option(["-s", "--strategy"], type=click.Choice(STRATEGIES),
+                                                 default="skip", show_default=True,
+                                                 help="What to do with macros that already exist: keep "
+                                                      "them, overwrite them, or import under a new name"),
+                                    click.Option(["-n", "--dry-run"], is_flag=True,
+                                                 help="Show what would change without writing anything")])
+
+    def execute(self, path, strategy, dry_run):
+        store = get_store()
+        plan = ImportPlan(store, strategy)
+        try:
+            with open_input(path) as stream:
+                batches = plan.batches(read_ndjson(stream), _print_action if dry_run else None)
+                if dry_run:
+                    for _ in batches:
+                        pass
+                else:
+                    store.put_batches(batches)
+        except (OSError, EOFError, ImportFormatError, CompositionError) as e:
+            click.echo(click.style(f"Import failed, nothing was changed: {e}", fg='red'), err=True)
+            raise SystemExit(1)
+
+        counts = plan.counts
+        summary = (f"{counts['add']} added, {counts['overwrite']} overwritten, {counts['rename']} renamed, "
+                   f"{counts['skip']} skipped, {counts['unchanged']} unchanged")
+        click.echo(click.style(f"{'Would import' if dry_run else 'Imported'}: {summary}", fg='blue'))
@@ -1,7 +1,7 @@
 import click
 
 from app.commands.base_command import Command
-from app.utils.config_utils import load_macros
+from app.utils.config_utils import get_store
 
 
 class ListCommand(Command):
@@ -10,13 +10,13 @@ class ListCommand(Command):
                          help_text="Lists available macros")
 
     def execute(self):
-        macros = load_macros()
+        names = get_store().names()
 
-        if not macros:
+        if not names:
             click.echo(click.style("No macros were found", fg='blue'))
             return
 
-        for key in macros.keys():
+        for key in names:
             click.echo(f"- {key}")
 
         click.echo(click.style(f"\nNOTE: use `tm desc <macro name>` command to see more details", fg='blue'))
@@ -0,0 +1,52 @@
+import difflib
+import time
+
+import click
+
+from app.commands.base_command import Command
+from app.utils.config_utils import get_store
+
+
+def _diffstat(old, new):
+    added = removed = 0
+    for line in difflib.unified_diff(old, new, lineterm="", n=0):
+        if line.startswith(("---", "+++")):
+            continue
+        added += line.startswith("+")
+        removed += line.startswith("-")
+    return f"+{added} -{removed}"
+
+
+class LogCommand(Command):
+    def __init__(self):
+        super().__init__(name="log",
+                         help_text="Show the saved versions of a macro, newest first",
+                         arguments=[click.Argument(["name"]),
+                                    click.Option(["--limit", "-n"], default=20, type=click.IntRange(min=1),
+                                                 show_default=True,
+                                                 help="Number of versions to show")])
+
+    def execute(self, name, limit):
+        # One version more than shown, to tell what the oldest shown one changed
+        versions = get_store().versions(name, limit + 1)
+        if not versions:
+            click.echo(f"No history recorded for '{name}'")
+            return
+
+        shown = versions[-limit:] if len(versions) > limit else versions
+        for version in reversed(shown):
+            previous = versions[versions.index(version) - 1] if version is not versions[0] else None
+            if version.deleted:
+                change = click.style("deleted", fg='red')
+            elif previous is None or previous.deleted:
+                change = click.style(f"saved with {len(version.commands)} step(s)", fg='green')
+            else:
+                change = _diffstat(previous.commands, version.commands)
+            current = click.style("  (current)", fg='blue') if version is versions[-1] and not version.deleted else ""
+            # Versions saved before the history was kept have no time
+            created = (time.strftime("%Y-%m-%d %H:%M", time.localtime(version.created))
+                       if version.created is not None else "-".ljust(16))
+            click.echo(f"{click.style(f'v{version.number}', bold=True)}  {created}  {change}{current}")
+
+        if len(versions) > limit:
+            click.echo(click.style(f"\nNOTE: older versions are not shown, use -n to see more", fg='blue'))
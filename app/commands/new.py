@@ -6,7 +6,9 @@ import click
 
 from app.commands.base_command import Command
 from app.utils.click_utils import get_argument, get_param
-from app.utils.config_utils import load_head, save_head, load_macros, save_macros
+from app.utils.composition import CompositionError
+from app.utils.config_utils import load_head, save_head, get_store
+from app.utils.shell_hooks import clear_journal, current_session
 
 
 class NewCommand(Command):
@@ -19,9 +21,9 @@ class NewCommand(Command):
                                     ])
 
     def execute(self, name, editor):
-        macros = load_macros()
+        store = get_store()
 
-        if name in macros:
+        if store.contains(name):
             click.echo(f"A macro with the name '{name}' already exists.")
             return
 
@@ -63,9 +65,15 @@ class NewCommand(Command):
                 click.echo("No commands were added. Macro creation canceled.")
                 return
 
-            macros[name] = commands
-            save_macros(macros)
+            try:
+                store.put(name, commands)
+            except CompositionError as e:
+                click.echo(click.style(f"Error: {e}. The macro was not saved.", fg='red'))
+                return
             click.echo(f"Macro '{name}' saved successfully.")
         else:
+            # Start from an empty journal in case an earlier recording was never saved
+            if current_session():
+                clear_journal(current_session())
             save_head(name)
             click.echo(f"Recording macro '{name}' started.")
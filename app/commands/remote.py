@@ -1,8 +1,252 @@
-import paramiko
+import codecs
+import secrets
+import select
+import shlex
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
 import click
 from app.commands.base_command import Command
-from app.utils.config_utils import load_macros
-import re
+from app.utils.composition import CompositionError
+from app.utils.config_utils import get_store
+from app.utils.hooks import HOOKS, Run, start_trace
+from app.utils.click_utils import DurationType
+from app.utils.ssh_broker import open_connection
+from app.utils.steps import StepError, StepResult, expand_steps
+from app.utils.templates import TemplateError, bind_params
+from app.utils.timeouts import (KILL_GRACE, TIMEOUT_STATUS, Deadline, echo_timing_summary, format_duration,
+                                retry_delay, step_limit)
+
+SLOWEST_HOSTS_SHOWN = 5
+RECV_CHUNK_SIZE = 32 * 1024
+POLL_INTERVAL = 0.1
+# What timeout(1) exits with on the host: it sent SIGTERM, or had to send SIGKILL after it
+REMOTE_TIMEOUT_STATUSES = (TIMEOUT_STATUS, 128 + 9)
+# A partial line longer than this is written out rather than held until its newline
+MAX_PENDING_LINE = 64 * 1024
+
+_echo_lock = threading.Lock()
+
+
+def _echo(message, **kwargs):
+    # Worker threads share the terminal; keep each message whole
+    with _echo_lock:
+        click.echo(message, **kwargs)
+
+
+def _parse_target(target, default_port):
+    """Split 'user@host:port' into its parts, defaulting to root and the given port."""
+    if "@" in target:
+        user, host = target.split("@", 1)
+    else:
+        user, host = "root", target
+    port = default_port
+    if ":" in host:
+        host, port_text = host.rsplit(":", 1)
+        if not port_text.isdigit() or not 0 < int(port_text) < 65536:
+            raise ValueError(f"invalid port '{port_text}' in '{target}'")
+        port = int(port_text)
+    return user, host, port
+
+
+def _load_inventory(path):
+    """Read one host per line, ignoring blank lines and '#' comments."""
+    with open(path, "r") as file:
+        return [line.split("#", 1)[0].strip() for line in file if line.split("#", 1)[0].strip()]
+
+
+class _OutputWriter:
+    """Writes decoded channel output as it arrives, optionally prefixing every line.
+
+    tap, if given, is called with every chunk of raw output first.
+    """
+
+    def __init__(self, prefix, err, tap=None):
+        self.prefix = prefix
+        self.err = err
+        self.tap = tap
+        self.decoder = codecs.getincrementaldecoder("utf-8")("replace")
+        self.pending = ""
+
+    def _style(self, text):
+        return click.style(text, fg="red") if self.err else text
+
+    def write(self, data, final=False):
+        if self.tap is not None and data:
+            self.tap(data, self.err)
+        text = self.decoder.decode(data, final)
+        if self.prefix is None:
+            if text:
+                _echo(self._style(text), nl=False, err=self.err)
+            return
+        lines = (self.pending + text).split("\n")
+        self.pending = lines.pop()
+        if final or len(self.pending) > MAX_PENDING_LINE:
+            if self.pending:
+                lines.append(self.pending)
+            self.pending = ""
+        for line in lines:
+            _echo(self.prefix + self._style(line), err=self.err)
+
+    def flush(self):
+        if self.pending:
+            _echo(self.prefix + self._style(self.pending), err=self.err)
+            self.pending = ""
+
+    def close(self):
+        self.write(b"", final=True)
+
+
+def _stream_channel(channel, stdout_writer, stderr_writer, expires=None, stdin=None):
+    """Relay a channel's stdout and stderr as they arrive and return its exit status.
+
+    Both buffers are drained on every wake-up, so a command filling its stderr window can
+    never block while we wait on stdout, and at most one chunk is held in memory at a time.
+    stdin, if given, is sent a chunk at a time as the channel takes it, between reads, so a
+    command that writes before it has read all of its input cannot stall us; the channel's
+    stdin is closed after it. expires, if given, returns the monotonic time (or None) after
+    which the channel is closed without waiting any longer; the exit status is then None.
+    """
+    status = None
+    pending = memoryview(stdin) if stdin is not None else None
+    while True:
+        if pending is not None:
+            while pending and channel.send_ready():
+                pending = pending[channel.send(pending[:RECV_CHUNK_SIZE]):]
+            if not pending:
+                channel.shutdown_write()
+                pending = None
+        select.select([channel], [], [], POLL_INTERVAL)
+        while channel.recv_ready():
+            stdout_writer.write(channel.recv(RECV_CHUNK_SIZE))
+        while channel.recv_stderr_ready():
+            stderr_writer.write(channel.recv_stderr(RECV_CHUNK_SIZE))
+        # Servers may report the exit status before the last of the output, so wait for EOF too
+        if (channel.exit_status_ready() and (channel.eof_received or channel.closed)
+                and not channel.recv_ready() and not channel.recv_stderr_ready()):
+            status = channel.recv_exit_status()
+            break
+        deadline = expires() if expires is not None else None
+        if deadline is not None and time.monotonic() >= deadline:
+            channel.close()
+            break
+    stdout_writer.close()
+    stderr_writer.close()
+    return status
+
+
+def _time_limited(command, limit):
+    """Wrap a remote command so the host kills it, with every process it started, after
+    limit seconds. Hosts without timeout(1) run it as is, bounded only by the client closing
+    the channel."""
+    if limit is None:
+        return command
+    script = (f'command -v timeout >/dev/null 2>&1 && exec timeout -k {KILL_GRACE:g} {limit:.3f} '
+              f'"${{SHELL:-sh}}" -c "$1"; exec "${{SHELL:-sh}}" -c "$1"')
+    return f"sh -c {shlex.quote(script)} termo {shlex.quote(command)}"
+
+
+def _build_script(formatted_commands, token):
+    """Build one POSIX sh script that runs every step and reports each exit status on stdout."""
+    lines = []
+    for index, cmd in enumerate(formatted_commands):
+        lines.append(f"{{ eval {shlex.quote(cmd)}\n}} </dev/null")
+        lines.append(f"printf '%s %d %d\\n' {token} {index} \"$?\"")
+    return "\n".join(lines) + "\n"
+
+
+class _MarkerParser:
+    """Sits in front of the stdout writer and pulls step status markers out of the stream."""
+
+    def __init__(self, writer, token, on_step_done):
+        self.writer = writer
+        self.token = token.encode()
+        self.on_step_done = on_step_done
+        self.buffer = b""
+
+    def _held_back(self):
+        # Keep any tail that could be the beginning of a marker split across chunks
+        for size in range(min(len(self.token), len(self.buffer)), 0, -1):
+            if self.buffer.endswith(self.token[:size]):
+                return size
+        return 0
+
+    def write(self, data):
+        self.buffer += data
+        while True:
+            start = self.buffer.find(self.token)
+            if start < 0:
+                break
+            end = self.buffer.find(b"\n", start)
+            if end < 0:
+                self.writer.write(self.buffer[:start])
+                self.buffer = self.buffer[start:]
+                return
+            self.writer.write(self.buffer[:start])
+            self.writer.flush()
+            _, index, status = self.buffer[start:end].split()
+            self.buffer = self.buffer[end + 1:]
+            self.on_step_done(int(index), int(status))
+        held = self._held_back()
+        self.writer.write(self.buffer[:len(self.buffer) - held])
+        self.buffer = self.buffer[len(self.buffer) - held:]
+
+    def close(self):
+        self.writer.write(self.buffer)
+        self.writer.close()
+
+
+class _HostEvents:
+    """Sends the hook events of one host's run, with steps numbered like local ones."""
+
+    def __init__(self, run):
+        self.run = run
+        self.step = None
+        self.results = []
+
+    def step_start(self, step):
+        self.step = step
+        HOOKS.emit("step_start", self.run, step)
+
+    def step_end(self, result):
+        self.results.append(result)
+        HOOKS.emit("step_end", self.run, self.step, result)
+        self.step = None
+
+    def output(self, data, err):
+        HOOKS.emit("output", self.run, self.step, data, err)
+
+
+class HostResult:
+    def __init__(self, target):
+        self.target = target
+        self.exit_codes = []
+        # StepResults of the steps that ran, with their timeouts and retries
+        self.steps = []
+        self.error = None
+        self.duration = 0.0
+
+    @property
+    def ok(self):
+        return self.error is None and all(code == 0 for code in self.exit_codes)
+
+    @property
+    def failure(self):
+        if self.error:
+            return self.error
+        problems = []
+        timed_out = {result.step.index for result in self.steps if result.status == "timeout"}
+        failed = [str(index + 1) for index, code in enumerate(self.exit_codes)
+                  if code not in (0, None) and index not in timed_out]
+        if failed:
+            problems.append(f"step {', '.join(failed)} exited non-zero")
+        if timed_out:
+            problems.append(f"step {', '.join(str(index + 1) for index in sorted(timed_out))} timed out")
+        if None in self.exit_codes:
+            problems.append(f"step {self.exit_codes.index(None) + 1} onwards did not run")
+        return "; ".join(problems)
+
 
 class RemoteCommand(Command):
     """Command to execute a macro on a remote machine via SSH."""
@@ -10,68 +254,281 @@ class RemoteCommand(Command):
     def __init__(self):
         super().__init__(
             name="remote",
-            help_text="Execute a macro on a remote machine via SSH (beta)",
+            help_text="Execute a macro on one or more remote machines via SSH (beta)",
             arguments=[
                 click.Argument(["name"]),
                 click.Argument(["params"], nargs=-1),
-                click.Option(["--host", "-h"], required=True, help="Remote host (user@host)."),
+                click.Option(["--set", "-S", "assignments"], multiple=True,
+                             help="Set a named parameter, as name=value."),
+                click.Option(["--host", "-h"], default=None, help="Remote host (user@host)."),
+                click.Option(["--hosts"], default=None, help="Comma-separated list of remote hosts."),
+                click.Option(["--inventory", "-i"], default=None, type=click.Path(exists=True),
+                             help="File with one remote host per line."),
+                click.Option(["--workers", "-w"], default=16, type=int,
+                             help="Number of hosts to run on concurrently (default: 16)."),
                 click.Option(["--port", "-p"], default=22, type=int, help="SSH port (default: 22)."),
                 click.Option(["--key", "-k"], default=None, help="Path to SSH private key."),
                 click.Option(["--password", "-P"], default=None, help="Password for SSH authentication."),
+                click.Option(["--script", "-s"], is_flag=True,
+                             help="Send the whole macro as one script over a single channel."),
+                click.Option(["--broker/--no-broker"], default=None,
+                             help="Reuse SSH connections kept open by a local broker between runs "
+                                  "(default: on if TERMO_SSH_BROKER=1)."),
+                click.Option(["--trace"], type=click.Path(dir_okay=False),
+                             help="Append the run as OpenTelemetry spans (OTLP JSON, one trace per line) to FILE."),
+                click.Option(["--timeout", "-t"], type=DurationType(),
+                             help="Stop the macro on a host after this long, e.g. 90s, 5m or 1h."),
             ],
         )
 
-    def execute(self, name, params, host, port, key, password):
-        macros = load_macros()
-        if name not in macros:
+    def execute(self, name, params, assignments, host, hosts, inventory, workers, port, key, password, script,
+                broker, trace, timeout):
+        try:
+            templates = get_store().get_templates(name)
+        except CompositionError as e:
+            click.echo(click.style(f"Error: {e}", fg='red'))
+            return
+        if templates is None:
             click.echo(f"No macro found with the name '{name}'.")
             return
 
-        commands = macros[name]
+        targets = ([host] if host else []) + (hosts.split(",") if hosts else [])
+        if inventory:
+            targets += _load_inventory(inventory)
+        targets = list(dict.fromkeys(target.strip() for target in targets if target.strip()))
+        if not targets:
+            click.echo("Error: Provide a host with --host, --hosts or --inventory.")
+            return
+
+        if not key and not password:
+            click.echo("Error: Provide either a private key or a password for authentication.")
+            return
 
         # Format commands with parameters if provided
-        param_dict = {str(i + 1): param for i, param in enumerate(params)}
         try:
-            formatted_commands = [re.sub(
-                    r"\{(\d+)\}",
-                    lambda match: param_dict.get(match.group(1), f"{{{match.group(1)}}}"),
-                    cmd
-                ) for cmd in commands]
-        except KeyError as e:
-            click.echo(f"Error: Missing parameter for placeholder '{e.args[0]}'.")
+            steps = expand_steps(templates, bind_params(params, assignments))
+        except (StepError, TemplateError) as e:
+            click.echo(f"Error: {e}.")
             return
 
-        # Parse host and user
-        if "@" in host:
-            user, host = host.split("@", 1)
-        else:
-            user = "root"
+        HOOKS.load_plugins()
+        tracer = start_trace(trace) if trace else None
+        try:
+            if len(targets) == 1:
+                result = self._run_on_host(name, targets[0], steps, port, key, password, script,
+                                           prefix=None, broker=broker, timeout=timeout)
+                if result.error:
+                    click.echo(click.style(f"Error: Unable to connect or execute commands: {result.error}",
+                                           fg="red"))
+                echo_timing_summary(result.steps)
+                # Exit like a fan-out does, so scripts and CI see a failed or unreachable host
+                if not result.ok:
+                    raise SystemExit(1)
+                return
 
-        # Connect to the remote machine
+            self._fan_out(name, targets, steps, port, key, password, script, workers,
+                          broker=broker, timeout=timeout)
+        finally:
+            if tracer is not None:
+                HOOKS.unregister(tracer)
+
+    def _fan_out(self, name, targets, steps, port, key, password, script, workers, broker=None, timeout=None):
+        click.echo(f"Executing macro '{name}' on {len(targets)} hosts with {workers} workers...\n")
+        # The run on every host is part of one run across all of them
+        run = Run(name) if HOOKS.active else None
+        if run is not None:
+            HOOKS.emit("macro_start", run)
+        results = []
         try:
-            click.echo(f"Connecting to {user}@{host}:{port}...")
-            ssh = paramiko.SSHClient()
-            ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-            if key:
-                ssh.connect(hostname=host, port=port, username=user, key_filename=key)
-            elif password:
-                ssh.connect(hostname=host, port=port, username=user, password=password)
+            with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+                futures = [pool.submit(self._run_on_host, name, target, steps, port, key, password,
+                                       script, prefix=f"[{target}] ", broker=broker, parent=run, timeout=timeout)
+                           for target in targets]
+                for done, future in enumerate(as_completed(futures), start=1):
+                    result = future.result()
+                    results.append(result)
+                    status = click.style("ok", fg="green") if result.ok else click.style("FAILED", fg="red")
+                    _echo(f"({done}/{len(targets)}) {result.target}: {status} in {result.duration:.1f}s")
+        finally:
+            if run is not None:
+                failed = [result.target for result in results if not result.ok]
+                run.error = f"failed on {', '.join(sorted(failed))}" if failed else None
+                steps_run = [step for result in results for step in result.steps]
+                HOOKS.emit("macro_end", run, steps_run if len(results) == len(targets) else None)
+
+        self._print_summary(results)
+        if any(not result.ok for result in results):
+            raise SystemExit(1)
+
+    def _print_summary(self, results):
+        failed = [result for result in results if not result.ok]
+        click.echo(click.style(f"\n{len(results) - len(failed)} succeeded, {len(failed)} failed", bold=True))
+        if failed:
+            click.echo(click.style("\nFailed hosts:", fg="red"))
+            width = max(len(result.target) for result in failed)
+            for result in sorted(failed, key=lambda r: r.target):
+                click.echo(f"  {result.target.ljust(width)}  {result.failure}")
+
+        retried = [(result.target, step) for result in sorted(results, key=lambda r: r.target)
+                   for step in result.steps if step.attempts > 1]
+        if retried:
+            click.echo(click.style("\nRetried steps:", fg="yellow"))
+            width = max(len(target) for target, _ in retried)
+            for target, step in retried:
+                click.echo(f"  {target.ljust(width)}  step {step.step.index + 1}: {step.status} after "
+                           f"{step.attempts} attempts")
+
+        slowest = sorted(results, key=lambda r: r.duration, reverse=True)[:SLOWEST_HOSTS_SHOWN]
+        click.echo(click.style("\nSlowest hosts:", fg="blue"))
+        width = max(len(result.target) for result in slowest)
+        for result in slowest:
+            click.echo(f"  {result.target.ljust(width)}  {result.duration:.1f}s")
+
+    def _run_on_host(self, name, target, steps, port, key, password, script, prefix, broker=None,
+                     parent=None, timeout=None):
+        """Connect to one host (or reuse the broker's connection) and run every command, returning a HostResult."""
+        result = HostResult(target)
+        started = time.monotonic()
+        deadline = Deadline(timeout) if timeout else None
+        events = _HostEvents(Run(name, target, parent)) if HOOKS.active else None
+        tap = events.output if events is not None else None
+        if events is not None:
+            HOOKS.emit("macro_start", events.run)
+
+        def output(text, **style):
+            if prefix is None:
+                click.echo(click.style(text, **style) if style else text)
             else:
-                click.echo("Error: Provide either a private key or a password for authentication.")
-                return
+                for line in text.splitlines():
+                    _echo(prefix + (click.style(line, **style) if style else line))
+
+        # Connect to the remote machine
+        connection = None
+        try:
+            # A malformed target fails this host only, not the hosts running alongside it
+            user, host, port = _parse_target(target, port)
+            if prefix is None:
+                click.echo(f"Connecting to {user}@{host}:{port}...")
+            connection = open_connection(user, host, port, key, password, broker)
 
             # Execute commands remotely
-            click.echo(f"Executing macro '{name}' on {host}:\n")
-            for cmd in formatted_commands:
-                click.echo(click.style(f"→ {cmd}", fg="green"))
-                stdin, stdout, stderr = ssh.exec_command(cmd)
-                output = stdout.read().decode("utf-8")
-                error = stderr.read().decode("utf-8")
-                if output:
-                    click.echo(output)
-                if error:
-                    click.echo(click.style(f"Error: {error}", fg="red"))
-
-            ssh.close()
+            if prefix is None:
+                click.echo(f"Executing macro '{name}' on {host}:\n")
+            if script:
+                result.steps, result.exit_codes = self._run_script(connection, steps, prefix, output, events,
+                                                                   deadline)
+            else:
+                for step in steps:
+                    if deadline is not None and deadline.expired:
+                        # The rest did not run
+                        result.exit_codes += [None] * (len(steps) - step.index)
+                        break
+                    output(f"→ {step.command}", fg="green")
+                    if events is not None:
+                        events.step_start(step)
+                    step_result = self._run_step(connection, step, deadline, prefix, output, tap)
+                    result.exit_codes.append(step_result.returncode)
+                    result.steps.append(step_result)
+                    if events is not None:
+                        events.step_end(step_result)
+                    if prefix is None:
+                        click.echo("")
         except Exception as e:
-            click.echo(click.style(f"Error: Unable to connect or execute commands: {e}", fg="red"))
+            result.error = str(e) or type(e).__name__
+        finally:
+            if connection is not None:
+                connection.close()
+            result.duration = time.monotonic() - started
+            if events is not None:
+                events.run.error = result.error
+                HOOKS.emit("macro_end", events.run, events.results)
+        return result
+
+    def _run_step(self, connection, step, deadline, prefix, output, tap):
+        """Run one step over a channel of its own, retrying as its annotation asks, and return its StepResult."""
+        started = time.monotonic()
+        attempts = 1
+        while True:
+            limit = step_limit(step, deadline)
+            attempt_started = time.monotonic()
+            channel = connection.open_channel(_time_limited(step.command, limit))
+            channel.shutdown_write()
+            # The host gets to stop the step itself first; the channel is only abandoned if it does not
+            expires = None if limit is None else attempt_started + limit + KILL_GRACE + 1
+            exit_code = _stream_channel(channel, _OutputWriter(prefix, err=False, tap=tap),
+                                        _OutputWriter(prefix, err=True, tap=tap), lambda: expires)
+            channel.close()
+            timed_out = limit is not None and (exit_code is None or (
+                exit_code in REMOTE_TIMEOUT_STATUSES and time.monotonic() - attempt_started >= limit))
+            if timed_out:
+                output(f"timed out after {format_duration(limit)}", fg="red")
+                exit_code = TIMEOUT_STATUS
+            delay = None if exit_code == 0 else retry_delay(step, attempts, deadline)
+            if delay is None:
+                break
+            attempts += 1
+            output(f"↻ retrying in {delay:.1f}s (attempt {attempts} of {step.retries + 1})", fg="yellow")
+            time.sleep(delay)
+        status = "timeout" if timed_out else "ok" if exit_code == 0 else "failed"
+        return StepResult(step, status, exit_code, time.monotonic() - started, attempts=attempts)
+
+    def _run_script(self, connection, steps, prefix, output, events=None, deadline=None):
+        """Run all steps in one remote shell over a single channel, returning their StepResults and exit codes.
+
+        Steps are not retried here. A step's timeout is kept by closing the channel, which
+        ends the whole script; the deadline is also kept by the host, as for single steps.
+        """
+        token = f"__termo_{secrets.token_hex(8)}__"
+        exit_codes = [None] * len(steps)
+        results = []
+        tap = events.output if events is not None else None
+        step_started = time.monotonic()
+
+        def start(index):
+            nonlocal step_started
+            step_started = time.monotonic()
+            output(f"→ {steps[index].command}", fg="green")
+            if events is not None:
+                events.step_start(steps[index])
+
+        def end(index, status, outcome=None):
+            exit_codes[index] = status
+            result = StepResult(steps[index], outcome or ("ok" if status == 0 else "failed"), status,
+                                time.monotonic() - step_started)
+            results.append(result)
+            if events is not None:
+                events.step_end(result)
+
+        def on_step_done(index, status):
+            end(index, status)
+            if prefix is None:
+                click.echo("")
+            if index + 1 < len(steps):
+                start(index + 1)
+
+        def expires():
+            limits = []
+            running = steps[len(results)] if len(results) < len(steps) else None
+            if running is not None and running.timeout is not None:
+                limits.append(step_started + running.timeout)
+            if deadline is not None:
+                limits.append(deadline.expires + KILL_GRACE + 1)
+            return min(limits) if limits else None
+
+        if steps:
+            start(0)
+        channel = connection.open_channel(_time_limited("sh -s", deadline.remaining() if deadline else None))
+        status = _stream_channel(channel,
+                                 _MarkerParser(_OutputWriter(prefix, err=False, tap=tap), token, on_step_done),
+                                 _OutputWriter(prefix, err=True, tap=tap), expires,
+                                 stdin=_build_script([step.command for step in steps], token).encode())
+        channel.close()
+        # A step that ended the shell leaves no marker; the shell's own status is its status
+        if None in exit_codes:
+            index = exit_codes.index(None)
+            if status is None or (deadline is not None and deadline.expired):
+                output(f"timed out after {format_duration(time.monotonic() - step_started)}", fg="red")
+                end(index, TIMEOUT_STATUS, "timeout")
+            else:
+                end(index, status)
+        return results, exit_codes
@@ -0,0 +1,45 @@
+import click
+
+from app.commands.base_command import Command
+from app.utils.click_utils import VersionType, echo_diff
+from app.utils.composition import CompositionError
+from app.utils.config_utils import get_store
+
+
+class RollbackCommand(Command):
+    def __init__(self):
+        super().__init__(name="rollback",
+                         help_text="Restore an earlier version of a macro, by default the previous one. "
+                                   "The restored version is saved as a new one, so it can be undone too",
+                         arguments=[click.Argument(["name"]),
+                                    click.Argument(["version"], type=VersionType(), required=False)])
+
+    def execute(self, name, version):
+        store = get_store()
+        latest = store.versions(name, 2)
+        if not latest:
+            click.echo(f"No history recorded for '{name}'")
+            return
+        current = latest[-1]
+        if version is None:
+            if len(latest) < 2:
+                click.echo(f"Macro '{name}' has no earlier version")
+                return
+            version = latest[0].number
+
+        commands = store.get_version(name, version)
+        if commands is None:
+            reason = "deleted the macro" if 0 < version < current.number else "does not exist"
+            click.echo(click.style(f"Error: Version v{version} of '{name}' {reason}", fg='red'))
+            return
+        if commands == current.commands:
+            click.echo(f"Macro '{name}' is already the same as v{version}")
+            return
+
+        try:
+            store.rollback(name, version)
+        except CompositionError as e:
+            click.echo(click.style(f"Error: {e}. The macro was not changed.", fg='red'))
+            return
+        echo_diff(current.commands or [], commands, indent="    ")
+        click.echo(f"Macro '{name}' rolled back to v{version}, saved as v{current.number + 1}.")
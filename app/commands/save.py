@@ -1,31 +1,58 @@
 import click
 
 from app.commands.base_command import Command
+from app.utils.click_utils import get_param
+from app.utils.composition import CompositionError
 from app.utils.config_utils import (load_head,
                                     get_macro_commands_from_history,
-                                    load_macros,
-                                    save_macros,
+                                    get_store,
                                     clear_head)
+from app.utils.shell_hooks import clear_journal, current_session, read_journal
 
 
 class SaveCommand(Command):
     def __init__(self):
         super().__init__(name="save",
-                         help_text="Finish the current recording and save the macro")
+                         help_text="Finish the current recording and save the macro",
+                         arguments=[get_param(["--drop-failed", "-f"], True,
+                                              "Leave out commands that exited with an error. "
+                                              "Needs the shell hooks from `tm hook`")])
 
-    def execute(self):
+    def execute(self, drop_failed):
         recording_macro = load_head()
         if not recording_macro:
             click.echo("No macro recording in progress.")
             return
 
-        commands = get_macro_commands_from_history(recording_macro)
+        session = current_session()
+        if session:
+            # The shell hooks journaled every command as it ran, so the history is not needed
+            entries = read_journal(session)
+            failed = [entry for entry in entries if entry.failed]
+            if drop_failed:
+                entries = [entry for entry in entries if not entry.failed]
+            commands = [entry.command for entry in entries]
+            clear_journal(session)
+        else:
+            if drop_failed:
+                click.echo(click.style("Exit codes are only known with the shell hooks loaded "
+                                       "(see `tm hook`); keeping all commands.", fg="yellow"))
+            failed = []
+            commands = get_macro_commands_from_history(recording_macro)
+
         if commands:
             macro_commands = [line.strip() for line in commands]
-            macros = load_macros()
-            macros[recording_macro] = macro_commands
-            save_macros(macros)
+            try:
+                get_store().put(recording_macro, macro_commands)
+            except CompositionError as e:
+                # The recording is kept, so the macro can be saved again once the problem is fixed
+                click.echo(click.style(f"Error: {e}", fg='red'))
+                return
             click.echo(f"Macro '{recording_macro}' saved.")
+            if failed:
+                verb = "Dropped" if drop_failed else "Kept"
+                click.echo(click.style(f"{verb} {len(failed)} failed command(s): "
+                                       + ", ".join(entry.command for entry in failed), fg="yellow"))
         else:
             click.echo("No commands were recorded.")
 
@@ -0,0 +1,112 @@
+from collections import defaultdict
+
+import click
+
+from app.commands.base_command import Command
+from app.utils.telemetry import percentile, read_runs
+
+RECENT_RUNS = 5
+# Recent runs are flagged when their median is this much slower than the earlier runs
+REGRESSION_RATIO = 1.25
+REGRESSION_MIN_SECONDS = 0.05
+
+
+def _regressed(walls):
+    if len(walls) < 2 * RECENT_RUNS:
+        return False
+    baseline = percentile(walls[:-RECENT_RUNS], 0.5)
+    recent = percentile(walls[-RECENT_RUNS:], 0.5)
+    return recent > baseline * REGRESSION_RATIO and recent - baseline > REGRESSION_MIN_SECONDS
+
+
+def _seconds(value):
+    if value is None:
+        return "-"
+    return f"{value * 1000:.0f}ms" if value < 1 else f"{value:.2f}s"
+
+
+def _width(column):
+    # Styled columns are as wide as their text, not their escape codes
+    return len(click.unstyle(str(column)))
+
+
+def _row(columns, widths):
+    return "  ".join(str(column) + " " * (width - _width(column)) for column, width in zip(columns, widths))
+
+
+def _table(header, rows):
+    widths = [max(_width(row[i]) for row in [header] + rows) for i in range(len(header))]
+    click.echo(click.style(_row(header, widths), bold=True))
+    for row in rows:
+        click.echo(_row(row, widths))
+
+
+class StatsCommand(Command):
+    def __init__(self):
+        super().__init__(name="stats",
+                         help_text="Show run time statistics for all macros or per step of one macro",
+                         arguments=[click.Argument(["name"], required=False)])
+
+    def execute(self, name):
+        if name:
+            self._macro_stats(name)
+        else:
+            self._overview()
+
+    def _overview(self):
+        walls = defaultdict(list)
+        failures = defaultdict(int)
+        for run in read_runs():
+            walls[run["m"]].append(run["w"])
+            if any(step[2] not in (0, None) for step in run["s"]):
+                failures[run["m"]] += 1
+
+        if not walls:
+            click.echo(click.style("No runs were recorded yet", fg='blue'))
+            return
+
+        rows = []
+        for macro, values in sorted(walls.items()):
+            flag = click.style("slower", fg="red") if _regressed(values) else ""
+            rows.append([macro, len(values), failures[macro], _seconds(percentile(values, 0.5)),
+                         _seconds(percentile(values, 0.95)), _seconds(max(values)), flag])
+        _table(["macro", "runs", "failed", "p50", "p95", "max", ""], rows)
+        click.echo(click.style(f"\nNOTE: use `tm stats <macro name>` to see per step timings", fg='blue'))
+
+    def _macro_stats(self, name):
+        walls = defaultdict(list)
+        cpu = defaultdict(list)
+        commands = {}
+        failures = defaultdict(int)
+        last_run = None
+        for run in read_runs(name):
+            if run["m"] != name:
+                continue
+            last_run = run
+            for step_id, wall, returncode, utime, stime, command in run["s"]:
+                walls[step_id].append(wall)
+                commands[step_id] = command
+                if utime is not None:
+                    cpu[step_id].append(utime + stime)
+                if returncode not in (0, None):
+                    failures[step_id] += 1
+
+        if last_run is None:
+            click.echo(f"No runs were recorded for the macro '{name}'")
+            return
+
+        rows = []
+        for step_id, values in walls.items():
+            average_cpu = sum(cpu[step_id]) / len(cpu[step_id]) if cpu[step_id] else None
+            flag = click.style("slower", fg="red") if _regressed(values) else ""
+            rows.append([step_id, len(values), failures[step_id], _seconds(percentile(values, 0.5)),
+                         _seconds(percentile(values, 0.95)), _seconds(max(values)), _seconds(average_cpu),
+                         commands[step_id], flag])
+        click.echo(click.style(f"Step timings for macro '{name}':", fg='blue'))
+        _table(["step", "runs", "failed", "p50", "p95", "max", "cpu", "command", ""], rows)
+
+        usage = last_run["r"]
+        click.echo(f"\nLast run: {_seconds(last_run['w'])} wall, "
+                   f"{_seconds(usage['utime'])} user, {_seconds(usage['stime'])} sys, "
+                   f"max RSS {usage['maxrss_kb'] // 1024} MB, "
+                   f"{usage['inblock']} blocks in, {usage['oublock']} blocks out")
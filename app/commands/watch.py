@@ -0,0 +1,210 @@
+import fnmatch
+import os
+import select
+import signal
+import sys
+import time
+import traceback
+
+import click
+
+from app.commands.base_command import Command
+from app.commands.exec import run_steps
+from app.utils.composition import CompositionError
+from app.utils.config_utils import get_store
+from app.utils.fs_watch import DEFAULT_IGNORE, create_watcher
+from app.utils.steps import Step, StepError, expand_steps
+from app.utils.templates import TemplateError, bind_params
+
+# How often to check on a running macro, and to poll for changes without inotify
+CHECK_INTERVAL = 0.1
+POLL_INTERVAL = 1.0
+# A cancelled run gets this long to exit after SIGTERM before it is killed
+CANCEL_GRACE = 2.0
+CHANGES_SHOWN = 3
+
+
+def input_matches(pattern, path, cwd):
+    """True if a changed path falls under an `inputs=` glob or directory (relative to cwd)."""
+    pattern = os.path.normpath(os.path.expanduser(pattern))
+    if not os.path.isabs(pattern):
+        path = os.path.relpath(path, cwd)
+    return (fnmatch.fnmatch(path, pattern)
+            or fnmatch.fnmatch(path, pattern.replace("**" + os.sep, ""))
+            or path.startswith(pattern.rstrip(os.sep) + os.sep))
+
+
+def affected_steps(steps, changed, cwd):
+    """Return the steps to re-run for the changed paths, renumbered to run on their own.
+
+    A step runs if one of its inputs changed, if it declares no inputs (it may read
+    anything), or if it depends on a step that runs. A changed directory, which is also
+    how lost events are reported, re-runs everything.
+    """
+    if any(os.path.isdir(path) for path in changed):
+        return steps
+    selected = {step.id for step in steps
+                if "inputs" not in step.options
+                or any(input_matches(pattern, path, cwd) for pattern in step.options["inputs"] for path in changed)}
+    grew = True
+    while grew:
+        grew = False
+        for step in steps:
+            if step.id not in selected and selected.intersection(step.deps):
+                selected.add(step.id)
+                grew = True
+
+    subset = []
+    for step in steps:
+        if step.id in selected:
+            copy = Step(len(subset), step.command, {**step.options, "id": step.id})
+            copy.deps = [dep for dep in step.deps if dep in selected]
+            subset.append(copy)
+    return subset
+
+
+def _start_run(name, steps, jobs, no_cache):
+    """Run the steps in a child process of its own group, so a newer change can kill all of it."""
+    sys.stdout.flush()
+    sys.stderr.flush()
+    pid = os.fork()
+    if pid == 0:
+        code = 1
+        try:
+            os.setpgid(0, 0)
+            for signum in (signal.SIGTERM, signal.SIGHUP):
+                signal.signal(signum, signal.SIG_DFL)
+            # Only the foreground process group may read the terminal
+            devnull = os.open(os.devnull, os.O_RDONLY)
+            os.dup2(devnull, 0)
+            os.close(devnull)
+            results = run_steps(name, steps, jobs=jobs, no_cache=no_cache)
+            code = 0 if all(result.succeeded for result in results) else 1
+        except BaseException:
+            traceback.print_exc()
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os._exit(code)
+    try:
+        os.setpgid(pid, pid)
+    except OSError:
+        pass
+    return pid
+
+
+def _cancel_run(pid):
+    for signum in (signal.SIGTERM, signal.SIGKILL):
+        try:
+            os.killpg(pid, signum)
+        except ProcessLookupError:
+            pass
+        deadline = time.monotonic() + CANCEL_GRACE
+        while time.monotonic() < deadline:
+            if os.waitpid(pid, os.WNOHANG)[0]:
+                return
+            time.sleep(0.02)
+    os.waitpid(pid, 0)
+
+
+def _report(code, wall):
+    if code == 0:
+        click.echo(click.style(f"\nRun finished in {wall:.1f}s, watching for changes", fg='green'))
+    else:
+        click.echo(click.style(f"\nRun failed after {wall:.1f}s, watching for changes", fg='red'))
+
+
+class WatchCommand(Command):
+    def __init__(self):
+        super().__init__(name="watch",
+                         help_text="Run a macro, then run it again whenever files under the watched paths "
+                                   "change. A change during a run cancels it and starts over",
+                         arguments=[click.Argument(["name"]),
+                                    click.Argument(["params"], nargs=-1),
+                                    click.Option(["--path", "-p", "paths"], multiple=True, default=["."],
+                                                 show_default=True, help="File or directory tree to watch; "
+                                                                         "repeat for several"),
+                                    click.Option(["--set", "-S", "assignments"], multiple=True,
+                                                 help="Set a named parameter, as name=value"),
+                                    click.Option(["--affected"], is_flag=True,
+                                                 help="Only re-run steps whose inputs= match the changed "
+                                                      "files, and the steps after them"),
+                                    click.Option(["--debounce"], default=200, type=int, show_default=True,
+                                                 help="Milliseconds without changes to wait before running"),
+                                    click.Option(["--ignore", "-x"], multiple=True,
+                                                 help=f"File or directory name pattern to ignore, in addition "
+                                                      f"to {', '.join(DEFAULT_IGNORE)}"),
+                                    click.Option(["--jobs", "-j"], default=1, type=int,
+                                                 help="Run independent steps in parallel, up to N at a time"),
+                                    click.Option(["--no-cache"], is_flag=True,
+                                                 help="Run every step even if its cached outputs are up to date")])
+
+    def execute(self, name, params, paths, assignments, affected, debounce, ignore, jobs, no_cache):
+        try:
+            templates = get_store().get_templates(name)
+        except CompositionError as e:
+            click.echo(click.style(f"Error: {e}", fg='red'))
+            return
+        if templates is None:
+            click.echo(f"No macro found with the name '{name}'")
+            return
+        try:
+            steps = expand_steps(templates, bind_params(params, assignments))
+        except (StepError, TemplateError) as e:
+            click.echo(click.style(f"Error: {e}", fg='red'))
+            return
+
+        missing = [path for path in paths if not os.path.exists(path)]
+        if missing:
+            click.echo(click.style(f"Error: No such file or directory: {', '.join(missing)}", fg='red'))
+            return
+
+        cwd = os.getcwd()
+        # Files the macro writes itself must not trigger the next run
+        outputs = [pattern for step in steps for pattern in step.options.get("outputs", [])]
+        watcher = create_watcher([os.path.abspath(path) for path in paths], recursive=True,
+                                 ignore=DEFAULT_IGNORE + list(ignore))
+        click.echo(click.style(f"Watching {', '.join(paths)} for changes, press Ctrl-C to stop", fg='blue'))
+
+        # Being terminated (or losing the terminal) must still stop the current run
+        for signum in (signal.SIGTERM, signal.SIGHUP):
+            signal.signal(signum, lambda signum, frame: sys.exit(128 + signum))
+        run, run_started = _start_run(name, steps, jobs, no_cache), time.monotonic()
+        pending, last_change = set(), 0.0
+        try:
+            while True:
+                if watcher.fileno() is not None:
+                    select.select([watcher], [], [], CHECK_INTERVAL)
+                else:
+                    time.sleep(POLL_INTERVAL)
+                changed = {path for path in watcher.changes()
+                           if not any(input_matches(pattern, path, cwd) for pattern in outputs)}
+                if changed:
+                    pending |= changed
+                    last_change = time.monotonic()
+
+                if run is not None:
+                    done, wait_status = os.waitpid(run, os.WNOHANG)
+                    if done:
+                        _report(os.waitstatus_to_exitcode(wait_status), time.monotonic() - run_started)
+                        run = None
+
+                if pending and time.monotonic() - last_change >= debounce / 1000:
+                    if run is not None:
+                        click.echo(click.style("\nChange detected, cancelling the current run", fg='yellow'))
+                        _cancel_run(run)
+                    selected = affected_steps(steps, pending, cwd) if affected else steps
+                    shown = sorted(os.path.relpath(path, cwd) for path in pending)[:CHANGES_SHOWN]
+                    more = f" and {len(pending) - CHANGES_SHOWN} more" if len(pending) > CHANGES_SHOWN else ""
+                    click.echo(click.style(f"\nChanged: {', '.join(shown)}{more}", fg='blue'))
+                    pending = set()
+                    if selected:
+                        run, run_started = _start_run(name, selected, jobs, no_cache), time.monotonic()
+                    else:
+                        click.echo(click.style("No steps affected", fg='blue'))
+        except KeyboardInterrupt:
+            pass
+        finally:
+            if run is not None:
+                _cancel_run(run)
+            watcher.close()
@@ -0,0 +1,215 @@
+"""The resident termo daemon, started with `tm daemon start`.
+
+It imports every command and loads the macro store (with its compiled templates and
+search index) once, then forks a child per request from `app.client`. The child takes
+over the caller's stdin, stdout and stderr, working directory and environment and runs
+the command exactly as `tm` would. The daemon exits after being idle for a while.
+"""
+import json
+import os
+import select
+import signal
+import socket
+import sys
+import time
+import traceback
+
+from app.client import DAEMON_SOCKET, HEADER, REPLY
+from app.utils.config_utils import MACRO_DB_FILE, MACRO_DIR
+from app.utils.env_utils import env_number
+from app.utils.fs_watch import create_watcher
+
+DAEMON_PID_FILE = MACRO_DIR / "daemon.pid"
+DAEMON_LOG_FILE = MACRO_DIR / "daemon.log"
+IDLE_TIMEOUT = env_number("TERMO_DAEMON_IDLE", 30 * 60)
+MAX_REQUEST_BYTES = 16 * 1024 * 1024
+# Requests are read before forking, so a client that stalls must not hold up the others
+REQUEST_TIMEOUT = 5
+STORE_FILES = {str(MACRO_DB_FILE), f"{MACRO_DB_FILE}-wal"}
+
+
+def read_pid():
+    """Return the pid of the running daemon, or None."""
+    try:
+        pid = int(DAEMON_PID_FILE.read_text().strip())
+        os.kill(pid, 0)
+        return pid
+    except (OSError, ValueError):
+        return None
+
+
+def _receive_request(connection):
+    data, fds, _, _ = socket.recv_fds(connection, 64 * 1024, 3)
+    try:
+        if len(data) < HEADER.size:
+            raise ValueError("Truncated request")
+        length = HEADER.unpack_from(data)[0]
+        if length > MAX_REQUEST_BYTES:
+            raise ValueError("Request too large")
+        data = data[HEADER.size:]
+        while len(data) < length:
+            chunk = connection.recv(length - len(data))
+            if not chunk:
+                raise ValueError("Truncated request")
+            data += chunk
+        return json.loads(data), fds
+    except BaseException:
+        for fd in fds:
+            os.close(fd)
+        raise
+
+
+def _reopen_stdio():
+    """Point sys.stdin/stdout/stderr at the caller's file descriptors 0, 1 and 2."""
+    sys.stdin = open(0, "r", closefd=False)
+    sys.stdout = open(1, "w", buffering=1 if os.isatty(1) else -1, closefd=False)
+    sys.stderr = open(2, "w", buffering=1, closefd=False)
+
+
+def _run_request(connection, request, fds):
+    """Runs in the forked child: become the caller and run the CLI."""
+    from app.cli import cli
+
+    # A process group of our own lets the client relay Ctrl-C to every step we start
+    os.setpgid(0, 0)
+    for target, fd in enumerate(fds):
+        os.dup2(fd, target)
+        os.close(fd)
+    _reopen_stdio()
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+    os.environ.clear()
+    os.environ.update(request["env"])
+    code = 1
+    try:
+        os.chdir(request["cwd"])
+        connection.sendall(REPLY.pack(b"P", os.getpid()))
+        cli.main(args=request["argv"], prog_name="tm")
+        code = 0
+    except SystemExit as e:
+        code = e.code if isinstance(e.code, int) else (0 if e.code is None else 1)
+    except BaseException:
+        traceback.print_exc()
+    finally:
+        for stream in (sys.stdout, sys.stderr):
+            try:
+                stream.flush()
+            except OSError:
+                pass
+        try:
+            connection.sendall(REPLY.pack(b"X", code))
+        except OSError:
+            pass
+        os._exit(0)
+
+
+class Daemon:
+    def __init__(self, idle_timeout=IDLE_TIMEOUT):
+        self.idle_timeout = idle_timeout
+        self.children = set()
+        self.last_active = time.monotonic()
+        self.running = True
+
+    def _preload(self):
+        from app.cli import load_all_commands
+        from app.utils import config_utils
+        from app.utils.macro_store import SnapshotMacroStore
+
+        load_all_commands()
+        # The JSON backend has no snapshot support; it is read from disk on every request
+        self.store = None
+        if os.environ.get("TERMO_STORE") != "json":
+            # Opening the regular store first creates or migrates the database if needed
+            config_utils.get_store().close()
+            self.store = SnapshotMacroStore(MACRO_DB_FILE)
+            self.store.on_change = config_utils.refresh_completion_cache
+            config_utils.set_store(self.store)
+
+    def _listen(self):
+        if os.path.exists(DAEMON_SOCKET):
+            os.unlink(DAEMON_SOCKET)
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        # Only the owner may talk to the daemon: it runs commands as them
+        previous_umask = os.umask(0o077)
+        try:
+            listener.bind(DAEMON_SOCKET)
+        finally:
+            os.umask(previous_umask)
+        listener.listen(64)
+        return listener
+
+    def _stop(self, signum, frame):
+        self.running = False
+
+    def _reap(self):
+        for pid in list(self.children):
+            try:
+                done, _ = os.waitpid(pid, os.WNOHANG)
+            except ChildProcessError:
+                done = pid
+            if done:
+                self.children.discard(pid)
+                self.last_active = time.monotonic()
+
+    def _refresh_store(self):
+        """Reload the snapshot early, off the request path, when the store files change."""
+        if self.store is not None and self.watcher.changes() & STORE_FILES:
+            self.store.refresh()
+
+    def _handle(self, listener):
+        connection, _ = listener.accept()
+        connection.settimeout(REQUEST_TIMEOUT)
+        try:
+            request, fds = _receive_request(connection)
+            connection.settimeout(None)
+        except (OSError, ValueError) as e:
+            print(f"Bad request: {e}", file=sys.stderr)
+            connection.close()
+            return
+        # An event can arrive before the write it reports has committed, so check the
+        # database itself (a single cheap pragma) before every fork
+        if self.store is not None:
+            self.store.refresh()
+        pid = os.fork()
+        if pid == 0:
+            listener.close()
+            _run_request(connection, request, fds)
+        for fd in fds:
+            os.close(fd)
+        connection.close()
+        self.children.add(pid)
+        self.last_active = time.monotonic()
+
+    def serve(self):
+        self._preload()
+        self.watcher = create_watcher([MACRO_DIR])
+        listener = self._listen()
+        DAEMON_PID_FILE.write_text(str(os.getpid()))
+        signal.signal(signal.SIGTERM, self._stop)
+        signal.signal(signal.SIGINT, self._stop)
+        # Wakes select() when a child exits so it is reaped promptly
+        signal.signal(signal.SIGCHLD, lambda signum, frame: None)
+        try:
+            while self.running:
+                readable = [listener] + ([self.watcher] if self.watcher.fileno() is not None else [])
+                try:
+                    ready, _, _ = select.select(readable, [], [], 1.0)
+                except InterruptedError:
+                    ready = []
+                self._reap()
+                if self.watcher in ready or self.watcher.fileno() is None:
+                    self._refresh_store()
+                if listener in ready:
+                    self._handle(listener)
+                if not self.children and time.monotonic() - self.last_active > self.idle_timeout:
+                    break
+        finally:
+            listener.close()
+            if os.path.exists(DAEMON_SOCKET):
+                os.unlink(DAEMON_SOCKET)
+            DAEMON_PID_FILE.unlink(missing_ok=True)
+            self.watcher.close()
+
+
+if __name__ == "__main__":
+    Daemon().serve()
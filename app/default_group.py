@@ -1,3 +1,5 @@
+import importlib
+
 import click
 
 class DefaultGroup(click.Group):
@@ -8,6 +10,8 @@ class DefaultGroup(click.Group):
         self.ignore_unknown_options = True
         self.default_cmd_name = kwargs.pop('default', None)
         self.default_if_no_args = kwargs.pop('default_if_no_args', False)
+        # Maps command name to "module:ClassName", imported only when the command is used
+        self.lazy_commands = kwargs.pop('lazy_commands', {})
         super(DefaultGroup, self).__init__(*args, **kwargs)
 
     def set_default_command(self, command):
@@ -21,10 +25,21 @@ class DefaultGroup(click.Group):
             args.insert(0, self.default_cmd_name)
         return super(DefaultGroup, self).parse_args(ctx, args)
 
+    def list_commands(self, ctx):
+        return sorted(set(self.commands) | set(self.lazy_commands))
+
+    def _load_lazy_command(self, cmd_name):
+        module_name, class_name = self.lazy_commands[cmd_name].split(":")
+        command = getattr(importlib.import_module(module_name), class_name)()
+        self.add_command(command, cmd_name)
+        return command
+
     def get_command(self, ctx, cmd_name):
-        if cmd_name not in self.commands:
+        if cmd_name not in self.commands and cmd_name not in self.lazy_commands:
             ctx.arg0 = cmd_name
             cmd_name = self.default_cmd_name
+        if cmd_name not in self.commands and cmd_name in self.lazy_commands:
+            return self._load_lazy_command(cmd_name)
         return super(DefaultGroup, self).get_command(ctx, cmd_name)
 
     def resolve_command(self, ctx, args):
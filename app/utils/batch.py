@@ -0,0 +1,287 @@
+import itertools
+import os
+import re
+import select
+import shlex
+import shutil
+import signal
+import subprocess
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import click
+
+from app.utils.config_utils import MACRO_DIR
+from app.utils.shell_session import default_shell
+from app.utils.steps import StepError, expand_steps, run_order
+from app.utils.templates import TemplateError, bind_params
+from app.utils.timeouts import TIMEOUT_STATUS, format_duration, retry_delay, signal_group, stop_group
+
+BATCH_LOG_DIR = MACRO_DIR / "logs"
+BATCH_LOGS_KEPT = 20
+SLOWEST_ROWS_SHOWN = 5
+# Tokens of a row that set a named (or numbered) parameter rather than the next positional one
+ASSIGNMENT_PATTERN = re.compile(r"^(?:[A-Za-z_]\w*|\d+)=")
+
+
+class BatchRow:
+    """One parameter set of a batch: positional params and name=value assignments."""
+
+    def __init__(self, index, params=(), assignments=(), error=None):
+        self.index = index
+        self.params = list(params)
+        self.assignments = list(assignments)
+        # Set when the row's line could not be parsed; the row then fails without running
+        self.error = error
+
+    @property
+    def label(self):
+        return " ".join(shlex.quote(token) for token in self.params + self.assignments) or "(no params)"
+
+
+class RowResult:
+    def __init__(self, row, log_path):
+        self.row = row
+        self.log_path = log_path
+        self.returncode = None
+        self.error = None
+        self.duration = 0.0
+        # The time limit the row ran out of, if it did
+        self.timed_out = None
+
+    @property
+    def ok(self):
+        return self.error is None and self.returncode == 0
+
+    @property
+    def failure(self):
+        if self.timed_out is not None:
+            return f"timed out after {format_duration(self.timed_out)}"
+        return self.error or f"exited with status {self.returncode}"
+
+
+def parse_row(line):
+    """Split a row like `api region=eu` into positional params and assignments, or None if blank."""
+    tokens = shlex.split(line, comments=True)
+    if not tokens:
+        return None
+    params = [token for token in tokens if not ASSIGNMENT_PATTERN.match(token)]
+    assignments = [token for token in tokens if ASSIGNMENT_PATTERN.match(token)]
+    return params, assignments
+
+
+def parse_matrix(specs):
+    """Turn `name=v1,v2` specs into a list of (name, values) axes."""
+    axes = []
+    for spec in specs:
+        name, separator, values = spec.partition("=")
+        if not separator or not name or not values:
+            raise TemplateError(f"Expected name=value1,value2,... for --matrix, got '{spec}'")
+        axes.append((name, values.split(",")))
+    return axes
+
+
+def _each_rows(each):
+    if each is None:
+        yield [], [], None
+        return
+    for number, line in enumerate(each, start=1):
+        try:
+            parsed = parse_row(line)
+        except ValueError as e:
+            yield [line.strip()], [], f"line {number}: {e}"
+            continue
+        if parsed is not None:
+            yield parsed + (None,)
+
+
+def generate_rows(each=None, matrix=()):
+    """Yield BatchRows: every line of `each` (if given) crossed with every matrix combination.
+
+    The file is read lazily, so rows can be streamed from another command's output.
+    """
+    axes = parse_matrix(matrix)
+    names = [name for name, _ in axes]
+    combinations = [[f"{name}={value}" for name, value in zip(names, values)]
+                    for values in itertools.product(*(values for _, values in axes))]
+    index = itertools.count(1)
+    for params, assignments, error in _each_rows(each):
+        for combination in combinations:
+            yield BatchRow(next(index), params, assignments + combination, error)
+
+
+def row_script(steps, status_fd):
+    """One shell script for a row: every step runs in the same shell, like `tm exec` does.
+
+    Steps are retried as their annotations ask, and skipped when a step they need did not
+    succeed; the script exits with the status of the last step that failed. Before every
+    attempt it writes `start <n>` to status_fd, for the runner to time the nth step by.
+    """
+    position = {step.id: number for number, step in enumerate(steps)}
+    lines = ["__termo_status=0"]
+    for number, step in enumerate(steps):
+        attempt = (f"printf 'start {number}\\n' >&{status_fd}\n"
+                   f"{{ eval {shlex.quote(step.command)} {status_fd}>&-\n}}\n"
+                   f"__termo_step=$?")
+        body = [f"printf '→ %s\\n' {shlex.quote(step.command)}", attempt]
+        # The random share of each delay is drawn per row, as the script is written
+        for retry in range(1, step.retries + 1):
+            delay = retry_delay(step, retry)
+            body.append(f"if [ $__termo_step -ne 0 ]; then\n"
+                        f"printf '↻ retrying in {delay:.1f}s (attempt {retry + 1} of {step.retries + 1})\\n'\n"
+                        f"sleep {delay:.3f}\n{attempt}\nfi")
+        body.append(f"[ $__termo_step -eq 0 ] || {{ __termo_status=$__termo_step; printf '[termo] step %s "
+                    f"exited with status %d\\n' {shlex.quote(step.id)} \"$__termo_status\"; }}")
+        body.append(f"__termo_ok_{number}=$__termo_step")
+        if step.deps:
+            needed = "".join(f"$__termo_ok_{position[dep]}" for dep in step.deps)
+            lines.append(f"if [ \"{needed}\" = {'0' * len(step.deps)} ]; then")
+            lines.extend(body)
+            lines.append(f"else\n__termo_ok_{number}=skipped\n"
+                         f"printf '[termo] step %s skipped\\n' {shlex.quote(step.id)}\nfi")
+        else:
+            lines.extend(body)
+    lines.append("exit $__termo_status")
+    return "\n".join(lines) + "\n"
+
+
+def _prune_logs():
+    runs = sorted((path for path in BATCH_LOG_DIR.iterdir() if path.is_dir()),
+                  key=lambda path: path.stat().st_mtime, reverse=True)
+    for path in runs[BATCH_LOGS_KEPT:]:
+        shutil.rmtree(path, ignore_errors=True)
+
+
+class BatchRunner:
+    """Run a macro once per parameter row, up to `jobs` rows at a time.
+
+    Each row runs in its own shell with output going to a log file of its own. Rows are
+    pulled from the (possibly streamed) row iterator only as workers become free. A row
+    still running after `timeout` seconds, or a step after its own `timeout=`, is killed
+    with every process the row started.
+    """
+
+    def __init__(self, name, templates, rows, jobs, base_params=(), base_assignments=(), timeout=None):
+        self.name = name
+        self.templates = templates
+        self.rows = rows
+        self.jobs = max(1, jobs)
+        self.base_params = list(base_params)
+        self.base_assignments = list(base_assignments)
+        self.timeout = timeout
+        # The rows running right now, so an interrupt can be passed on to them
+        self.processes = set()
+        self.shell = default_shell()
+        self.log_dir = BATCH_LOG_DIR / f"{name}-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}"
+
+    def _steps(self, row):
+        # Row values extend, and override, the ones given on the command line
+        params = row.params + self.base_params[len(row.params):]
+        values = bind_params(params, self.base_assignments + row.assignments)
+        return run_order(expand_steps(self.templates, values))
+
+    def _run_row(self, row):
+        result = RowResult(row, self.log_dir / f"{row.index}.log")
+        started = time.monotonic()
+        try:
+            if row.error:
+                raise TemplateError(row.error)
+            steps = self._steps(row)
+            timed = self.timeout is not None or any(step.timeout is not None for step in steps)
+            with open(result.log_path, "w") as log:
+                log.write(f"# tm exec {self.name} {row.label}\n")
+                log.flush()
+                status_read, status_write = os.pipe()
+                # With a time limit each row gets a session of its own, so it can be killed with
+                # all of its steps; Ctrl-C then no longer reaches it, so run() passes it on
+                try:
+                    process = subprocess.Popen([self.shell, "-c", row_script(steps, status_write)],
+                                               stdin=subprocess.DEVNULL, stdout=log, stderr=subprocess.STDOUT,
+                                               pass_fds=(status_write,), start_new_session=timed)
+                except OSError:
+                    os.close(status_read)
+                    raise
+                finally:
+                    os.close(status_write)
+                self.processes.add(process)
+                try:
+                    with os.fdopen(status_read, "rb", buffering=0) as status:
+                        result.returncode = self._wait(process, result, steps, status)
+                finally:
+                    self.processes.discard(process)
+        except (StepError, TemplateError, OSError) as e:
+            result.error = str(e)
+        result.duration = time.monotonic() - started
+        return result
+
+    def _wait(self, process, result, steps, status):
+        """Wait for the row, killing it once it, or the step it is running, runs out of time."""
+        expires = None if self.timeout is None else time.monotonic() + self.timeout
+        step_expires = None
+        while True:
+            limit, until = self.timeout, expires
+            if step_expires is not None and (until is None or step_expires < until):
+                limit, until = step.timeout, step_expires
+            wait_for = None if until is None else max(0.0, until - time.monotonic())
+            ready, _, _ = select.select([status], [], [], wait_for)
+            if not ready:
+                break
+            line = status.readline()
+            if not line:
+                # The script has exited, or is about to
+                return process.wait()
+            step = steps[int(line.split()[1])]
+            step_expires = None if step.timeout is None else time.monotonic() + step.timeout
+        result.timed_out = limit
+        stop_group(process.pid, process.poll)
+        process.wait()
+        return TIMEOUT_STATUS
+
+    def run(self):
+        """Run every row, reporting each as it finishes, and return the RowResults."""
+        self.log_dir.mkdir(parents=True, exist_ok=True)
+        _prune_logs()
+        click.echo(f"Executing macro '{self.name}' for each row with {self.jobs} worker(s), "
+                   f"logs in {self.log_dir}\n")
+        results = []
+        with ThreadPoolExecutor(max_workers=self.jobs) as pool:
+            pending = set()
+            try:
+                for row in self.rows:
+                    if len(pending) >= self.jobs:
+                        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                        self._report(done, results)
+                    pending.add(pool.submit(self._run_row, row))
+                while pending:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    self._report(done, results)
+            except KeyboardInterrupt:
+                for process in list(self.processes):
+                    signal_group(process.pid, signal.SIGINT)
+                raise
+        return results
+
+    def _report(self, futures, results):
+        for future in sorted(futures, key=lambda future: future.result().row.index):
+            result = future.result()
+            results.append(result)
+            status = click.style("ok", fg="green") if result.ok else click.style("FAILED", fg="red")
+            click.echo(f"[{result.row.index}] {result.row.label}: {status} "
+                       f"in {result.duration:.1f}s")
+
+
+def print_batch_summary(results):
+    failed = [result for result in results if not result.ok]
+    click.echo(click.style(f"\n{len(results) - len(failed)} succeeded, {len(failed)} failed", bold=True))
+    if failed:
+        click.echo(click.style("\nFailed rows:", fg="red"))
+        for result in sorted(failed, key=lambda r: r.row.index):
+            click.echo(f"  [{result.row.index}] {result.row.label}  {result.failure}")
+            if result.error is None:
+                click.echo(f"      log: {result.log_path}")
+
+    slowest = sorted(results, key=lambda r: r.duration, reverse=True)[:SLOWEST_ROWS_SHOWN]
+    if slowest:
+        click.echo(click.style("\nSlowest rows:", fg="blue"))
+        for result in slowest:
+            click.echo(f"  [{result.row.index}] {result.row.label}  {result.duration:.1f}s")
@@ -0,0 +1,140 @@
+import hashlib
+import json
+import os
+import sqlite3
+import time
+from contextlib import contextmanager
+
+from app.utils.config_utils import MACRO_DIR
+from app.utils.env_utils import env_number
+
+CHECKPOINT_DB_FILE = MACRO_DIR / "checkpoints.db"
+SCHEMA_VERSION = 1
+# Checkpoints not written to for this long are dropped, as are those beyond the cap
+MAX_AGE_DAYS = env_number("TERMO_CHECKPOINT_DAYS", 7)
+MAX_CHECKPOINTS = 200
+
+
+def checkpoint_key(name, version, steps, cwd):
+    """Hash what a run's completed steps are only valid for: the macro version, its
+    expanded steps (so the parameters) and the directory it runs in."""
+    key = hashlib.sha256(f"{name}\0{version}\0{cwd}\0".encode())
+    for step in steps:
+        key.update(f"{step.id}\0{step.command}\0{json.dumps(step.options, sort_keys=True)}\0".encode())
+    return key.hexdigest()
+
+
+class Checkpoint:
+    """The steps one run of a macro has completed, kept until the run succeeds.
+
+    Every run that does not succeed saves its completed steps under a key from
+    checkpoint_key, replacing what an earlier run with the same key left behind. A
+    resumed run instead starts from that record and skips the steps in it. Once every
+    step has succeeded the record is removed. Steps are kept in memory while the run
+    goes on, so the database is written once, when it ends.
+    """
+
+    def __init__(self, name, version, steps, resume=False, cwd=None, path=CHECKPOINT_DB_FILE):
+        self.name = name
+        self.version = version
+        self.path = path
+        self.key = checkpoint_key(name, version, steps, cwd or os.getcwd())
+        self.connection = None
+        self.completed = []
+        # The shell's directory after the last completed step of a sequential run
+        self.cwd = None
+        if resume and os.path.exists(path):
+            row = self._connect().execute("SELECT steps, cwd FROM checkpoints WHERE key = ?",
+                                          (self.key,)).fetchone()
+            if row is not None:
+                self.completed, self.cwd = json.loads(row[0]), row[1]
+        self.resumed = set(self.completed)
+        self.finished = False
+
+    def _connect(self):
+        if self.connection is None:
+            self.connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute("PRAGMA synchronous=NORMAL")
+            self._create_schema()
+        return self.connection
+
+    def close(self):
+        """Save the steps completed so far if the run ended without finish(), e.g. on Ctrl-C."""
+        if not self.finished:
+            self.finished = True
+            self._save()
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+    @contextmanager
+    def _transaction(self):
+        self.connection.execute("BEGIN IMMEDIATE")
+        try:
+            yield self.connection
+        except BaseException:
+            self.connection.execute("ROLLBACK")
+            raise
+        self.connection.execute("COMMIT")
+
+    def _create_schema(self):
+        if self.connection.execute("PRAGMA user_version").fetchone()[0] >= SCHEMA_VERSION:
+            return
+        with self._transaction() as db:
+            version = db.execute("PRAGMA user_version").fetchone()[0]
+            for target in range(version + 1, SCHEMA_VERSION + 1):
+                getattr(self, f"_schema_v{target}")(db)
+            db.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+    def _schema_v1(self, db):
+        db.execute("""CREATE TABLE checkpoints (
+                          key TEXT PRIMARY KEY,
+                          macro TEXT NOT NULL,
+                          version INTEGER,
+                          steps TEXT NOT NULL,
+                          cwd TEXT,
+                          updated REAL NOT NULL)""")
+        db.execute("CREATE INDEX checkpoints_updated ON checkpoints (updated)")
+
+    def is_done(self, step):
+        """Return True if a previous run completed the step."""
+        return step.id in self.resumed
+
+    def record(self, step, cwd=None):
+        """Note that the step succeeded; cwd is the shell's directory after it, if known."""
+        self.completed.append(step.id)
+        if cwd is not None:
+            self.cwd = cwd
+
+    def _save(self):
+        # With nothing completed, an earlier run's record is left to resume from
+        if not self.completed:
+            return
+        now = time.time()
+        self._connect()
+        with self._transaction() as db:
+            db.execute("INSERT INTO checkpoints (key, macro, version, steps, cwd, updated) VALUES (?, ?, ?, ?, ?, ?) "
+                       "ON CONFLICT (key) DO UPDATE SET steps = excluded.steps, cwd = excluded.cwd, "
+                       "updated = excluded.updated",
+                       (self.key, self.name, self.version, json.dumps(self.completed), self.cwd, now))
+            self._collect(db, now)
+
+    def _collect(self, db, now):
+        """Drop checkpoints that are too old, or left by an earlier version of this macro."""
+        db.execute("DELETE FROM checkpoints WHERE updated < ?", (now - MAX_AGE_DAYS * 86400,))
+        if self.version is not None:
+            db.execute("DELETE FROM checkpoints WHERE macro = ? AND version < ?", (self.name, self.version))
+        db.execute("DELETE FROM checkpoints WHERE key IN "
+                   "(SELECT key FROM checkpoints ORDER BY updated DESC LIMIT -1 OFFSET ?)", (MAX_CHECKPOINTS,))
+
+    def finish(self, results):
+        """Forget the checkpoint once every step has succeeded; save it otherwise."""
+        self.finished = True
+        if not all(result.succeeded for result in results):
+            self._save()
+        elif os.path.exists(self.path):
+            self._connect()
+            with self._transaction() as db:
+                db.execute("DELETE FROM checkpoints WHERE key = ?", (self.key,))
+        self.close()
@@ -1,5 +1,7 @@
 import click
 
+from app.utils.timeouts import parse_duration
+
 
 def get_argument(param_decls: list[str], nargs=False):
     if nargs:
@@ -11,3 +13,43 @@ def get_param(param_decls: list[str], is_flag=False, help=None):
     return click.Option(
         param_decls=param_decls, is_flag=is_flag, help=help
     )
+
+
+class VersionType(click.ParamType):
+    """A macro version number, written as 3 or v3."""
+    name = "version"
+
+    def convert(self, value, param, ctx):
+        if isinstance(value, int):
+            return value
+        try:
+            number = int(value[1:] if value[:1] in ("v", "V") else value)
+        except ValueError:
+            number = 0
+        if number < 1:
+            self.fail(f"Expected a version such as v3, got '{value}'", param, ctx)
+        return number
+
+
+class DurationType(click.ParamType):
+    """A duration such as 30s, 5m or 1h; a bare number is seconds."""
+    name = "duration"
+
+    def convert(self, value, param, ctx):
+        if isinstance(value, float):
+            return value
+        try:
+            return parse_duration(value)
+        except ValueError as e:
+            self.fail(str(e), param, ctx)
+
+
+def echo_diff(old, new, indent="", context=1):
+    """Print a colored line diff between two lists of commands."""
+    # Imported here so commands that never diff do not pay for it at startup
+    import difflib
+    for line in difflib.unified_diff(old, new, lineterm="", n=context):
+        if line.startswith(("---", "+++")):
+            continue
+        color = {"+": 'green', "-": 'red', "@": 'cyan'}.get(line[:1])
+        click.echo(indent + (click.style(line, fg=color) if color else line))
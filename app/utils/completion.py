@@ -0,0 +1,118 @@
+import os
+import tempfile
+
+DESCRIPTION_CHARS = 60
+# Beyond this many changed macros it is cheaper to rewrite the cache from the store
+PATCH_LIMIT = 1000
+
+# Subcommands whose first argument is a macro name
+MACRO_ARGUMENT_COMMANDS = ["exec", "desc", "del", "edit", "remote", "stats", "watch", "log", "diff", "rollback"]
+
+# The scripts grep ~/.termo/completions.txt ("name<TAB>first command" per line) directly,
+# so completing a macro name never starts Python. `tm completion refresh` rebuilds it.
+ZSH_COMPLETION = r'''#compdef tm termo
+# termo completion, load with: eval "$(tm completion zsh)"
+_tm() {
+  local cache="$HOME/.termo/completions.txt"
+  [[ -r $cache ]] || command tm completion refresh >/dev/null 2>&1
+  if (( CURRENT == 2 )); then
+    compadd -- @SUBCOMMANDS@
+  elif (( CURRENT != 3 )) || [[ " @MACRO_COMMANDS@ " != *" ${words[2]} "* ]]; then
+    _files
+    return
+  fi
+  local pattern=$PREFIX
+  local -a lines names descriptions
+  # Escape the characters that are special in a basic regular expression
+  [[ $pattern == *[].[\\^\$*]* ]] && pattern=$(print -rn -- $pattern | command sed 's/[].[\\^$*]/\\&/g')
+  lines=("${(@f)$(LC_ALL=C command grep -- "^$pattern" $cache 2>/dev/null)}")
+  names=("${lines[@]%%$'\t'*}")
+  descriptions=("${lines[@]/$'\t'/  -- }")
+  (( ${#lines[1]} )) && compadd -l -d descriptions -a names
+}
+compdef _tm tm termo
+'''
+
+BASH_COMPLETION = r'''# termo completion, load with: eval "$(tm completion bash)"
+_tm() {
+  local cur=${COMP_WORDS[COMP_CWORD]} cache="$HOME/.termo/completions.txt" IFS=$'\n'
+  [[ -r $cache ]] || command tm completion refresh >/dev/null 2>&1
+  COMPREPLY=()
+  if (( COMP_CWORD == 1 )); then
+    COMPREPLY=($(compgen -W "@SUBCOMMANDS@" -- "$cur"))
+  elif (( COMP_CWORD != 2 )) || [[ " @MACRO_COMMANDS@ " != *" ${COMP_WORDS[1]} "* ]]; then
+    return
+  fi
+  local pattern=$cur tab=$'\t'
+  # Escape the characters that are special in a basic regular expression
+  [[ $pattern == *[].[\\^\$*]* ]] && pattern=$(printf '%s' "$pattern" | command sed 's/[].[\\^$*]/\\&/g')
+  COMPREPLY+=($(LC_ALL=C command grep -o -- "^$pattern[^$tab]*" "$cache" 2>/dev/null))
+}
+complete -o default -F _tm tm termo
+'''
+
+FISH_COMPLETION = r'''# termo completion, load with: tm completion fish | source
+function __tm_macros
+    set -l cache "$HOME/.termo/completions.txt"
+    test -r $cache; or command tm completion refresh >/dev/null 2>&1
+    command cat $cache 2>/dev/null
+end
+for command in tm termo
+    complete -c $command -f -n '__fish_use_subcommand' -a '@SUBCOMMANDS@'
+    complete -c $command -f -n '__fish_use_subcommand' -a '(__tm_macros)'
+    complete -c $command -f -n '__fish_seen_subcommand_from @MACRO_COMMANDS@; and test (count (commandline -opc)) -eq 2' -a '(__tm_macros)'
+end
+'''
+
+COMPLETION_SCRIPTS = {"zsh": ZSH_COMPLETION, "bash": BASH_COMPLETION, "fish": FISH_COMPLETION}
+
+
+def completion_script(shell, subcommands):
+    """Return the completion script for a shell, raising ValueError for unsupported shells."""
+    if shell not in COMPLETION_SCRIPTS:
+        raise ValueError(f"No completion for '{shell}'. Supported shells: {', '.join(COMPLETION_SCRIPTS)}")
+    return (COMPLETION_SCRIPTS[shell]
+            .replace("@SUBCOMMANDS@", " ".join(subcommands))
+            .replace("@MACRO_COMMANDS@", " ".join(MACRO_ARGUMENT_COMMANDS)))
+
+
+def _clean(text, limit=DESCRIPTION_CHARS):
+    return " ".join((text or "").split())[:limit]
+
+
+def _name(name):
+    # Completing a shortened name would run a different macro, or none
+    return _clean(name, None)
+
+
+def _line(name, commands):
+    return f"{_name(name)}\t{_clean(commands[0] if commands else '')}\n"
+
+
+def write_completion_cache(store, path, names=None):
+    """Write one "name<TAB>first command" line per macro, replacing the file atomically.
+
+    When only the given names changed, the existing file is patched instead of reading
+    every macro back from the store.
+    """
+    if names is not None and len(names) <= PATCH_LIMIT and path.exists():
+        with open(path, "r") as file:
+            lines = {line.partition("\t")[0]: line for line in file}
+        for name in names:
+            commands = store.get(name)
+            if commands is None:
+                lines.pop(_name(name), None)
+            else:
+                lines[_name(name)] = _line(name, commands)
+        content = lines.values()
+    else:
+        content = (_line(name, [command]) for name, command in store.summaries())
+
+    descriptor, temp_path = tempfile.mkstemp(dir=path.parent, prefix=".completions-")
+    try:
+        with os.fdopen(descriptor, "w") as file:
+            file.writelines(content)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
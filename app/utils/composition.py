@@ -0,0 +1,135 @@
+import re
+import shlex
+
+from app.utils.steps import LIST_OPTIONS, split_annotation
+from app.utils.templates import Template, TemplateError, placeholder_label
+
+# A step of the form `@child arg1 name=value` runs the whole child macro in its place
+COMPOSE_PATTERN = re.compile(r"^\s*@(\S+)(.*)$")
+ASSIGNMENT_PATTERN = re.compile(r"^([A-Za-z_]\w*)=(.*)$", re.DOTALL)
+# Options that only make sense within the macro that declares them
+SCOPED_OPTIONS = {"id", "needs", "group"}
+
+
+class CompositionError(TemplateError):
+    """Raised when a composed macro refers to itself or cannot be flattened."""
+
+
+class MissingMacroError(CompositionError):
+    """Raised when a composed macro refers to a macro that does not exist (yet)."""
+
+
+def child_reference(line):
+    """Return (child name, argument tokens) for an `@child ...` step, otherwise None."""
+    command, options = split_annotation(line)
+    match = COMPOSE_PATTERN.match(command)
+    if not match:
+        return None
+    if options:
+        raise CompositionError(f"Annotations are not supported on '@{match.group(1)}' steps")
+    try:
+        return match.group(1), shlex.split(match.group(2))
+    except ValueError as e:
+        raise CompositionError(f"Invalid arguments for '@{match.group(1)}': {e}")
+
+
+def child_names(commands):
+    """The names of the macros a macro's steps refer to directly."""
+    names = []
+    for line in commands:
+        reference = child_reference(line)
+        if reference is not None and reference[0] not in names:
+            names.append(reference[0])
+    return names
+
+
+def _annotation(options):
+    kept = {key: value for key, value in options.items() if key not in SCOPED_OPTIONS}
+    if not kept:
+        return ""
+    return "  #tm: " + " ".join(f"{key}={','.join(value) if key in LIST_OPTIONS else value}"
+                                for key, value in kept.items())
+
+
+def bind_child(child, lines, args):
+    """Substitute the arguments of an `@child` step into the child's flattened lines.
+
+    Arguments may themselves hold the parent's placeholders, so the result is still a
+    template of the parent. Named parameters the step does not set are passed through
+    to the parent, so `--set` reaches every macro it is composed of.
+    """
+    values = {}
+    position = 0
+    for token in args:
+        match = ASSIGNMENT_PATTERN.match(token)
+        if match:
+            values[match.group(1)] = match.group(2)
+        else:
+            position += 1
+            values[str(position)] = token
+
+    bound = []
+    for line in lines:
+        command, options = split_annotation(line)
+        parts = []
+        for segment in Template.compile(command).segments:
+            if isinstance(segment, str):
+                parts.append(segment)
+                continue
+            key, default = segment
+            if key in values:
+                parts.append(values[key])
+            elif not key.isdigit():
+                parts.append(f"{{{{{key}}}}}" if default is None else f"{{{{{key}:{default}}}}}")
+            elif default is not None:
+                parts.append(default)
+            else:
+                raise CompositionError(f"'@{child}' needs a value for {placeholder_label(key)}")
+        bound.append("".join(parts) + _annotation(options))
+    return bound
+
+
+def flatten(name, commands, lookup):
+    """Replace every `@child` step, recursively, with the child's steps.
+
+    lookup(name) returns a macro's commands or None. Raises CompositionError for cycles
+    and MissingMacroError for children that do not exist.
+    """
+    return _flatten(commands, lookup, [name], {})
+
+
+def _flatten(commands, lookup, stack, memo):
+    lines = []
+    for line in commands:
+        reference = child_reference(line)
+        if reference is None:
+            lines.append(line)
+            continue
+        child, args = reference
+        if child in stack:
+            raise CompositionError(f"Macros call each other in a cycle: {' → '.join(stack + [child])}")
+        if child not in memo:
+            child_commands = lookup(child)
+            if child_commands is None:
+                raise MissingMacroError(f"Macro '{stack[-1]}' uses macro '{child}', which does not exist")
+            # Each child is flattened once, however often it is used
+            memo[child] = _flatten(child_commands, lookup, stack + [child], memo)
+        lines.extend(bind_child(child, memo[child], args))
+    return lines
+
+
+def check_composition(items, lookup):
+    """Raise CompositionError if any of the macros would end up calling itself.
+
+    Missing children are allowed: the macro can be saved before the macros it uses.
+    """
+    for name, commands in items:
+        if is_composed(commands):
+            try:
+                flatten(name, commands, lookup)
+            except MissingMacroError:
+                pass
+
+
+def is_composed(commands):
+    return any(COMPOSE_PATTERN.match(split_annotation(line)[0]) for line in commands)
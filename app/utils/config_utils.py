@@ -1,14 +1,26 @@
 import json
+import os
 from pathlib import Path
 
 import click
 
+from app.utils.completion import write_completion_cache
+from app.utils.history_utils import (HistoryMarkerError,
+                                     find_recorded_commands,
+                                     get_history_parser,
+                                     get_history_path)
+from app.utils.macro_store import JsonMacroStore, SqliteMacroStore
+
 MACRO_DIR = Path.home() / ".termo"
 MACRO_DIR.mkdir(exist_ok=True)
 
 HEAD_FILE = MACRO_DIR / "HEAD"
 CONFIG_FILE = MACRO_DIR / ".config.json"
 MACRO_FILE = MACRO_DIR / "macros.json"
+MACRO_DB_FILE = MACRO_DIR / "macros.db"
+COMPLETION_FILE = MACRO_DIR / "completions.txt"
+
+_store = None
 
 def load_prebuilt_macros():
     """Initialize pre-built macros."""
@@ -25,17 +37,15 @@ def load_prebuilt_macros():
         "sshserver": ["ssh user@your-server.com"]
     }
     
-    macros = load_macros()
-    macros.update(prebuilt_macros)
-    save_macros(macros)
+    get_store().put_many(prebuilt_macros.items())
 
 def is_first_run():
-    """Check if this is the first run by looking for a config file."""
-    if not CONFIG_FILE.exists():
-        return True
-    with open(CONFIG_FILE, "r") as file:
-        config = json.load(file)
-    return config.get("first_run", True)
+    """Check if this is the first run by looking for a config file.
+
+    The config file is only written by complete_first_run, so its existence is enough
+    and startup costs a single stat.
+    """
+    return not CONFIG_FILE.exists()
 
 
 def complete_first_run():
@@ -77,55 +87,61 @@ def clear_head():
         HEAD_FILE.unlink()
 
 
-def load_macros():
-    if MACRO_FILE.exists():
-        with open(MACRO_FILE, "r") as file:
-            return json.load(file)
-    return {}
+def get_store():
+    """Return the macro store, opening it on first use.
 
+    SQLite is the default backend; set TERMO_STORE=json to keep using macros.json.
+    An existing macros.json is migrated into the SQLite store the first time it is opened.
+    Every write refreshes the shell completion cache.
+    """
+    global _store
+    if _store is None:
+        if os.environ.get("TERMO_STORE") == "json":
+            _store = JsonMacroStore(MACRO_FILE)
+        else:
+            _store = SqliteMacroStore(MACRO_DB_FILE, legacy_json_path=MACRO_FILE)
+        _store.on_change = refresh_completion_cache
+        # Macros migrated from macros.json were written before there was an on_change to tell
+        if getattr(_store, "migrated_json", False):
+            refresh_completion_cache(_store)
+    return _store
 
-def save_macros(macros):
-    with open(MACRO_FILE, "w") as file:
-        json.dump(macros, file)
 
+def set_store(store):
+    """Make get_store() return the given store, e.g. the daemon's in-memory snapshot."""
+    global _store
+    _store = store
 
-def get_macro_commands_from_history(name):
-    """Extract commands between 'tm new <name>' and 'tm save' in the zsh_history file."""
-    history_path = Path.home() / ".zsh_history"
 
-    if not history_path.exists():
-        print("zsh_history file not found.")
-        return []
+def refresh_completion_cache(store=None, names=None):
+    """Rewrite the macro names file that the shell completion scripts read."""
+    try:
+        write_completion_cache(store or get_store(), COMPLETION_FILE, names)
+    except OSError:
+        pass
 
-    with open(history_path, "r") as file:
-        lines = file.readlines()
 
-    start_index = None
-    for i in range(len(lines) - 1, -1, -1):
-        if f"tm new {name}" in lines[i]:
-            start_index = i
-            break
+def load_macros():
+    """Load every macro as a dict. Prefer get_store() for single-macro lookups."""
+    return dict(get_store().items())
 
-    if start_index is None:
-        print(f"No 'new {name}' found in zsh_history.")
-        return []
 
-    end_index = None
-    for i in range(start_index + 1, len(lines)):
-        if "tm save" in lines[i]:
-            end_index = i
-            break
+def save_macros(macros):
+    """Replace the whole store with the given dict of macros."""
+    get_store().replace_all(macros)
+
 
-    if end_index is None:
-        print(f"No 'finish' found after 'record start {name}'.")
-        return []
+def get_macro_commands_from_history(name):
+    """Extract commands between 'tm new <name>' and 'tm save' from the shell history file."""
+    parser = get_history_parser()
+    history_path = get_history_path(parser)
 
-    macro_commands = []
-    for line in lines[start_index + 1: end_index]:
-        # Each line is in the format ": <timestamp>:<duration>;<command>"
-        parts = line.split(";", maxsplit=1)
-        if len(parts) > 1:
-            command = parts[1].strip()
-            macro_commands.append(command)
+    if not history_path.exists():
+        print(f"{parser.shell} history file not found.")
+        return []
 
-    return macro_commands
+    try:
+        return find_recorded_commands(name, parser, history_path)
+    except HistoryMarkerError as e:
+        print(e)
+        return []
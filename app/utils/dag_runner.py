@@ -0,0 +1,199 @@
+import asyncio
+import signal
+import time
+
+import click
+
+from app.utils.hooks import HOOKS
+from app.utils.steps import StepResult
+from app.utils.timeouts import (GROUP_POLL_INTERVAL, KILL_GRACE, TIMEOUT_STATUS, format_duration, group_exists,
+                                retry_delay, signal_group, step_limit)
+
+# Output is read in chunks rather than lines, so a step can print lines of any length
+READ_CHUNK = 65536
+
+PREFIX_COLORS = ["cyan", "magenta", "yellow", "blue", "green", "bright_cyan", "bright_magenta"]
+
+
+async def _kill_process_group(process):
+    """SIGTERM the process's group, then SIGKILL whatever is left of it after a grace period."""
+    signal_group(process.pid, signal.SIGTERM)
+    expires = time.monotonic() + KILL_GRACE
+    # Processes the step started may outlive its shell, so wait for the whole group
+    while time.monotonic() < expires and group_exists(process.pid):
+        await asyncio.sleep(GROUP_POLL_INTERVAL)
+    signal_group(process.pid, signal.SIGKILL)
+    await process.wait()
+
+
+class DagRunner:
+    """Run steps concurrently as their dependencies complete, at most `jobs` at a time.
+
+    Output lines are prefixed with the step id. The first failing step cancels every
+    step that is still running or waiting. With a run given, step events and the steps'
+    output are sent to the registered hooks. With a checkpoint given, completed
+    steps are recorded, and a resumed run skips those a previous run completed. Steps
+    are retried and timed out as their annotations ask, and none start once the deadline
+    has passed.
+    """
+
+    def __init__(self, steps, commands, jobs, cache=None, run=None, checkpoint=None, deadline=None):
+        self.steps = steps
+        self.commands = commands
+        self.jobs = max(1, jobs)
+        self.cache = cache
+        self.run_info = run
+        self.checkpoint = checkpoint
+        self.deadline = deadline
+        width = max(len(step.id) for step in steps)
+        self.prefixes = {
+            step.id: click.style(f"[{step.id.ljust(width)}] ", fg=PREFIX_COLORS[i % len(PREFIX_COLORS)])
+            for i, step in enumerate(steps)
+        }
+        self.results = {}
+        # Steps whose step_start hooks have seen
+        self.started = set()
+
+    def run(self):
+        """Run all steps and return the results keyed by step id."""
+        asyncio.run(self._run_all())
+        return [self.results[step.id] for step in self.steps]
+
+    async def _run_all(self):
+        self.semaphore = asyncio.Semaphore(self.jobs)
+        self.tasks = {}
+        for step in self.steps:
+            self.tasks[step.id] = asyncio.create_task(self._run_step(step))
+        await asyncio.gather(*self.tasks.values(), return_exceptions=True)
+
+    def _fail_fast(self, failed_step):
+        for step_id, task in self.tasks.items():
+            if step_id != failed_step.id and not task.done():
+                task.cancel()
+
+    async def _pump(self, stream, step, prefix, err):
+        pending = b""
+        while True:
+            chunk = await stream.read(READ_CHUNK)
+            if not chunk:
+                break
+            *lines, pending = (pending + chunk).split(b"\n")
+            for line in lines:
+                self._echo_line(step, prefix, line + b"\n", err)
+        if pending:
+            self._echo_line(step, prefix, pending, err)
+
+    def _echo_line(self, step, prefix, line, err):
+        if self.run_info is not None:
+            HOOKS.emit("output", self.run_info, step, line, err)
+        click.echo(prefix + line.decode("utf-8", errors="replace").rstrip("\n"), err=err)
+
+    async def _run_step(self, step):
+        try:
+            for dep in step.deps:
+                await asyncio.shield(self.tasks[dep])
+                if not self.results[dep].succeeded:
+                    self.results[step.id] = StepResult(step, "skipped")
+                    return
+            async with self.semaphore:
+                await self._execute(step)
+        except asyncio.CancelledError:
+            if step.id not in self.results:
+                self._finish(StepResult(step, "cancelled"))
+            raise
+        except Exception as e:
+            # A step the runner itself failed on still needs a result, and stops the rest
+            if step.id not in self.results:
+                click.echo(self.prefixes[step.id] + click.style(f"Error: {e}", fg="red"), err=True)
+                self._finish(StepResult(step, "failed"))
+            self._fail_fast(step)
+
+    def _start(self, step):
+        self.started.add(step.id)
+        if self.run_info is not None:
+            HOOKS.emit("step_start", self.run_info, step)
+
+    def _finish(self, result):
+        self.results[result.step.id] = result
+        if self.checkpoint is not None and result.status in ("ok", "cached"):
+            self.checkpoint.record(result.step)
+        # Steps skipped or cancelled before they started are started here, so hooks see pairs
+        if result.step.id not in self.started:
+            self._start(result.step)
+        if self.run_info is not None:
+            HOOKS.emit("step_end", self.run_info, result.step, result)
+
+    async def _execute(self, step):
+        command = self.commands[step.index]
+        prefix = self.prefixes[step.id]
+        if self.deadline is not None and self.deadline.expired:
+            self._finish(StepResult(step, "skipped"))
+            return
+        self._start(step)
+        if self.checkpoint is not None and self.checkpoint.is_done(step):
+            click.echo(prefix + click.style(f"→ {command} (done in previous run)", fg="blue"))
+            self._finish(StepResult(step, "resumed", 0))
+            return
+        key, hit = self.cache.lookup(step, command) if self.cache else (None, False)
+        if hit:
+            click.echo(prefix + click.style(f"→ {command} (cached)", fg="blue"))
+            self._finish(StepResult(step, "cached", 0))
+            return
+        click.echo(prefix + click.style(f"→ {command}", fg="green"))
+
+        started = time.monotonic()
+        attempts = 1
+        while True:
+            status, returncode = await self._attempt(step, command, prefix, started, attempts)
+            delay = None if status == "ok" else retry_delay(step, attempts, self.deadline)
+            if delay is None:
+                break
+            attempts += 1
+            click.echo(prefix + click.style(f"↻ retrying in {delay:.1f}s (attempt {attempts} of "
+                                            f"{step.retries + 1})", fg="yellow"))
+            await asyncio.sleep(delay)
+
+        if status == "ok" and key:
+            self.cache.store(key, step, command)
+        self._finish(StepResult(step, status, returncode, time.monotonic() - started, attempts=attempts))
+        if status != "ok":
+            self._fail_fast(step)
+
+    async def _attempt(self, step, command, prefix, started, attempt):
+        """Run the step once and return its status and exit status."""
+        limit = step_limit(step, self.deadline)
+        # Each step gets its own session so cancelling it can kill the whole process tree
+        process = await asyncio.create_subprocess_shell(
+            command,
+            stdin=asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            start_new_session=True)
+        communicate = asyncio.ensure_future(self._communicate(process, step, prefix))
+        try:
+            done, _ = await asyncio.wait({communicate}, timeout=limit)
+        except asyncio.CancelledError:
+            await _kill_process_group(process)
+            await communicate
+            self._finish(StepResult(step, "cancelled", process.returncode, time.monotonic() - started,
+                                    attempts=attempt))
+            raise
+        if not done:
+            await _kill_process_group(process)
+            # With every process of the step gone, its output reaches its end
+            await communicate
+            click.echo(prefix + click.style(f"timed out after {format_duration(limit)}", fg="red"), err=True)
+            return "timeout", TIMEOUT_STATUS
+        try:
+            returncode = communicate.result()
+        except Exception:
+            await _kill_process_group(process)
+            raise
+        if returncode != 0:
+            click.echo(prefix + click.style(f"exited with status {returncode}", fg="red"), err=True)
+        return "ok" if returncode == 0 else "failed", returncode
+
+    async def _communicate(self, process, step, prefix):
+        await asyncio.gather(self._pump(process.stdout, step, prefix, False),
+                             self._pump(process.stderr, step, prefix, True))
+        return await process.wait()
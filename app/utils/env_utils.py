@@ -0,0 +1,23 @@
+import math
+import os
+import sys
+
+
+def env_number(name, default, kind=float):
+    """Read a non-negative number from the environment variable `name`.
+
+    A value that is not one is reported and `default` used instead, as these are read
+    when modules are imported, where an exception would break every command.
+    """
+    text = os.environ.get(name)
+    if text is None or not text.strip():
+        return default
+    try:
+        value = kind(text)
+        if value < 0 or not math.isfinite(value):
+            raise ValueError
+    except ValueError:
+        expected = "a whole number" if kind is int else "a number"
+        sys.stderr.write(f"termo: ignoring {name}={text!r}, expected {expected} of at least 0\n")
+        return default
+    return value
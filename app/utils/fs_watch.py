@@ -0,0 +1,236 @@
+import ctypes
+import fnmatch
+import os
+import struct
+import subprocess
+import tempfile
+
+# From <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+EVENT_HEADER = struct.Struct("iIII")
+
+# Directory names never worth watching in a source tree
+DEFAULT_IGNORE = [".git", ".hg", ".svn", "__pycache__", ".pytest_cache", ".mypy_cache", ".tox", ".venv",
+                  "node_modules"]
+
+_libc = None
+
+
+def _inotify_libc():
+    """Return libc if it provides inotify (Linux), otherwise None."""
+    global _libc
+    if _libc is None:
+        try:
+            # The running interpreter is already linked against libc
+            libc = ctypes.CDLL(None, use_errno=True)
+            libc.inotify_init1
+        except (OSError, AttributeError, TypeError):
+            _libc = False
+        else:
+            _libc = libc
+    return _libc or None
+
+
+def is_ignored(path, ignore):
+    """True if any component of the path matches one of the ignore patterns."""
+    return any(fnmatch.fnmatch(part, pattern) for part in path.split(os.sep) for pattern in ignore)
+
+
+def _subdirectories(top, ignore):
+    """Yield every directory below top, skipping ignored ones; only directory entries are examined."""
+    pending = [top]
+    while pending:
+        try:
+            entries = os.scandir(pending.pop())
+        except OSError:
+            continue
+        with entries:
+            for entry in entries:
+                # d_type tells directories apart without a stat call per file
+                if entry.is_dir(follow_symlinks=False) and not is_ignored(entry.name, ignore):
+                    yield entry.path
+                    pending.append(entry.path)
+
+
+class InotifyWatcher:
+    """Reports changes to files in a set of directories using Linux inotify.
+
+    With recursive, whole trees are watched, including directories created later.
+    fileno() can be passed to select(); changes() never blocks.
+    """
+
+    def __init__(self, directories, recursive=False, ignore=()):
+        self.libc = _inotify_libc()
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.recursive = recursive
+        self.ignore = list(ignore)
+        self.roots = [os.fspath(directory) for directory in directories]
+        self.directories = {}
+        try:
+            for root in self.roots:
+                self._add(root)
+                if recursive and os.path.isdir(root):
+                    for directory in _subdirectories(root, self.ignore):
+                        self._add(directory)
+        except OSError:
+            os.close(self.fd)
+            raise
+
+    def _add(self, path):
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), WATCH_MASK)
+        if wd < 0:
+            errno = ctypes.get_errno()
+            hint = " (raise fs.inotify.max_user_watches)" if errno == 28 else ""
+            raise OSError(errno, f"Cannot watch {path}{hint}")
+        self.directories[wd] = path
+
+    def fileno(self):
+        return self.fd
+
+    def _watch_new_directory(self, path):
+        try:
+            self._add(path)
+            for directory in _subdirectories(path, self.ignore):
+                self._add(directory)
+        except OSError:
+            pass
+
+    def changes(self):
+        """Return the set of paths that changed since the last call."""
+        changed = set()
+        while True:
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                return changed
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+                offset += EVENT_HEADER.size
+                name = data[offset:offset + length].rstrip(b"\0")
+                offset += length
+                if mask & IN_Q_OVERFLOW:
+                    # Events were lost; report the roots so callers assume everything changed
+                    changed.update(self.roots)
+                    continue
+                if mask & IN_IGNORED:
+                    self.directories.pop(wd, None)
+                    continue
+                if wd not in self.directories:
+                    continue
+                path = os.path.join(self.directories[wd], os.fsdecode(name)) if name else self.directories[wd]
+                if self.ignore and is_ignored(os.fsdecode(name), self.ignore):
+                    continue
+                changed.add(path)
+                if self.recursive and mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+                    self._watch_new_directory(path)
+
+    def close(self):
+        os.close(self.fd)
+
+
+class PollingWatcher:
+    """Fallback for systems without inotify: compares file sizes and mtimes on every call."""
+
+    def __init__(self, directories):
+        self.directories = [os.fspath(directory) for directory in directories]
+        self.state = self._scan()
+
+    def fileno(self):
+        return None
+
+    def _scan(self):
+        state = {}
+        for directory in self.directories:
+            try:
+                entries = os.scandir(directory)
+            except OSError:
+                continue
+            with entries:
+                for entry in entries:
+                    try:
+                        stat = entry.stat(follow_symlinks=False)
+                    except OSError:
+                        continue
+                    state[entry.path] = (stat.st_size, stat.st_mtime_ns, stat.st_ino)
+        return state
+
+    def changes(self):
+        state = self._scan()
+        changed = {path for path in state.keys() | self.state.keys() if state.get(path) != self.state.get(path)}
+        self.state = state
+        return changed
+
+    def close(self):
+        pass
+
+
+class FindWatcher:
+    """Fallback for watching trees without inotify.
+
+    Each call runs `find -newer` against a marker file touched at the previous call, so
+    the stat calls happen in find rather than in a Python loop over every file. Deleted
+    files are not listed, but the directory they were in is.
+    """
+
+    def __init__(self, paths, ignore=()):
+        self.paths = [os.fspath(path) for path in paths]
+        self.ignore = list(ignore)
+        self.marker = self._new_marker()
+
+    @staticmethod
+    def _new_marker():
+        descriptor, path = tempfile.mkstemp(prefix="termo-watch-")
+        os.close(descriptor)
+        return path
+
+    def fileno(self):
+        return None
+
+    def changes(self):
+        # The next marker is created first so nothing changed during the scan is missed
+        marker = self._new_marker()
+        prune = []
+        for pattern in self.ignore:
+            prune += ["-name", pattern, "-o"]
+        command = ["find"] + self.paths
+        if prune:
+            command += ["("] + prune[:-1] + [")", "-prune", "-o"]
+        command += ["-newer", self.marker, "-print0"]
+        output = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL).stdout
+        os.unlink(self.marker)
+        self.marker = marker
+        return {os.fsdecode(path) for path in output.split(b"\0") if path}
+
+    def close(self):
+        try:
+            os.unlink(self.marker)
+        except OSError:
+            pass
+
+
+def create_watcher(directories, recursive=False, ignore=()):
+    """Watch the given directories with inotify where available, otherwise by polling.
+
+    With recursive, every directory below them is watched too, except ignored ones.
+    """
+    if _inotify_libc() is not None:
+        try:
+            return InotifyWatcher(directories, recursive, ignore)
+        except OSError:
+            pass
+    return FindWatcher(directories, ignore) if recursive else PollingWatcher(directories)
@@ -0,0 +1,193 @@
+import os
+from pathlib import Path
+
+CHUNK_SIZE = 64 * 1024
+# A recording longer than this is taken to be a missing start marker, not read into memory
+MAX_RECORDED_ENTRIES = 100_000
+
+# zsh "metafies" special bytes in its history file as META followed by the byte xor 0x20
+ZSH_META = 0x83
+
+
+def read_lines_reversed(path, chunk_size=CHUNK_SIZE):
+    """Yield the raw lines of a file as bytes, last line first, reading fixed-size blocks from the end."""
+    with open(path, "rb") as file:
+        position = file.seek(0, os.SEEK_END)
+        remainder = b""
+        while position > 0:
+            read_size = min(chunk_size, position)
+            position -= read_size
+            file.seek(position)
+            block = file.read(read_size) + remainder
+            lines = block.split(b"\n")
+            # The first piece may be the tail of a line that starts in an earlier block
+            remainder = lines.pop(0)
+            for line in reversed(lines):
+                yield line
+        yield remainder
+
+
+class HistoryParser:
+    """Base class for shell history formats. Subclasses turn raw history lines into commands."""
+
+    shell = None
+
+    def default_path(self):
+        raise NotImplementedError("Subclasses must implement default_path.")
+
+    def entries_reversed(self, path):
+        """Yield the commands in the history file, newest first."""
+        raise NotImplementedError("Subclasses must implement entries_reversed.")
+
+
+class ZshHistoryParser(HistoryParser):
+    shell = "zsh"
+
+    def default_path(self):
+        return Path.home() / ".zsh_history"
+
+    @staticmethod
+    def unmetafy(raw):
+        if bytes([ZSH_META]) not in raw:
+            return raw
+        result = bytearray()
+        iterator = iter(raw)
+        for byte in iterator:
+            if byte == ZSH_META:
+                byte = next(iterator, 0x20) ^ 0x20
+            result.append(byte)
+        return bytes(result)
+
+    @staticmethod
+    def strip_extended(line):
+        # Extended history lines look like ": <timestamp>:<duration>;<command>"
+        if line.startswith(": "):
+            parts = line.split(";", maxsplit=1)
+            if len(parts) > 1:
+                return parts[1]
+        return line
+
+    def entries_reversed(self, path):
+        # Multi-line commands are stored as physical lines ending in a backslash,
+        # so an entry is complete once the line before it does not end with one.
+        pending = None
+        for raw in read_lines_reversed(path):
+            if pending is not None and raw.endswith(b"\\"):
+                pending = raw[:-1] + b"\n" + pending
+                continue
+            if pending is not None:
+                yield self._decode(pending)
+            pending = raw if raw else None
+        if pending is not None:
+            yield self._decode(pending)
+
+    def _decode(self, raw):
+        line = self.unmetafy(raw).decode("utf-8", errors="replace")
+        return self.strip_extended(line).strip()
+
+
+class BashHistoryParser(HistoryParser):
+    shell = "bash"
+
+    def default_path(self):
+        return Path.home() / ".bash_history"
+
+    def entries_reversed(self, path):
+        for raw in read_lines_reversed(path):
+            line = raw.decode("utf-8", errors="replace").strip()
+            # With HISTTIMEFORMAT set, bash writes "#<timestamp>" lines before each entry
+            if not line or (line.startswith("#") and line[1:].isdigit()):
+                continue
+            yield line
+
+
+class FishHistoryParser(HistoryParser):
+    shell = "fish"
+
+    def default_path(self):
+        data_home = os.environ.get("XDG_DATA_HOME") or str(Path.home() / ".local" / "share")
+        return Path(data_home) / "fish" / "fish_history"
+
+    @staticmethod
+    def unescape(value):
+        result = []
+        iterator = iter(value)
+        for char in iterator:
+            if char == "\\":
+                escaped = next(iterator, "")
+                result.append("\n" if escaped == "n" else escaped)
+            else:
+                result.append(char)
+        return "".join(result)
+
+    def entries_reversed(self, path):
+        # Entries are YAML-like records; only the "- cmd: " line carries the command
+        for raw in read_lines_reversed(path):
+            if raw.startswith(b"- cmd: "):
+                yield self.unescape(raw[7:].decode("utf-8", errors="replace")).strip()
+
+
+HISTORY_PARSERS = {
+    "zsh": ZshHistoryParser,
+    "bash": BashHistoryParser,
+    "fish": FishHistoryParser,
+}
+
+
+def register_history_parser(parser_class):
+    """Register a parser for an additional shell history format."""
+    HISTORY_PARSERS[parser_class.shell] = parser_class
+
+
+def get_history_parser(shell=None):
+    """Return the parser for the given shell, defaulting to the user's login shell and then zsh."""
+    if shell is None:
+        shell = os.path.basename(os.environ.get("SHELL", ""))
+    return HISTORY_PARSERS.get(shell, ZshHistoryParser)()
+
+
+def get_history_path(parser):
+    histfile = os.environ.get("HISTFILE")
+    if histfile:
+        return Path(histfile).expanduser()
+    return parser.default_path()
+
+
+class HistoryMarkerError(ValueError):
+    """Raised when the recording markers cannot be found in the history file."""
+
+
+def _is_new_marker(command, name):
+    return command.split()[:3] == ["tm", "new", name]
+
+
+def _is_save_marker(command):
+    return command.split()[:2] == ["tm", "save"]
+
+
+def find_recorded_commands(name, parser, path, max_entries=MAX_RECORDED_ENTRIES):
+    """Scan history backwards to the latest 'tm new <name>' and return the commands up to the next 'tm save'.
+
+    Only the entries between the start marker and the 'tm save' after it are held in memory,
+    and the scan gives up once there are more than max_entries of them.
+    """
+    newer_commands = []
+    saved = False
+    for command in parser.entries_reversed(path):
+        if _is_new_marker(command, name):
+            break
+        if _is_save_marker(command):
+            # Scanning backwards, the last save seen is the first one after the start marker
+            newer_commands.clear()
+            saved = True
+            continue
+        newer_commands.append(command)
+        if len(newer_commands) > max_entries:
+            raise HistoryMarkerError(f"No 'new {name}' found within {max_entries} commands "
+                                     f"in {parser.shell} history.")
+    else:
+        raise HistoryMarkerError(f"No 'new {name}' found in {parser.shell} history.")
+
+    if not saved:
+        raise HistoryMarkerError(f"No 'save' found after 'new {name}'.")
+    return [command for command in reversed(newer_commands) if command]
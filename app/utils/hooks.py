@@ -0,0 +1,117 @@
+"""Lifecycle hooks on the execution path of `tm exec` and `tm remote`.
+
+A hook is any object that defines some of these methods:
+
+    macro_start(run)
+    macro_end(run, results)        results is None if the run was interrupted
+    step_start(run, step)
+    step_end(run, step, result)
+    output(run, step, data, err)
+
+run is a Run, step a Step and result a StepResult. Every step_end follows a step_start
+for the same step, also for steps that were skipped or cancelled without running. For the
+parent run of a remote run on several hosts, results holds the StepResults of every host,
+host after host. Remote runs on several hosts call hooks from worker threads.
+
+output receives chunks of stdout (err=False) or stderr as bytes. Steps run one at a time
+write to the terminal directly unless a hook takes output events; then their output is
+relayed through termo too, and they no longer see a terminal on stdout and stderr. Steps
+run with --admin are the exception: NO output events are sent for them.
+
+Register hooks with HOOKS.register(hook), or list factories as module:name in
+TERMO_HOOKS (comma-separated). With no hooks registered, a call site costs one
+attribute check.
+"""
+import importlib
+import os
+import secrets
+import threading
+
+import click
+
+EVENTS = ("macro_start", "macro_end", "step_start", "step_end", "output")
+
+
+class Run:
+    """One run of a macro, locally or on one remote host.
+
+    A remote run on several hosts is a run of its own, the parent of each host's run.
+    """
+
+    def __init__(self, name, host=None, parent=None):
+        self.name = name
+        self.host = host
+        self.parent = parent
+        self.id = secrets.token_hex(8)
+        self.trace_id = parent.trace_id if parent else secrets.token_hex(16)
+        # Set when the run could not start or was cut short, e.g. an SSH connection error
+        self.error = None
+
+
+class HookRegistry:
+    def __init__(self):
+        self.hooks = []
+        self.callbacks = {event: [] for event in EVENTS}
+        # Checked by every call site before building any event arguments
+        self.active = False
+        self.lock = threading.Lock()
+        self.loaded_spec = None
+
+    def register(self, hook):
+        with self.lock:
+            self.hooks.append(hook)
+            for event, callbacks in self.callbacks.items():
+                callback = getattr(hook, event, None)
+                if callback is not None:
+                    callbacks.append((hook, callback))
+            self.active = True
+
+    def unregister(self, hook):
+        with self.lock:
+            if hook not in self.hooks:
+                return
+            self.hooks.remove(hook)
+            # New lists, so an emit that is iterating the old ones is not disturbed
+            self.callbacks = {event: [entry for entry in callbacks if entry[0] is not hook]
+                              for event, callbacks in self.callbacks.items()}
+            self.active = bool(self.hooks)
+
+    def wants(self, event):
+        """Whether any registered hook takes event."""
+        return bool(self.callbacks[event])
+
+    def emit(self, event, *args):
+        for hook, callback in self.callbacks[event]:
+            try:
+                callback(*args)
+            except Exception as e:
+                # A broken hook must not break the run; it is dropped after its first failure
+                click.echo(click.style(f"Hook {type(hook).__name__} failed in {event} and was disabled: {e}",
+                                       fg='yellow'), err=True)
+                self.unregister(hook)
+
+    def load_plugins(self):
+        """Register the hooks named in TERMO_HOOKS, once per process."""
+        spec = os.environ.get("TERMO_HOOKS")
+        if not spec or spec == self.loaded_spec:
+            return
+        self.loaded_spec = spec
+        for entry in filter(None, (item.strip() for item in spec.split(","))):
+            module_name, _, attribute = entry.partition(":")
+            try:
+                factory = getattr(importlib.import_module(module_name), attribute)
+                self.register(factory())
+            except Exception as e:
+                click.echo(click.style(f"Could not load hook '{entry}': {e}", fg='yellow'), err=True)
+
+
+HOOKS = HookRegistry()
+
+
+def start_trace(path):
+    """Register a hook that appends runs to path as OpenTelemetry spans, and return it."""
+    # Imported here so runs without tracing do not load it
+    from app.utils.tracing import TraceHook
+    tracer = TraceHook(path)
+    HOOKS.register(tracer)
+    return tracer
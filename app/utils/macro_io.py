@@ -0,0 +1,149 @@
+import gzip
+import hashlib
+import json
+import sys
+from contextlib import contextmanager
+from itertools import islice
+
+GZIP_MAGIC = b"\x1f\x8b"
+# Macros are read, resolved against the store and written this many at a time
+IMPORT_BATCH_SIZE = 5000
+STRATEGIES = ["skip", "overwrite", "rename"]
+
+
+class ImportFormatError(ValueError):
+    """Raised when an import file is not valid macro NDJSON."""
+
+
+@contextmanager
+def open_output(path, compress=None):
+    """Open a text stream for writing; "-" is stdout. Compress with gzip if asked or if path ends in .gz."""
+    if compress is None:
+        compress = path.endswith(".gz")
+    raw = sys.stdout.buffer if path == "-" else open(path, "wb")
+    stream = gzip.GzipFile(fileobj=raw, mode="wb") if compress else raw
+    try:
+        yield stream
+    finally:
+        if compress:
+            stream.close()
+        if path == "-":
+            raw.flush()
+        else:
+            raw.close()
+
+
+@contextmanager
+def open_input(path):
+    """Open a binary stream for reading; "-" is stdin. gzip input is detected from its header."""
+    raw = sys.stdin.buffer if path == "-" else open(path, "rb")
+    try:
+        stream = gzip.GzipFile(fileobj=raw, mode="rb") if raw.peek(2)[:2] == GZIP_MAGIC else raw
+        yield stream
+    finally:
+        if path != "-":
+            raw.close()
+
+
+def write_ndjson(stream, items):
+    """Write one {"name": ..., "commands": [...]} line per macro and return how many were written."""
+    count = 0
+    for name, commands in items:
+        stream.write(json.dumps({"name": name, "commands": commands}, ensure_ascii=False).encode() + b"\n")
+        count += 1
+    return count
+
+
+def read_ndjson(stream):
+    """Yield (name, commands) pairs from a macro NDJSON stream, one line at a time."""
+    for number, line in enumerate(stream, start=1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as e:
+            raise ImportFormatError(f"Line {number}: invalid JSON ({e})")
+        name = record.get("name") if isinstance(record, dict) else None
+        commands = record.get("commands") if isinstance(record, dict) else None
+        if not isinstance(name, str) or not name:
+            raise ImportFormatError(f"Line {number}: a macro needs a non-empty \"name\"")
+        if not isinstance(commands, list) or not all(isinstance(command, str) for command in commands):
+            raise ImportFormatError(f"Line {number}: \"commands\" of '{name}' must be a list of strings")
+        yield name, commands
+
+
+def _content_hash(commands):
+    return hashlib.blake2b(json.dumps(commands, ensure_ascii=False).encode("utf-8", "surrogatepass"),
+                           digest_size=16).digest()
+
+
+class ImportPlan:
+    """Resolves imported macros against the store with a merge strategy.
+
+    Each macro ends up as one action: add, overwrite, rename (to a free name), skip
+    (exists, strategy skip) or unchanged (exists with the same commands).
+    """
+
+    def __init__(self, store, strategy):
+        if strategy not in STRATEGIES:
+            raise ValueError(f"Unknown strategy '{strategy}'")
+        self.store = store
+        self.strategy = strategy
+        self.counts = dict.fromkeys(["add", "overwrite", "rename", "skip", "unchanged"], 0)
+        # Names already claimed by this import, so duplicates in the file are handled too,
+        # with a hash of their commands rather than the commands to keep large imports small
+        self.claimed = {}
+
+    def _free_name(self, name, existing):
+        suffix = 2
+        while True:
+            candidate = f"{name}-{suffix}"
+            if candidate not in self.claimed and candidate not in existing and not self.store.contains(candidate):
+                return candidate
+            suffix += 1
+
+    def resolve(self, batch):
+        """Yield (action, name, new name, old commands, new commands) for a batch of macros.
+
+        Old commands are those in the store, or None if the name is new or was claimed by
+        an earlier macro in this import.
+        """
+        existing = self.store.get_many({name for name, _ in batch})
+        for name, commands in batch:
+            digest = _content_hash(commands)
+            if name in self.claimed:
+                current = None
+                exists, same = True, self.claimed[name] == digest
+            else:
+                current = existing.get(name)
+                exists, same = current is not None, current == commands
+            if not exists:
+                action, target = "add", name
+            elif same:
+                action, target = "unchanged", name
+            elif self.strategy == "skip":
+                action, target = "skip", name
+            elif self.strategy == "overwrite":
+                action, target = "overwrite", name
+            else:
+                action, target = "rename", self._free_name(name, existing)
+            self.counts[action] += 1
+            if action in ("add", "overwrite", "rename"):
+                self.claimed[target] = digest
+            yield action, name, target, current, commands
+
+    def batches(self, items, on_action=None):
+        """Yield the batches of (name, commands) to write, calling on_action for every macro."""
+        items = iter(items)
+        while True:
+            batch = list(islice(items, IMPORT_BATCH_SIZE))
+            if not batch:
+                return
+            writes = []
+            for action, name, target, current, commands in self.resolve(batch):
+                if on_action is not None:
+                    on_action(action, name, target, current, commands)
+                if action in ("add", "overwrite", "rename"):
+                    writes.append((target, commands))
+            # Later entries for the same name in this batch win
+            yield list(dict(writes).items())
@@ -0,0 +1,748 @@
+import fcntl
+import hashlib
+import json
+from array import array
+from bisect import bisect_left
+from collections import Counter, defaultdict
+from itertools import chain
+import os
+import tempfile
+import time
+from contextlib import contextmanager
+
+from app.utils.composition import (MissingMacroError, check_composition, child_names, flatten,
+                                   is_composed)
+from app.utils.search_index import GRAM_SIZE, MIN_GRAM_OVERLAP, macro_trigrams, rank, trigrams
+from app.utils.templates import Template, compile_commands
+
+SCHEMA_VERSION = 5
+SEARCH_CANDIDATES = 200
+# Keeps "IN (...)" lists below SQLite's bound-parameter limit
+SQL_BATCH_SIZE = 500
+# Bulk writes buffer index changes for this many macros before writing the posting lists
+POSTING_FLUSH_ROWS = 50000
+
+
+# Bytes of the content hashes that address lines and macro bodies in the version history
+HASH_SIZE = 16
+
+
+def _digest(text):
+    return hashlib.blake2b(text.encode("utf-8", "surrogatepass"), digest_size=HASH_SIZE).digest()
+
+
+class MacroVersion:
+    """One recorded version of a macro. commands is None for the version that deleted it."""
+
+    def __init__(self, number, created, commands):
+        self.number = number
+        self.created = created
+        self.commands = commands
+
+    @property
+    def deleted(self):
+        return self.commands is None
+
+
+class MacroStore:
+    """Storage backend for macros. Each macro is a name mapped to a list of commands."""
+
+    # Called as on_change(store, names) after every write, e.g. to refresh the shell
+    # completion cache. names lists the macros that changed, or is None if all may have.
+    on_change = None
+
+    def _changed(self, names=None):
+        if self.on_change is not None:
+            self.on_change(self, names)
+
+    def get(self, name):
+        """Return the commands of a macro, or None if it does not exist."""
+        raise NotImplementedError("Subclasses must implement get.")
+
+    def put(self, name, commands):
+        self.put_many([(name, commands)])
+
+    def put_many(self, items):
+        """Insert or replace several macros in a single write."""
+        raise NotImplementedError("Subclasses must implement put_many.")
+
+    def put_batches(self, batches):
+        """Write an iterable of (name, commands) batches, atomically where the backend allows.
+
+        Batches are consumed one at a time, so a large import never has to be held in memory.
+        """
+        for batch in batches:
+            self.put_many(batch)
+
+    def get_many(self, names):
+        """Return a dict of the commands of those names that exist."""
+        found = {}
+        for name in names:
+            commands = self.get(name)
+            if commands is not None:
+                found[name] = commands
+        return found
+
+    def delete(self, name):
+        """Delete a macro, returning False if it did not exist."""
+        raise NotImplementedError("Subclasses must implement delete.")
+
+    def items(self):
+        """Yield (name, commands) pairs in insertion order."""
+        raise NotImplementedError("Subclasses must implement items.")
+
+    def names(self):
+        return [name for name, _ in self.items()]
+
+    def summaries(self):
+        """Yield (name, first command) pairs in insertion order."""
+        for name, commands in self.items():
+            yield name, commands[0] if commands else ""
+
+    def contains(self, name):
+        return self.get(name) is not None
+
+    def get_templates(self, name):
+        """Return the macro's commands compiled into templates, or None if it does not exist.
+
+        `@child` steps are replaced by the child's steps; raises CompositionError if that fails.
+        """
+        commands = self.get(name)
+        if commands is None:
+            return None
+        return compile_commands(flatten(name, commands, self.get) if is_composed(commands) else commands)
+
+    def dependants(self, name):
+        """Return the names of the macros that use this one as an `@` step."""
+        return [parent for parent, commands in self.items() if name in child_names(commands)]
+
+    def replace_all(self, macros):
+        """Replace the whole store with the given dict of macros."""
+        raise NotImplementedError("Subclasses must implement replace_all.")
+
+    def versions(self, name, limit=None):
+        """Return the latest `limit` (default: all) recorded versions of a macro, oldest first.
+
+        Stores that keep no history return [].
+        """
+        return []
+
+    def current_version(self, name):
+        """Return the number of the macro's current version, or None without history or macro."""
+        versions = self.versions(name, 1)
+        return versions[-1].number if versions and not versions[-1].deleted else None
+
+    def get_version(self, name, number):
+        """Return the commands of one recorded version, or None if it does not exist or is a deletion."""
+        for version in self.versions(name):
+            if version.number == number:
+                return version.commands
+        return None
+
+    def rollback(self, name, number):
+        """Make a recorded version current again, itself recorded as a new version.
+
+        Returns the restored commands, or None if there is no such version.
+        """
+        commands = self.get_version(name, number)
+        if commands is not None:
+            self.put(name, commands)
+        return commands
+
+    def search(self, query, limit=20):
+        """Return up to `limit` (name, commands) pairs ranked by how well they match the query."""
+        return rank(query, self.items(), limit)
+
+
+class JsonMacroStore(MacroStore):
+    """The original single-file macros.json store, with locked and atomic rewrites."""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock_path = path.with_name(path.name + ".lock")
+
+    @contextmanager
+    def _locked(self):
+        with open(self.lock_path, "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _read(self):
+        if self.path.exists():
+            with open(self.path, "r") as file:
+                return json.load(file)
+        return {}
+
+    def _write(self, macros):
+        # Write to a temporary file next to the store and rename it over the old one,
+        # so readers only ever see a complete file.
+        fd, temp_path = tempfile.mkstemp(dir=self.path.parent, prefix=".macros.", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as file:
+                json.dump(macros, file)
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(temp_path, self.path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+
+    def get(self, name):
+        return self._read().get(name)
+
+    def put_many(self, items):
+        items = list(items)
+        with self._locked():
+            macros = self._read()
+            macros.update(items)
+            check_composition(items, macros.get)
+            self._write(macros)
+        self._changed([name for name, _ in items])
+
+    def delete(self, name):
+        with self._locked():
+            macros = self._read()
+            if name not in macros:
+                return False
+            del macros[name]
+            self._write(macros)
+        self._changed([name])
+        return True
+
+    def items(self):
+        return list(self._read().items())
+
+    def replace_all(self, macros):
+        with self._locked():
+            self._write(macros)
+        self._changed()
+
+
+class SqliteMacroStore(MacroStore):
+    """Indexed macro store in SQLite (WAL mode) with single-record, transactional updates."""
+
+    def __init__(self, path, legacy_json_path=None):
+        # Imported here so `tm` only pays for sqlite3 when a command opens the store
+        import sqlite3
+        self.path = path
+        self.connection = sqlite3.connect(path, timeout=30, isolation_level=None)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self._create_schema()
+        # Whether opening the store imported macros.json; on_change is not set yet to hear of it
+        self.migrated_json = legacy_json_path is not None and self._migrate_json(legacy_json_path)
+
+    def close(self):
+        self.connection.close()
+
+    @contextmanager
+    def _transaction(self):
+        self.connection.execute("BEGIN IMMEDIATE")
+        try:
+            yield self.connection
+        except BaseException:
+            self.connection.execute("ROLLBACK")
+            raise
+        self.connection.execute("COMMIT")
+
+    def _create_schema(self):
+        # Checking user_version first keeps the common path free of write locks
+        if self.connection.execute("PRAGMA user_version").fetchone()[0] >= SCHEMA_VERSION:
+            return
+        with self._transaction() as db:
+            # Another process may have upgraded the schema while we waited for the lock
+            version = db.execute("PRAGMA user_version").fetchone()[0]
+            for target in range(version + 1, SCHEMA_VERSION + 1):
+                getattr(self, f"_schema_v{target}")(db)
+            db.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+    def _schema_v1(self, db):
+        db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        db.execute("CREATE TABLE IF NOT EXISTS macros (name TEXT PRIMARY KEY, commands TEXT NOT NULL)")
+
+    def _schema_v2(self, db):
+        # Trigram index over names and commands for `tm find`: one row per trigram holding
+        # the sorted rowids of the macros that contain it
+        db.execute("CREATE TABLE macro_grams (gram TEXT PRIMARY KEY, ids BLOB NOT NULL) WITHOUT ROWID")
+        added = defaultdict(set)
+        for rowid, name, commands in db.execute("SELECT rowid, name, commands FROM macros"):
+            for gram in macro_trigrams(name, json.loads(commands)):
+                added[gram].add(rowid)
+        self._update_postings(db, added, {})
+
+    def _schema_v3(self, db):
+        # Templates are compiled when a macro is written so exec only has to join segments
+        db.execute("ALTER TABLE macros ADD COLUMN compiled TEXT")
+        rows = db.execute("SELECT rowid, commands FROM macros").fetchall()
+        db.executemany("UPDATE macros SET compiled = ? WHERE rowid = ?",
+                       ((self._compiled_json(json.loads(commands)), rowid) for rowid, commands in rows))
+
+    def _schema_v4(self, db):
+        # Which macros use which others as `@` steps, so plans can be rebuilt when a child changes
+        db.execute("CREATE TABLE macro_deps (parent TEXT NOT NULL, child TEXT NOT NULL, "
+                   "PRIMARY KEY (parent, child)) WITHOUT ROWID")
+        db.execute("CREATE INDEX macro_deps_child ON macro_deps (child)")
+        macros = {name: json.loads(commands) for name, commands in db.execute("SELECT name, commands FROM macros")}
+        self._update_deps(db, macros)
+        db.executemany("UPDATE macros SET compiled = ? WHERE name = ?",
+                       ((self._plan_json(db, name, commands, macros), name)
+                        for name, commands in macros.items() if is_composed(commands)))
+
+    def _schema_v5(self, db):
+        # Version history. The current version stays in macros, so running a macro never
+        # reads the history. Earlier versions are content-addressed: every distinct command
+        # line is stored once, every distinct body once as the concatenated hashes of its
+        # lines, and a version points at a body (NULL for the version that deleted it)
+        db.execute("ALTER TABLE macros ADD COLUMN version INTEGER NOT NULL DEFAULT 1")
+        db.execute("ALTER TABLE macros ADD COLUMN updated REAL")
+        db.execute("CREATE TABLE macro_lines (hash BLOB PRIMARY KEY, text TEXT NOT NULL) WITHOUT ROWID")
+        db.execute("CREATE TABLE macro_blobs (hash BLOB PRIMARY KEY, lines BLOB NOT NULL) WITHOUT ROWID")
+        db.execute("CREATE TABLE macro_versions (name TEXT NOT NULL, version INTEGER NOT NULL, blob BLOB, "
+                   "created REAL, PRIMARY KEY (name, version)) WITHOUT ROWID")
+
+    @staticmethod
+    def _compiled_json(commands):
+        return json.dumps([template.to_json() for template in compile_commands(commands)])
+
+    def _plan_json(self, db, name, commands, pending):
+        """Compile a macro, flattening `@child` steps against pending macros and then the database.
+
+        Returns None while a child does not exist yet; the plan is built once it does.
+        """
+        if not is_composed(commands):
+            return self._compiled_json(commands)
+
+        def lookup(child):
+            if child in pending:
+                return pending[child]
+            row = db.execute("SELECT commands FROM macros WHERE name = ?", (child,)).fetchone()
+            return json.loads(row[0]) if row else None
+
+        try:
+            return self._compiled_json(flatten(name, commands, lookup))
+        except MissingMacroError:
+            return None
+
+    def _update_deps(self, db, items):
+        db.executemany("DELETE FROM macro_deps WHERE parent = ?", ((name,) for name in items))
+        db.executemany("INSERT OR IGNORE INTO macro_deps (parent, child) VALUES (?, ?)",
+                       ((name, child) for name, commands in items.items() for child in child_names(commands)))
+
+    def _replan_dependants(self, db, names, exclude=()):
+        """Rebuild the plans of every macro that uses the given ones, directly or indirectly."""
+        query = ("WITH RECURSIVE users(name) AS ("
+                 "SELECT parent FROM macro_deps WHERE child IN ({}) "
+                 "UNION SELECT macro_deps.parent FROM macro_deps JOIN users ON macro_deps.child = users.name) "
+                 "SELECT macros.name, macros.commands FROM users JOIN macros ON macros.name = users.name")
+        dependants = {name: json.loads(commands) for name, commands in self._select_in(db, query, names)
+                      if name not in exclude}
+        db.executemany("UPDATE macros SET compiled = ? WHERE name = ?",
+                       ((self._plan_json(db, name, commands, {}), name) for name, commands in dependants.items()))
+
+    def _migrate_json(self, json_path):
+        """Import an existing macros.json once, then move it aside; return True if it was imported."""
+        if not json_path.exists():
+            return False
+        with self._transaction() as db:
+            if db.execute("SELECT 1 FROM meta WHERE key = 'migrated_json'").fetchone():
+                return False
+            with open(json_path, "r") as file:
+                macros = json.load(file)
+            self._upsert(db, macros.items())
+            db.execute("INSERT INTO meta (key, value) VALUES ('migrated_json', ?)", (str(json_path),))
+        try:
+            json_path.rename(json_path.with_name(json_path.name + ".migrated"))
+        except FileNotFoundError:
+            pass
+        return True
+
+    def _archive(self, db, versions):
+        """Add (name, version, commands or None, created) rows to the history."""
+        line_hashes = {}
+        blobs = {}
+        rows = []
+        for name, number, commands, created in versions:
+            blob = None
+            if commands is not None:
+                for line in commands:
+                    if line not in line_hashes:
+                        line_hashes[line] = _digest(line)
+                lines = b"".join(line_hashes[line] for line in commands)
+                blob = hashlib.blake2b(lines, digest_size=HASH_SIZE).digest()
+                blobs[blob] = lines
+            rows.append((name, number, blob, created))
+        # Lines and bodies already stored, by any version of any macro, are not stored again
+        db.executemany("INSERT OR IGNORE INTO macro_lines (hash, text) VALUES (?, ?)",
+                       ((digest, line) for line, digest in line_hashes.items()))
+        db.executemany("INSERT OR IGNORE INTO macro_blobs (hash, lines) VALUES (?, ?)", blobs.items())
+        db.executemany("INSERT INTO macro_versions (name, version, blob, created) VALUES (?, ?, ?, ?)", rows)
+
+    def _next_versions(self, db, items, previous):
+        """Return {name: (version, updated)} for items, archiving the versions they replace."""
+        now = time.time()
+        # A macro saved again after it was deleted carries on from the deletion's number
+        deleted = dict(self._select_in(
+            db, "SELECT name, MAX(version) FROM macro_versions WHERE name IN ({}) GROUP BY name",
+            [name for name in items if name not in previous]))
+        versions, replaced = {}, []
+        for name, commands in items.items():
+            if name not in previous:
+                versions[name] = (deleted.get(name, 0) + 1, now)
+                continue
+            _, old_commands, version, updated = previous[name]
+            if old_commands == commands:
+                versions[name] = (version, updated)
+            else:
+                replaced.append((name, version, old_commands, updated))
+                versions[name] = (version + 1, now)
+        self._archive(db, replaced)
+        return versions
+
+    def _bodies(self, blobs):
+        """Turn macro_blobs.lines values back into lists of commands (None stays None)."""
+        bodies = [[lines[start:start + HASH_SIZE] for start in range(0, len(lines), HASH_SIZE)]
+                  if lines is not None else None for lines in blobs]
+        texts = dict(self._select_in(self.connection, "SELECT hash, text FROM macro_lines WHERE hash IN ({})",
+                                     {digest for body in bodies if body for digest in body}))
+        return [[texts[digest] for digest in body] if body is not None else None for body in bodies]
+
+    @staticmethod
+    def _select_in(db, query, values):
+        """Run a query with an "IN ({})" clause over values in batches and yield all rows."""
+        values = list(values)
+        for start in range(0, len(values), SQL_BATCH_SIZE):
+            batch = values[start:start + SQL_BATCH_SIZE]
+            yield from db.execute(query.format(",".join("?" * len(batch))), batch)
+
+    def _upsert(self, db, items, pending=None):
+        """Insert or replace macros and index them.
+
+        With pending, a pair of added/removed posting dicts, the index changes are merged
+        into it for a later _update_postings call instead of being written right away.
+        """
+        items = dict(items)
+        previous = {name: (rowid, json.loads(commands), version, updated)
+                    for rowid, name, commands, version, updated in self._select_in(
+                        db, "SELECT rowid, name, commands, version, updated FROM macros WHERE name IN ({})", items)}
+        versions = self._next_versions(db, items, previous)
+        db.executemany(
+            "INSERT INTO macros (name, commands, compiled, version, updated) VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT(name) DO UPDATE SET commands = excluded.commands, compiled = excluded.compiled, "
+            "version = excluded.version, updated = excluded.updated",
+            ((name, json.dumps(commands), self._plan_json(db, name, commands, items), *versions[name])
+             for name, commands in items.items()))
+        self._update_deps(db, items)
+        self._replan_dependants(db, items, exclude=items)
+        rowids = dict(self._select_in(db, "SELECT name, rowid FROM macros WHERE name IN ({})", items))
+
+        added, removed = pending or (defaultdict(set), defaultdict(set))
+        for name, commands in items.items():
+            grams = macro_trigrams(name, commands)
+            old_grams = macro_trigrams(name, previous[name][1]) if name in previous else set()
+            for gram in grams - old_grams:
+                added[gram].add(rowids[name])
+            for gram in old_grams - grams:
+                # The gram may have been added earlier in the same pending set
+                added[gram].discard(rowids[name])
+                removed[gram].add(rowids[name])
+        if pending is None:
+            self._update_postings(db, added, removed)
+
+    def _update_postings(self, db, added, removed):
+        """Apply per-trigram sets of added and removed rowids to the sorted posting lists."""
+        grams = set(added) | set(removed)
+        postings = dict(self._select_in(db, "SELECT gram, ids FROM macro_grams WHERE gram IN ({})", grams))
+        updates, deletes = [], []
+        for gram in grams:
+            ids = array("q", postings.get(gram, b""))
+            dropped, new_ids = removed.get(gram, ()), sorted(added.get(gram, ()))
+            if not dropped and new_ids and (not ids or new_ids[0] > ids[-1]):
+                # New macros get the highest rowids, so bulk inserts usually just append
+                ids.extend(new_ids)
+            elif len(dropped) + len(new_ids) > len(ids) // 64:
+                # Rebuilding beats shifting the array once per rowid for bulk changes
+                ids = array("q", sorted(set(ids).difference(dropped).union(new_ids)))
+            else:
+                for rowid in dropped:
+                    index = bisect_left(ids, rowid)
+                    if index < len(ids) and ids[index] == rowid:
+                        del ids[index]
+                for rowid in new_ids:
+                    index = bisect_left(ids, rowid)
+                    if index == len(ids) or ids[index] != rowid:
+                        ids.insert(index, rowid)
+            if ids:
+                updates.append((gram, ids.tobytes()))
+            else:
+                deletes.append((gram,))
+        db.executemany("INSERT OR REPLACE INTO macro_grams (gram, ids) VALUES (?, ?)", updates)
+        db.executemany("DELETE FROM macro_grams WHERE gram = ?", deletes)
+
+    def get(self, name):
+        row = self.connection.execute("SELECT commands FROM macros WHERE name = ?", (name,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def contains(self, name):
+        return self.connection.execute("SELECT 1 FROM macros WHERE name = ?", (name,)).fetchone() is not None
+
+    def get_templates(self, name):
+        row = self.connection.execute("SELECT commands, compiled FROM macros WHERE name = ?", (name,)).fetchone()
+        if row is None:
+            return None
+        if row[1] is None:
+            # No plan means a child is missing; flattening again reports which one
+            return compile_commands(flatten(name, json.loads(row[0]), self.get))
+        return [Template.from_json(data) for data in json.loads(row[1])]
+
+    def dependants(self, name):
+        return [row[0] for row in self.connection.execute(
+            "SELECT parent FROM macro_deps WHERE child = ? ORDER BY parent", (name,))]
+
+    def put_many(self, items):
+        items = list(items)
+        with self._transaction() as db:
+            self._upsert(db, items)
+        self._changed([name for name, _ in items])
+
+    def put_batches(self, batches):
+        # One transaction for the whole import: it lands completely or not at all
+        with self._transaction() as db:
+            pending, pending_rows = (defaultdict(set), defaultdict(set)), 0
+            for batch in batches:
+                self._upsert(db, batch, pending)
+                pending_rows += len(batch)
+                # Rewriting each posting list once per many batches rather than once per batch
+                if pending_rows >= POSTING_FLUSH_ROWS:
+                    self._update_postings(db, *pending)
+                    pending, pending_rows = (defaultdict(set), defaultdict(set)), 0
+            self._update_postings(db, *pending)
+        self._changed()
+
+    def get_many(self, names):
+        return {name: json.loads(commands) for name, commands in self._select_in(
+            self.connection, "SELECT name, commands FROM macros WHERE name IN ({})", names)}
+
+    def _delete_rows(self, db, rows):
+        """Delete (rowid, name, commands, version, updated) rows, keeping their history."""
+        names = [name for _, name, _, _, _ in rows]
+        db.executemany("DELETE FROM macros WHERE rowid = ?", ((rowid,) for rowid, *_ in rows))
+        removed = defaultdict(set)
+        for rowid, name, commands, _, _ in rows:
+            for gram in macro_trigrams(name, json.loads(commands)):
+                removed[gram].add(rowid)
+        self._update_postings(db, {}, removed)
+        # Rows naming these macros as children stay, so their users are planned again if they come back
+        db.executemany("DELETE FROM macro_deps WHERE parent = ?", ((name,) for name in names))
+        self._replan_dependants(db, names)
+        now = time.time()
+        self._archive(db, chain.from_iterable(
+            ((name, version, json.loads(commands), updated), (name, version + 1, None, now))
+            for _, name, commands, version, updated in rows))
+
+    def delete(self, name):
+        with self._transaction() as db:
+            row = db.execute("SELECT rowid, name, commands, version, updated FROM macros WHERE name = ?",
+                             (name,)).fetchone()
+            if row is None:
+                return False
+            self._delete_rows(db, [row])
+        self._changed([name])
+        return True
+
+    def items(self):
+        for name, commands in self.connection.execute("SELECT name, commands FROM macros ORDER BY rowid"):
+            yield name, json.loads(commands)
+
+    def names(self):
+        return [row[0] for row in self.connection.execute("SELECT name FROM macros ORDER BY rowid")]
+
+    def summaries(self):
+        return self.connection.execute("SELECT name, json_extract(commands, '$[0]') FROM macros ORDER BY rowid")
+
+    def replace_all(self, macros):
+        with self._transaction() as db:
+            # Macros are updated in place rather than dropped, so they keep their history
+            rows = db.execute("SELECT rowid, name, commands, version, updated FROM macros").fetchall()
+            self._delete_rows(db, [row for row in rows if row[1] not in macros])
+            self._upsert(db, macros.items())
+        self._changed()
+
+    def current_version(self, name):
+        row = self.connection.execute("SELECT version FROM macros WHERE name = ?", (name,)).fetchone()
+        return row[0] if row else None
+
+    def versions(self, name, limit=None):
+        current = self.connection.execute("SELECT version, updated, commands FROM macros WHERE name = ?",
+                                          (name,)).fetchone()
+        if limit is not None and current is not None:
+            limit -= 1
+        # LIMIT -1 is no limit
+        rows = self.connection.execute(
+            "SELECT version, created, lines FROM macro_versions LEFT JOIN macro_blobs ON macro_blobs.hash = blob "
+            "WHERE name = ? ORDER BY version DESC LIMIT ?", (name, -1 if limit is None else limit)).fetchall()[::-1]
+        versions = [MacroVersion(number, created, commands) for (number, created, _), commands
+                    in zip(rows, self._bodies([row[2] for row in rows]))]
+        if current is not None:
+            versions.append(MacroVersion(current[0], current[1], json.loads(current[2])))
+        return versions
+
+    def get_version(self, name, number):
+        row = self.connection.execute("SELECT commands FROM macros WHERE name = ? AND version = ?",
+                                      (name, number)).fetchone()
+        if row is not None:
+            return json.loads(row[0])
+        row = self.connection.execute(
+            "SELECT lines FROM macro_versions LEFT JOIN macro_blobs ON macro_blobs.hash = blob "
+            "WHERE name = ? AND version = ?", (name, number)).fetchone()
+        return self._bodies([row[0]])[0] if row else None
+
+    def search(self, query, limit=20):
+        query = query.strip()
+        if len(query) < GRAM_SIZE:
+            # Matched against the decoded lines, not their JSON, where quotes and escapes would match
+            escaped = query.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+            pattern = f"%{escaped}%"
+            candidates = self.connection.execute(
+                "SELECT name, commands FROM macros WHERE name LIKE ?1 ESCAPE '\\' OR EXISTS "
+                "(SELECT 1 FROM json_each(commands) WHERE value LIKE ?1 ESCAPE '\\') LIMIT ?2",
+                (pattern, SEARCH_CANDIDATES)).fetchall()
+        else:
+            grams = trigrams(query)
+            postings = [array("q", ids) for _, ids in self._select_in(
+                self.connection, "SELECT gram, ids FROM macro_grams WHERE gram IN ({})", grams)]
+            hits = Counter(chain.from_iterable(postings))
+            threshold = MIN_GRAM_OVERLAP * len(grams)
+            best = [rowid for rowid, count in hits.most_common(SEARCH_CANDIDATES) if count >= threshold]
+            candidates = self._select_in(self.connection,
+                                         "SELECT name, commands FROM macros WHERE rowid IN ({})", best)
+        return rank(query, ((name, json.loads(commands)) for name, commands in candidates), limit)
+
+    def snapshot(self):
+        """Read every row and posting list in one consistent pass, for SnapshotMacroStore."""
+        # A deferred transaction is enough for a consistent read in WAL mode
+        self.connection.execute("BEGIN")
+        try:
+            rows = self.connection.execute(
+                "SELECT rowid, name, commands, compiled, version FROM macros ORDER BY rowid").fetchall()
+            grams = dict(self.connection.execute("SELECT gram, ids FROM macro_grams"))
+        finally:
+            self.connection.execute("COMMIT")
+        return rows, grams
+
+
+class SnapshotMacroStore(MacroStore):
+    """An in-memory copy of a SqliteMacroStore, kept by the daemon and shared with the
+    processes it forks.
+
+    Reads, compiled templates and the trigram search are served from memory. Writes go to
+    the database through a connection opened on first use, as connections must not be
+    used on both sides of a fork. After a write this copy is stale, so later reads go to
+    the database too.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        # Only the daemon itself reads through this one
+        self._reader = SqliteMacroStore(path)
+        self._data_version = None
+        self._backing = None
+        self.refresh()
+
+    def refresh(self):
+        """Reload the copy if another connection committed since the last load; return True if it did."""
+        # data_version only changes for commits made through other connections
+        data_version = self._reader.connection.execute("PRAGMA data_version").fetchone()[0]
+        if data_version == self._data_version:
+            return False
+        rows, self.grams = self._reader.snapshot()
+        self._data_version = data_version
+        # JSON is only decoded for the macros a command actually looks at
+        self.rows = {name: (rowid, commands, compiled, version) for rowid, name, commands, compiled, version in rows}
+        self.names_by_rowid = {rowid: name for rowid, name, _, _, _ in rows}
+        self.stale = False
+        return True
+
+    def _database(self):
+        if self._backing is None:
+            self._backing = SqliteMacroStore(self.path)
+            self._backing.on_change = self.on_change
+        return self._backing
+
+    def get(self, name):
+        if self.stale:
+            return self._database().get(name)
+        row = self.rows.get(name)
+        return json.loads(row[1]) if row else None
+
+    def contains(self, name):
+        return self._database().contains(name) if self.stale else name in self.rows
+
+    def get_templates(self, name):
+        row = self.rows.get(name)
+        if self.stale or (row and row[2] is None):
+            return self._database().get_templates(name)
+        return [Template.from_json(data) for data in json.loads(row[2])] if row else None
+
+    def dependants(self, name):
+        return self._database().dependants(name)
+
+    def versions(self, name, limit=None):
+        return self._database().versions(name, limit)
+
+    def current_version(self, name):
+        if self.stale:
+            return self._database().current_version(name)
+        row = self.rows.get(name)
+        return row[3] if row else None
+
+    def get_version(self, name, number):
+        return self._database().get_version(name, number)
+
+    def items(self):
+        if self.stale:
+            yield from self._database().items()
+            return
+        for name, (_, commands, _, _) in self.rows.items():
+            yield name, json.loads(commands)
+
+    def names(self):
+        return self._database().names() if self.stale else list(self.rows)
+
+    def summaries(self):
+        return self._database().summaries()
+
+    def get_many(self, names):
+        if self.stale:
+            return self._database().get_many(names)
+        return {name: json.loads(self.rows[name][1]) for name in names if name in self.rows}
+
+    def put_many(self, items):
+        self.stale = True
+        self._database().put_many(items)
+
+    def put_batches(self, batches):
+        self.stale = True
+        self._database().put_batches(batches)
+
+    def delete(self, name):
+        self.stale = True
+        return self._database().delete(name)
+
+    def replace_all(self, macros):
+        self.stale = True
+        self._database().replace_all(macros)
+
+    def search(self, query, limit=20):
+        query = query.strip()
+        if self.stale or len(query) < GRAM_SIZE:
+            return self._database().search(query, limit)
+        grams = trigrams(query)
+        postings = [array("q", self.grams[gram]) for gram in grams if gram in self.grams]
+        hits = Counter(chain.from_iterable(postings))
+        threshold = MIN_GRAM_OVERLAP * len(grams)
+        names = [self.names_by_rowid[rowid] for rowid, count in hits.most_common(SEARCH_CANDIDATES)
+                 if count >= threshold]
+        return rank(query, ((name, json.loads(self.rows[name][1])) for name in names), limit)
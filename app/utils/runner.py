@@ -0,0 +1,165 @@
+import os
+import platform
+import signal
+import subprocess
+import time
+
+import click
+
+from app.utils.hooks import HOOKS
+from app.utils.shell_session import ShellSession, controlling_terminal, hand_terminal
+from app.utils.steps import StepResult, run_order
+from app.utils.timeouts import TIMEOUT_STATUS, format_duration, retry_delay, signal_group, step_limit, stop_group
+
+
+def _run_sudo(args, timeout=None):
+    """Run sudo like subprocess.run(check=True), killing everything it started on timeout.
+
+    With a timeout sudo gets a process group of its own, and the terminal for its password
+    prompt, so the command can be stopped with every process it started.
+    """
+    if timeout is None:
+        subprocess.run(args, check=True)
+        return
+    process = subprocess.Popen(args, process_group=0)
+    terminal = controlling_terminal()
+    hand_terminal(terminal, process.pid)
+    # It may have tried to read the terminal before it was handed over, and been stopped
+    signal_group(process.pid, signal.SIGCONT)
+    try:
+        returncode = process.wait(timeout)
+    except subprocess.TimeoutExpired:
+        stop_group(process.pid, process.poll)
+        process.wait()
+        raise
+    finally:
+        hand_terminal(terminal, os.getpgrp())
+    if returncode:
+        raise subprocess.CalledProcessError(returncode, args)
+
+
+def run_as_admin(cmd, timeout=None):
+    """Run a command with administrative privileges and return its exit status.
+
+    Raises subprocess.TimeoutExpired if it runs for longer than timeout seconds.
+    """
+    system = platform.system()
+
+    try:
+        if system in ["Darwin"]:
+            # Use 'sudo' on Linux/macOS
+            click.echo(click.style(f"Running as admin: {cmd}", fg="yellow"))
+            _run_sudo(["sudo", "sh", "-c", cmd], timeout)
+            return 0
+        else:
+            click.echo(click.style("Unsupported platform for admin execution.", fg="red"))
+    except subprocess.TimeoutExpired:
+        raise
+    except subprocess.CalledProcessError as e:
+        click.echo(click.style(f"Error: Command failed with error: {e}", fg="red"))
+        return e.returncode
+    except Exception as e:
+        click.echo(click.style(f"Error: Unable to elevate privileges: {e}", fg="red"))
+    return 1
+
+
+class SequentialRunner:
+    """Run steps one after another in a single shell session, timing each of them.
+
+    Steps run in macro order, except that a step waits for the steps it `needs=`. A step
+    is skipped when a step it depends on did not succeed, as with DagRunner.
+
+    With a run given, step events are sent to the registered hooks, and the steps' output
+    is relayed to them if any takes it. With a checkpoint
+    given, the steps completed before the first failure are recorded, and a resumed run
+    skips the steps a previous run completed up to its first failure. Steps are retried
+    and timed out as their annotations ask, and none start once the deadline has passed.
+    """
+
+    def __init__(self, steps, admin=False, cache=None, run=None, checkpoint=None, deadline=None):
+        self.steps = steps
+        self.admin = admin
+        self.cache = cache
+        self.run_info = run
+        self.checkpoint = checkpoint
+        self.deadline = deadline
+
+    def run(self):
+        results = []
+        self.unbroken = True
+        self.succeeded = {}
+        resuming = self.checkpoint is not None and bool(self.checkpoint.resumed)
+        # Steps may have changed directory; exported variables are not carried over
+        cwd = self.checkpoint.cwd if resuming else None
+        output = self._output if self.run_info is not None and HOOKS.wants("output") else None
+        with ShellSession(cwd=cwd if cwd and os.path.isdir(cwd) else None, output=output) as session:
+            for step in run_order(self.steps):
+                self.step = step
+                # Skipped steps are started too, so hooks see a step_start for every step_end
+                if self.run_info is not None:
+                    HOOKS.emit("step_start", self.run_info, step)
+                if not all(self.succeeded[dep] for dep in step.deps):
+                    self._finish(results, StepResult(step, "skipped"))
+                    continue
+                if self.deadline is not None and self.deadline.expired:
+                    self._finish(results, StepResult(step, "skipped"))
+                    continue
+                if resuming and self.checkpoint.is_done(step):
+                    click.echo(click.style(f"→ {step.command} (done in previous run)", fg='blue'))
+                    self._finish(results, StepResult(step, "resumed", 0))
+                    continue
+                resuming = False
+                cwd = session.cwd
+                key, hit = self.cache.lookup(step, step.command, cwd) if self.cache else (None, False)
+                if hit:
+                    click.echo(click.style(f"→ {step.command} (cached)", fg='blue'))
+                    self._finish(results, StepResult(step, "cached", 0), session.cwd)
+                    continue
+                click.echo(click.style(f"→ {step.command}", fg='green'))
+                started = time.monotonic()
+                attempts = 1
+                while True:
+                    status, returncode, cpu = self._attempt(session, step)
+                    delay = None if status == "ok" else retry_delay(step, attempts, self.deadline)
+                    if delay is None:
+                        break
+                    attempts += 1
+                    click.echo(click.style(f"↻ retrying in {delay:.1f}s (attempt {attempts} of "
+                                           f"{step.retries + 1})", fg='yellow'))
+                    time.sleep(delay)
+                if key and returncode == 0:
+                    self.cache.store(key, step, step.command, cwd)
+                self._finish(results, StepResult(step, status, returncode, time.monotonic() - started, cpu,
+                                                 attempts), session.cwd)
+                click.echo("")
+        return results
+
+    def _attempt(self, session, step):
+        """Run the step once and return its status, exit status and CPU time."""
+        limit = step_limit(step, self.deadline)
+        if self.admin:
+            try:
+                returncode, cpu, timed_out = run_as_admin(step.command, limit), None, False
+            except subprocess.TimeoutExpired:
+                returncode, cpu, timed_out = TIMEOUT_STATUS, None, True
+        else:
+            returncode = session.run(step.command, limit)
+            cpu, timed_out = session.last_cpu, session.timed_out
+        if timed_out:
+            click.echo(click.style(f"timed out after {format_duration(limit)}", fg='red'))
+            return "timeout", returncode, None
+        return "ok" if returncode == 0 else "failed", returncode, cpu
+
+    def _output(self, data, err):
+        HOOKS.emit("output", self.run_info, self.step, data, err)
+
+    def _finish(self, results, result, cwd=None):
+        # Only the unbroken run of completed steps from the start can be resumed from
+        if not result.succeeded:
+            self.unbroken = False
+        elif self.checkpoint is not None and self.unbroken and result.status != "resumed":
+            self.checkpoint.record(result.step, cwd)
+        self.succeeded[result.step.id] = result.succeeded
+        results.append(result)
+        if self.run_info is not None:
+            HOOKS.emit("step_end", self.run_info, result.step, result)
@@ -0,0 +1,79 @@
+import re
+
+import click
+
+GRAM_SIZE = 3
+# A macro must share at least this fraction of the query's trigrams to be ranked
+MIN_GRAM_OVERLAP = 0.5
+
+
+def trigrams(text):
+    """Return the set of lower-cased trigrams in text; shorter text is its own single gram."""
+    text = text.lower()
+    if len(text) < GRAM_SIZE:
+        return {text} if text else set()
+    return {text[i:i + GRAM_SIZE] for i in range(len(text) - GRAM_SIZE + 1)}
+
+
+def macro_trigrams(name, commands):
+    grams = trigrams(name)
+    for command in commands:
+        grams |= trigrams(command)
+    return grams
+
+
+def score(query, name, commands):
+    """Rank a macro against a query; name matches outweigh matches in the commands."""
+    query = query.lower()
+    name_lower = name.lower()
+    body_lower = "\n".join(commands).lower()
+
+    value = 0.0
+    if name_lower == query:
+        value += 100
+    elif name_lower.startswith(query):
+        value += 60
+    elif query in name_lower:
+        value += 40
+    if query in body_lower:
+        value += 20
+
+    query_grams = trigrams(query)
+    if query_grams:
+        value += 20 * len(query_grams & trigrams(name_lower)) / len(query_grams)
+        value += 10 * len(query_grams & trigrams(body_lower)) / len(query_grams)
+    # Prefer shorter names when everything else is equal
+    return value - len(name) * 0.01
+
+
+def rank(query, candidates, limit):
+    """Sort (name, commands) candidates by score, dropping those that barely match."""
+    query_grams = trigrams(query)
+    threshold = MIN_GRAM_OVERLAP * len(query_grams)
+    ranked = []
+    for name, commands in candidates:
+        if len(query) < GRAM_SIZE:
+            if not any(query.lower() in text.lower() for text in [name, *commands]):
+                continue
+        elif len(query_grams & macro_trigrams(name, commands)) < threshold:
+            continue
+        ranked.append((score(query, name, commands), name, commands))
+    ranked.sort(key=lambda item: item[0], reverse=True)
+    return [(name, commands) for _, name, commands in ranked[:limit]]
+
+
+def highlight(text, query):
+    """Highlight every case-insensitive occurrence of the query (or its words) in text."""
+    words = sorted({word for word in query.split() if word} | {query.strip()}, key=len, reverse=True)
+    if not words[0]:
+        # An empty pattern would match, and style, the gap between every two characters
+        return text
+    pattern = re.compile("|".join(re.escape(word) for word in words if word), re.IGNORECASE)
+    return pattern.sub(lambda match: click.style(match.group(0), fg="yellow", bold=True), text)
+
+
+def matching_lines(commands, query):
+    query_grams = trigrams(query)
+    threshold = MIN_GRAM_OVERLAP * len(query_grams)
+    return [command for command in commands
+            if query.lower() in command.lower() or len(query_grams & trigrams(command)) >= max(threshold, 1)]
@@ -0,0 +1,157 @@
+import os
+import shlex
+
+from app.utils.config_utils import MACRO_DIR
+
+JOURNAL_DIR = MACRO_DIR / "journal"
+
+# Each hook appends NUL-terminated "exit code<TAB>start<TAB>end<TAB>command" records to
+# ~/.termo/journal/$TERMO_SESSION, but only while a recording is in progress (HEAD exists)
+ZSH_HOOK = r'''# termo recording hooks, load with: eval "$(tm hook zsh)"
+export TERMO_SESSION=$$
+zmodload zsh/datetime 2>/dev/null
+autoload -Uz add-zsh-hook
+command mkdir -p "$HOME/.termo/journal"
+
+_termo_preexec() {
+  unset _termo_cmd
+  [[ -e "$HOME/.termo/HEAD" ]] || return 0
+  _termo_cmd="$1"
+  _termo_start=$EPOCHREALTIME
+}
+
+_termo_precmd() {
+  local rc=$?
+  (( ${+_termo_cmd} )) || return 0
+  [[ -e "$HOME/.termo/HEAD" ]] &&
+    printf '%s\t%s\t%s\t%s\0' "$rc" "$_termo_start" "$EPOCHREALTIME" "$_termo_cmd" \
+      >>| "$HOME/.termo/journal/$TERMO_SESSION"
+  unset _termo_cmd
+}
+
+add-zsh-hook preexec _termo_preexec
+add-zsh-hook precmd _termo_precmd
+'''
+
+BASH_HOOK = r'''# termo recording hooks, load with: eval "$(tm hook bash)"
+export TERMO_SESSION=$$
+command mkdir -p "$HOME/.termo/journal"
+
+_termo_preexec() {
+  [[ -n "${_termo_armed-}" && -z "${COMP_LINE-}" ]] || return 0
+  [[ "$BASH_COMMAND" != _termo_precmd* ]] || return 0
+  _termo_armed=
+  [[ -e "$HOME/.termo/HEAD" ]] || return 0
+  local line
+  line=$(HISTTIMEFORMAT= builtin history 1)
+  [[ $line =~ ^\ *([0-9]+)\*?\ +(.*)$ ]] || return 0
+  # Commands hidden from history (ignorespace, ignoredups) leave the last entry unchanged
+  [[ "${BASH_REMATCH[1]}" != "${_termo_histnum-}" ]] || return 0
+  _termo_histnum=${BASH_REMATCH[1]}
+  _termo_cmd=${BASH_REMATCH[2]}
+  _termo_start=${EPOCHREALTIME:-$SECONDS}
+}
+
+_termo_precmd() {
+  local rc=$?
+  if [[ -n "${_termo_cmd+x}" && -e "$HOME/.termo/HEAD" ]]; then
+    printf '%s\t%s\t%s\t%s\0' "$rc" "$_termo_start" "${EPOCHREALTIME:-$SECONDS}" "$_termo_cmd" \
+      >> "$HOME/.termo/journal/$TERMO_SESSION"
+  fi
+  unset _termo_cmd
+  _termo_armed=1
+}
+
+trap '_termo_preexec' DEBUG
+PROMPT_COMMAND="_termo_precmd${PROMPT_COMMAND:+;$PROMPT_COMMAND}"
+'''
+
+FISH_HOOK = r'''# termo recording hooks, load with: tm hook fish | source
+set -gx TERMO_SESSION $fish_pid
+command mkdir -p "$HOME/.termo/journal"
+
+function _termo_postexec --on-event fish_postexec
+    set -l rc $status
+    test -e "$HOME/.termo/HEAD"; or return 0
+    test -n "$argv[1]"; or return 0
+    printf '%s\t0\t%s\t%s\0' $rc (math $CMD_DURATION / 1000) "$argv[1]" >> "$HOME/.termo/journal/$TERMO_SESSION"
+end
+'''
+
+HOOK_SCRIPTS = {"zsh": ZSH_HOOK, "bash": BASH_HOOK, "fish": FISH_HOOK}
+
+# termo's own recording commands never belong in a macro
+_RECORDING_COMMANDS = {"new", "save", "cancel"}
+
+
+class JournalEntry:
+    """One command captured by the shell hooks while recording."""
+
+    __slots__ = ("command", "returncode", "duration")
+
+    def __init__(self, command, returncode, duration):
+        self.command = command
+        self.returncode = returncode
+        self.duration = duration
+
+    @property
+    def failed(self):
+        return self.returncode not in (0, None)
+
+
+def hook_script(shell):
+    """Return the hook script for a shell, raising ValueError for shells without hooks."""
+    if shell not in HOOK_SCRIPTS:
+        raise ValueError(f"No recording hooks for '{shell}'. Supported shells: {', '.join(HOOK_SCRIPTS)}")
+    return HOOK_SCRIPTS[shell]
+
+
+def current_session():
+    """Return the session id exported by the hooks, or None when the shell has no hooks loaded."""
+    session = os.environ.get("TERMO_SESSION", "")
+    return session if session.isdigit() else None
+
+
+def journal_path(session):
+    return JOURNAL_DIR / session
+
+
+def _is_recording_command(command):
+    try:
+        tokens = shlex.split(command)
+    except ValueError:
+        tokens = command.split()
+    return len(tokens) >= 2 and tokens[0] in ("tm", "termo") and tokens[1] in _RECORDING_COMMANDS
+
+
+def _seconds(value):
+    # EPOCHREALTIME uses the locale's decimal separator
+    try:
+        return float(value.replace(",", "."))
+    except ValueError:
+        return None
+
+
+def read_journal(session):
+    """Return the JournalEntries recorded in a session, oldest first."""
+    try:
+        data = journal_path(session).read_bytes()
+    except FileNotFoundError:
+        return []
+
+    entries = []
+    for record in data.decode("utf-8", errors="replace").split("\0"):
+        fields = record.split("\t", 3)
+        if len(fields) != 4 or not fields[3].strip():
+            continue
+        returncode, start, end, command = fields
+        if _is_recording_command(command):
+            continue
+        start, end = _seconds(start), _seconds(end)
+        duration = end - start if start is not None and end is not None else None
+        entries.append(JournalEntry(command.strip(), int(returncode) if returncode.isdigit() else None, duration))
+    return entries
+
+
+def clear_journal(session):
+    journal_path(session).unlink(missing_ok=True)
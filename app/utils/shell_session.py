@@ -0,0 +1,300 @@
+import os
+import re
+import secrets
+import shlex
+import signal
+import select
+import subprocess
+import sys
+import time
+from contextlib import contextmanager
+
+import click
+
+from app.utils.timeouts import TIMEOUT_STATUS, signal_group, stop_group
+
+# Signals termo passes on to a running step; the last three end termo once the step is gone
+FORWARDED_SIGNALS = (signal.SIGINT, signal.SIGTERM, signal.SIGHUP, signal.SIGQUIT)
+
+# Relayed step output is read in chunks rather than lines, like DagRunner's
+READ_CHUNK = 65536
+
+# POSIX `times` prints "<user>m<seconds>s <sys>m<seconds>s" for the shell, then for its children
+TIMES_PATTERN = re.compile(r"(\d+)m([\d.]+)s\s+(\d+)m([\d.]+)s")
+
+
+def controlling_terminal():
+    """Our stdin's fd if it is a terminal whose foreground we hold, otherwise None."""
+    try:
+        fd = sys.stdin.fileno()
+        return fd if os.isatty(fd) and os.tcgetpgrp(fd) == os.getpgrp() else None
+    except (OSError, ValueError):
+        return None
+
+
+def hand_terminal(terminal, pgid):
+    """Make pgid the terminal's foreground process group, if there is a terminal."""
+    if terminal is None:
+        return
+    # Taking the terminal back from the background would otherwise stop us
+    previous_handler = signal.signal(signal.SIGTTOU, signal.SIG_IGN)
+    try:
+        os.tcsetpgrp(terminal, pgid)
+    except OSError:
+        pass
+    finally:
+        signal.signal(signal.SIGTTOU, previous_handler)
+
+
+def _is_open(fd):
+    try:
+        os.fstat(fd)
+    except OSError:
+        return False
+    return True
+
+
+@contextmanager
+def _single_digit_fds(fds):
+    """Yield descriptors below 10 standing for fds while a child process is started.
+
+    dash, the usual /bin/sh, rejects larger descriptors in redirections. Free ones are
+    used where there are any; failing that, one is borrowed for the moment it takes to
+    start the child, and restored after.
+    """
+    mapped, borrowed = [], []
+    for fd in fds:
+        if fd < 10:
+            mapped.append(fd)
+            continue
+        candidates = [number for number in range(3, 10) if number not in mapped and number not in fds]
+        target = next((number for number in candidates if not _is_open(number)), candidates[0])
+        saved = os.dup(target) if _is_open(target) else None
+        borrowed.append((target, saved, saved is not None and os.get_inheritable(target)))
+        os.dup2(fd, target)
+        mapped.append(target)
+    try:
+        yield mapped
+    finally:
+        for target, saved, inheritable in borrowed:
+            if saved is None:
+                os.close(target)
+            else:
+                os.dup2(saved, target, inheritable)
+                os.close(saved)
+
+
+def default_shell():
+    """Use the user's shell when it understands `source`, otherwise fall back to POSIX sh."""
+    shell = os.environ.get("SHELL", "")
+    if os.path.basename(shell) in ("bash", "zsh"):
+        return shell
+    return "/bin/sh"
+
+
+class ShellSession:
+    """A single long-lived shell that runs macro steps one after another.
+
+    Steps are sent over the shell's stdin and evaluated in the shell itself, so `cd`,
+    exported variables and sourced scripts carry over to later steps. After each step the
+    shell writes a sentinel line with the exit status to a private pipe, which is how the
+    end of a step is detected. The step's own stdin, stdout and stderr are the terminal's.
+    With an output callback, the step's stdout and stderr go through pipes instead: each
+    chunk is copied to ours and passed to output(data, err), err being True for stderr.
+
+    The shell runs in a process group of its own, which holds the terminal while a step
+    runs, so a step that runs out of time can be killed with every process it started.
+    """
+
+    def __init__(self, shell=None, cwd=None, output=None):
+        self.shell = shell or default_shell()
+        self.output = output
+        self.token = f"__termo_{secrets.token_hex(8)}__"
+        self.process = None
+        # CPU time of the last step's processes, from the shell's `times` builtin
+        self.last_cpu = None
+        # Steps may `cd`; this is the shell's working directory after the last step
+        self.cwd = cwd or os.getcwd()
+        # Where the shell starts, e.g. where a resumed run left off
+        self.start_cwd = cwd
+        # Whether the last step was killed for running out of time
+        self.timed_out = False
+        self._children_cpu = (0.0, 0.0)
+        # With an output callback: read end -> whether it carries stderr, and the write ends' numbers in the shell
+        self.relayed = {}
+        self.output_fds = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _start(self):
+        status_read, status_write = os.pipe()
+        try:
+            stdin_fd = os.dup(sys.stdin.fileno())
+        except (OSError, ValueError):
+            stdin_fd = os.open(os.devnull, os.O_RDONLY)
+        fds = [status_write, stdin_fd]
+        if self.output is not None:
+            for err in (False, True):
+                read_fd, write_fd = os.pipe()
+                self.relayed[read_fd] = err
+                fds.append(write_fd)
+        # The descriptors are named in the script, so they must be ones every shell accepts
+        with _single_digit_fds(fds) as mapped:
+            self.status_fd, self.stdin_fd, *self.output_fds = mapped
+            self.process = subprocess.Popen([self.shell, "-s"],
+                                            stdin=subprocess.PIPE,
+                                            cwd=self.start_cwd,
+                                            pass_fds=mapped,
+                                            process_group=0)
+        for fd in fds:
+            os.close(fd)
+        self.status = os.fdopen(status_read, "r")
+        self._children_cpu = (0.0, 0.0)
+        self.terminal = controlling_terminal()
+
+    def _script(self, command):
+        # eval keeps state changes in this shell; the brace group gives the step the
+        # terminal as stdin instead of the pipe carrying our script.
+        closed = f"{self.status_fd}>&- {self.stdin_fd}<&-"
+        redirects = f"<&{self.stdin_fd}"
+        if self.output_fds:
+            stdout_fd, stderr_fd = self.output_fds
+            closed += f" {stdout_fd}>&- {stderr_fd}>&-"
+            redirects += f" >&{stdout_fd} 2>&{stderr_fd}"
+        return (f"{{ eval {shlex.quote(command)} {closed}\n}} {redirects}\n"
+                f"{{ printf '%s %d %s\\n' {self.token} \"$?\" \"$PWD\"; times; }} >&{self.status_fd}\n")
+
+    def run(self, command, timeout=None):
+        """Run one step in the session and return its exit status.
+
+        A step still running after timeout seconds is killed, along with the shell, and
+        its status is TIMEOUT_STATUS. The next step starts a new shell in the same directory.
+        """
+        if self.process is None:
+            self._start()
+        self.timed_out = False
+        pgid = self.process.pid
+        received = []
+
+        # Like os.system, let Ctrl-C interrupt the step rather than termo itself
+        def forward(signum, frame):
+            received.append(signum)
+            signal_group(pgid, signum)
+
+        previous_handlers = {signum: signal.signal(signum, forward) for signum in FORWARDED_SIGNALS}
+        hand_terminal(self.terminal, pgid)
+        try:
+            try:
+                self.process.stdin.write(self._script(command).encode())
+                self.process.stdin.flush()
+            except BrokenPipeError:
+                return self._restart()
+            return self._wait_for_sentinel(None if timeout is None else time.monotonic() + timeout)
+        finally:
+            hand_terminal(self.terminal, os.getpgrp())
+            for signum, handler in previous_handlers.items():
+                signal.signal(signum, handler)
+            # Signals meant to end termo do so once the step has had them too
+            for signum in received:
+                if signum != signal.SIGINT:
+                    os.kill(os.getpid(), signum)
+
+    def _wait_for_sentinel(self, deadline=None):
+        if self.relayed:
+            if not self._relay_until_status(deadline):
+                return self._kill()
+        elif deadline is not None:
+            ready, _, _ = select.select([self.status], [], [], max(0.0, deadline - time.monotonic()))
+            if not ready:
+                return self._kill()
+        for line in self.status:
+            token, _, rest = line.rstrip("\n").partition(" ")
+            if token == self.token:
+                status, _, self.cwd = rest.partition(" ")
+                self._read_times()
+                return int(status)
+        # The step ended the shell (e.g. `exit`); report its status and start over next time
+        self.last_cpu = None
+        return self._restart()
+
+    def _relay_until_status(self, deadline):
+        """Relay the step's output until the shell reports its end; False if the deadline passed first."""
+        while True:
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            ready, _, _ = select.select([self.status, *self.relayed], [], [], timeout)
+            if not ready:
+                return False
+            if self.status in ready:
+                # The step wrote its output before the shell wrote the sentinel
+                self._drain()
+                return True
+            for fd in ready:
+                self._relay(fd)
+
+    def _drain(self):
+        while self.relayed:
+            ready, _, _ = select.select(list(self.relayed), [], [], 0)
+            if not ready:
+                return
+            for fd in ready:
+                self._relay(fd)
+
+    def _relay(self, fd):
+        data = os.read(fd, READ_CHUNK)
+        if not data:
+            # Only once the shell is gone; the next one gets new pipes
+            os.close(fd)
+            del self.relayed[fd]
+            return
+        err = self.relayed[fd]
+        click.echo(data, nl=False, err=err)
+        self.output(data, err)
+
+    def _read_times(self):
+        self.status.readline()
+        match = TIMES_PATTERN.search(self.status.readline())
+        if not match:
+            self.last_cpu = None
+            return
+        minutes_user, seconds_user, minutes_sys, seconds_sys = match.groups()
+        children_cpu = (int(minutes_user) * 60 + float(seconds_user), int(minutes_sys) * 60 + float(seconds_sys))
+        self.last_cpu = (children_cpu[0] - self._children_cpu[0], children_cpu[1] - self._children_cpu[1])
+        self._children_cpu = children_cpu
+
+    def _kill(self):
+        """Kill the running step and the shell with it: SIGTERM, then SIGKILL for what is left."""
+        self.timed_out = True
+        self.last_cpu = None
+        stop_group(self.process.pid, self.process.poll)
+        # The next shell carries on in the directory this one was in; its variables are lost
+        self.start_cwd = self.cwd
+        self._restart()
+        return TIMEOUT_STATUS
+
+    def _restart(self):
+        returncode = self._shutdown()
+        self.process = None
+        return returncode
+
+    def _shutdown(self):
+        try:
+            self.process.stdin.close()
+        except BrokenPipeError:
+            pass
+        returncode = self.process.wait()
+        self.status.close()
+        # The step's output up to the end of the shell is relayed before the pipes go
+        self._drain()
+        for fd in self.relayed:
+            os.close(fd)
+        self.relayed = {}
+        return returncode
+
+    def close(self):
+        if self.process is not None:
+            self._shutdown()
+            self.process = None
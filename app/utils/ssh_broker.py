@@ -0,0 +1,457 @@
+"""A local broker that keeps SSH connections open between `tm remote` runs.
+
+It is opt-in (`tm remote --broker`, or TERMO_SSH_BROKER=1), as it keeps authenticated
+connections open after `tm` exits. Like OpenSSH's ControlMaster, the first run against a
+host starts the broker, which
+connects and authenticates; later runs ask it over a Unix socket for new channels on the
+same transport and skip the TCP and SSH handshakes. Each channel is relayed over its own
+socket connection as frames: b"C" (request), then b"K" (opened) or b"F" (failed) back,
+b"I"/b"E" for stdin data and EOF, and b"O"/b"R"/b"X" for stdout, stderr and exit status.
+Transports unused for TERMO_SSH_TTL seconds are closed, checked every EXPIRE_INTERVAL
+seconds, and the broker exits once it has none left.
+"""
+import fcntl
+import hashlib
+import json
+import os
+import select
+import socket
+import struct
+import subprocess
+import sys
+import threading
+import time
+from pathlib import Path
+
+import paramiko
+
+from app.utils.config_utils import MACRO_DIR
+from app.utils.env_utils import env_number
+
+BROKER_SOCKET = MACRO_DIR / "ssh-broker.sock"
+BROKER_LOCK_FILE = MACRO_DIR / "ssh-broker.lock"
+BROKER_LOG_FILE = MACRO_DIR / "ssh-broker.log"
+IDLE_TTL = env_number("TERMO_SSH_TTL", 10 * 60)
+KEEPALIVE_INTERVAL = 30
+EXPIRE_INTERVAL = 1.0
+START_TIMEOUT = 5
+RECV_CHUNK_SIZE = 32 * 1024
+POLL_INTERVAL = 0.1
+FRAME = struct.Struct("!cI")
+EXIT_STATUS = struct.Struct("!i")
+# The directory containing the `app` package, so `python -m app.utils.ssh_broker` finds it
+PACKAGE_ROOT = Path(__file__).resolve().parents[2]
+
+
+def _send_frame(sock, kind, payload=b""):
+    sock.sendall(FRAME.pack(kind, len(payload)) + payload)
+
+
+def _recv_exact(sock, size):
+    data = b""
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            return None
+        data += chunk
+    return data
+
+
+def _recv_frame(sock):
+    """Read one frame and return (kind, payload), or (None, None) once the peer is gone."""
+    header = _recv_exact(sock, FRAME.size)
+    if header is None:
+        return None, None
+    kind, length = FRAME.unpack(header)
+    payload = _recv_exact(sock, length) if length else b""
+    return (kind, payload) if payload is not None else (None, None)
+
+
+def pool_key(user, host, port, key, password):
+    # Credentials are part of the key, so a transport is only shared by runs with the same login
+    secret = hashlib.sha256(f"{key or ''}\0{password or ''}".encode()).hexdigest()[:16]
+    return f"{user}@{host}:{port}/{secret}"
+
+
+def _ssh_connect(user, host, port, key, password):
+    client = paramiko.SSHClient()
+    client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+    if key:
+        client.connect(hostname=host, port=port, username=user, key_filename=key)
+    else:
+        client.connect(hostname=host, port=port, username=user, password=password)
+    return client
+
+
+class DirectConnection:
+    """An SSH connection owned by this process, closed when the run ends."""
+
+    def __init__(self, user, host, port, key, password):
+        self.client = _ssh_connect(user, host, port, key, password)
+
+    def open_channel(self, command):
+        channel = self.client.get_transport().open_session()
+        channel.exec_command(command)
+        return channel
+
+    def close(self):
+        self.client.close()
+
+
+class BrokerChannel:
+    """Our end of a channel relayed by the broker.
+
+    Provides the subset of paramiko's Channel API that `tm remote` uses, and can be
+    passed to select() like a real channel.
+    """
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.sock.setblocking(False)
+        self.buffer = bytearray()
+        self.stdout = bytearray()
+        self.stderr = bytearray()
+        # Framed stdin the socket has not taken yet
+        self.outgoing = bytearray()
+        self.exit_status = None
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def _parse(self):
+        while len(self.buffer) >= FRAME.size:
+            kind, length = FRAME.unpack_from(self.buffer)
+            if len(self.buffer) < FRAME.size + length:
+                return
+            payload = bytes(self.buffer[FRAME.size:FRAME.size + length])
+            del self.buffer[:FRAME.size + length]
+            if kind == b"O":
+                self.stdout += payload
+            elif kind == b"R":
+                self.stderr += payload
+            elif kind == b"X":
+                self.exit_status = EXIT_STATUS.unpack(payload)[0]
+
+    def _pump(self, block=False):
+        while self.exit_status is None:
+            if block:
+                select.select([self.sock], [], [])
+            try:
+                data = self.sock.recv(RECV_CHUNK_SIZE)
+            except BlockingIOError:
+                if not block:
+                    return
+                continue
+            if not data:
+                # The broker went away without reporting a status
+                self.exit_status = -1
+                return
+            self.buffer += data
+            self._parse()
+            if not block:
+                return
+
+    def recv_ready(self):
+        self._pump()
+        return bool(self.stdout)
+
+    def recv_stderr_ready(self):
+        self._pump()
+        return bool(self.stderr)
+
+    def recv(self, size):
+        data = bytes(self.stdout[:size])
+        del self.stdout[:size]
+        return data
+
+    def recv_stderr(self, size):
+        data = bytes(self.stderr[:size])
+        del self.stderr[:size]
+        return data
+
+    def exit_status_ready(self):
+        self._pump()
+        return self.exit_status is not None
+
+    @property
+    def eof_received(self):
+        # The broker sends the exit status once the remote output has ended
+        return self.exit_status is not None
+
+    @property
+    def closed(self):
+        return self.sock.fileno() < 0
+
+    def recv_exit_status(self):
+        self._pump(block=True)
+        return self.exit_status
+
+    def _flush(self):
+        while self.outgoing:
+            try:
+                sent = self.sock.send(self.outgoing)
+            except BlockingIOError:
+                return
+            del self.outgoing[:sent]
+
+    def _send(self, kind, payload=b""):
+        self.sock.setblocking(True)
+        try:
+            self.sock.sendall(bytes(self.outgoing) + FRAME.pack(kind, len(payload)) + payload)
+            self.outgoing.clear()
+        finally:
+            self.sock.setblocking(False)
+
+    def send_ready(self):
+        self._flush()
+        return not self.outgoing
+
+    def send(self, data):
+        """Queue up to one chunk of stdin and return how much was taken; never blocks."""
+        data = bytes(data[:RECV_CHUNK_SIZE])
+        self.outgoing += FRAME.pack(b"I", len(data)) + data
+        self._flush()
+        return len(data)
+
+    def shutdown_write(self):
+        self._send(b"E")
+
+    def close(self):
+        self.sock.close()
+
+
+class BrokerConnection:
+    """An SSH connection held by the broker; every channel is a new Unix socket connection."""
+
+    def __init__(self, user, host, port, key, password):
+        self.request = {"user": user, "host": host, "port": port, "key": key, "password": password}
+
+    def open_channel(self, command):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(str(BROKER_SOCKET))
+            _send_frame(sock, b"C", json.dumps({**self.request, "command": command}).encode())
+            kind, payload = _recv_frame(sock)
+        except OSError:
+            sock.close()
+            raise
+        if kind == b"K":
+            return BrokerChannel(sock)
+        sock.close()
+        if kind == b"F":
+            raise paramiko.SSHException(payload.decode())
+        raise paramiko.SSHException("The SSH broker closed the connection")
+
+    def close(self):
+        pass
+
+
+def _broker_running():
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(str(BROKER_SOCKET))
+        return True
+    except OSError:
+        return False
+    finally:
+        sock.close()
+
+
+def ensure_broker():
+    """Start the broker unless it is running; return False if it could not be reached."""
+    if _broker_running():
+        return True
+    with open(BROKER_LOG_FILE, "a") as log:
+        subprocess.Popen([sys.executable, "-m", "app.utils.ssh_broker"],
+                         cwd=PACKAGE_ROOT,
+                         stdin=subprocess.DEVNULL, stdout=log, stderr=log,
+                         start_new_session=True)
+    deadline = time.monotonic() + START_TIMEOUT
+    while time.monotonic() < deadline:
+        if _broker_running():
+            return True
+        time.sleep(0.02)
+    return False
+
+
+def open_connection(user, host, port, key=None, password=None, broker=None):
+    """Connect through the broker if asked to, otherwise directly.
+
+    broker=None leaves it to TERMO_SSH_BROKER=1. Without a working broker the connection is direct.
+    """
+    if key:
+        # The broker runs in another directory
+        key = os.path.abspath(os.path.expanduser(key))
+    if broker is None:
+        broker = os.environ.get("TERMO_SSH_BROKER") == "1"
+    if broker and ensure_broker():
+        return BrokerConnection(user, host, port, key, password)
+    return DirectConnection(user, host, port, key, password)
+
+
+class _PooledTransport:
+    def __init__(self, client):
+        self.client = client
+        self.transport = client.get_transport()
+        self.transport.set_keepalive(KEEPALIVE_INTERVAL)
+        self.channels = 0
+        self.last_used = time.monotonic()
+
+
+class Broker:
+    def __init__(self, ttl=IDLE_TTL):
+        self.ttl = ttl
+        self.pool = {}
+        self.lock = threading.Lock()
+        # One lock per pool key, so concurrent first runs against a host connect only once
+        self.connect_locks = {}
+        self.last_active = time.monotonic()
+
+    def _acquire(self, request):
+        key = pool_key(request["user"], request["host"], request["port"], request["key"], request["password"])
+        with self.lock:
+            connect_lock = self.connect_locks.setdefault(key, threading.Lock())
+        with connect_lock:
+            # Checked and claimed in one go, so the expiry cannot close it in between
+            with self.lock:
+                entry = self.pool.get(key)
+                if entry is not None and entry.transport.is_active():
+                    entry.channels += 1
+                    return entry
+            if entry is not None:
+                entry.client.close()
+            entry = _PooledTransport(_ssh_connect(request["user"], request["host"], request["port"],
+                                                  request["key"], request["password"]))
+            with self.lock:
+                self.pool[key] = entry
+                entry.channels += 1
+        return entry
+
+    def _release(self, entry):
+        with self.lock:
+            entry.channels -= 1
+            entry.last_used = self.last_active = time.monotonic()
+
+    def _expire(self):
+        now = time.monotonic()
+        with self.lock:
+            for key, entry in list(self.pool.items()):
+                if not entry.transport.is_active() or (entry.channels == 0 and now - entry.last_used > self.ttl):
+                    del self.pool[key]
+                    entry.client.close()
+            return not self.pool and now - self.last_active > self.ttl
+
+    def _expire_periodically(self, stop):
+        """Expire transports every EXPIRE_INTERVAL seconds; set stop once the broker is idle."""
+        while not stop.wait(EXPIRE_INTERVAL):
+            if self._expire():
+                stop.set()
+
+    def _handle(self, connection):
+        entry = None
+        try:
+            kind, payload = _recv_frame(connection)
+            if kind != b"C":
+                return
+            request = json.loads(payload)
+            try:
+                entry = self._acquire(request)
+                channel = entry.transport.open_session()
+                channel.exec_command(request["command"])
+            except Exception as e:
+                _send_frame(connection, b"F", (str(e) or type(e).__name__).encode())
+                return
+            _send_frame(connection, b"K")
+            self._relay(connection, channel)
+        except OSError:
+            pass
+        finally:
+            connection.close()
+            if entry is not None:
+                self._release(entry)
+
+    def _relay(self, connection, channel):
+        def forward_stdin():
+            try:
+                while True:
+                    kind, payload = _recv_frame(connection)
+                    if kind == b"I":
+                        channel.sendall(payload)
+                    elif kind == b"E":
+                        channel.shutdown_write()
+                    else:
+                        break
+            except (OSError, EOFError):
+                pass
+            # The client is gone (e.g. interrupted): stop the remote command
+            channel.close()
+
+        threading.Thread(target=forward_stdin, daemon=True).start()
+        while True:
+            select.select([channel], [], [], POLL_INTERVAL)
+            while channel.recv_ready():
+                _send_frame(connection, b"O", channel.recv(RECV_CHUNK_SIZE))
+            while channel.recv_stderr_ready():
+                _send_frame(connection, b"R", channel.recv_stderr(RECV_CHUNK_SIZE))
+            # Output may still arrive after the exit status; a channel closed without one reports -1
+            if (channel.exit_status_ready() and (channel.eof_received or channel.closed)
+                    and not channel.recv_ready() and not channel.recv_stderr_ready()):
+                _send_frame(connection, b"X", EXIT_STATUS.pack(channel.recv_exit_status()))
+                break
+        channel.close()
+
+    def _listen(self):
+        if os.path.exists(BROKER_SOCKET):
+            os.unlink(BROKER_SOCKET)
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        # Only the owner may use the broker's authenticated connections
+        previous_umask = os.umask(0o077)
+        try:
+            listener.bind(str(BROKER_SOCKET))
+        finally:
+            os.umask(previous_umask)
+        listener.listen(64)
+        listener.settimeout(1.0)
+        return listener
+
+    @staticmethod
+    def _lock(lock_file):
+        # A broker that is shutting down holds the lock briefly, so wait a little for it
+        deadline = time.monotonic() + START_TIMEOUT
+        while True:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return True
+            except BlockingIOError:
+                if time.monotonic() > deadline:
+                    return False
+                time.sleep(0.05)
+
+    def serve(self):
+        with open(BROKER_LOCK_FILE, "a") as lock_file:
+            if not self._lock(lock_file):
+                # Another broker was started at the same moment and serves the socket
+                return
+            listener = self._listen()
+            # On a timer of its own, as a steady stream of runs keeps accept() from timing out
+            stop = threading.Event()
+            threading.Thread(target=self._expire_periodically, args=(stop,), daemon=True).start()
+            try:
+                while not stop.is_set():
+                    try:
+                        connection, _ = listener.accept()
+                    except socket.timeout:
+                        continue
+                    connection.settimeout(None)
+                    self.last_active = time.monotonic()
+                    threading.Thread(target=self._handle, args=(connection,), daemon=True).start()
+            finally:
+                listener.close()
+                BROKER_SOCKET.unlink(missing_ok=True)
+                with self.lock:
+                    for entry in self.pool.values():
+                        entry.client.close()
+
+
+if __name__ == "__main__":
+    Broker().serve()
@@ -0,0 +1,225 @@
+import glob
+import hashlib
+import json
+import os
+import sqlite3
+import time
+from contextlib import contextmanager
+
+from app.utils.config_utils import MACRO_DIR
+from app.utils.env_utils import env_number
+
+CACHE_DB_FILE = MACRO_DIR / "cache.db"
+SCHEMA_VERSION = 2
+# After every write the least recently used entries, and file digests, are evicted until
+# each table holds at most this many bytes of rows; a step's entry grows with its outputs
+MAX_BYTES = env_number("TERMO_CACHE_MB", 8) * 1024 * 1024
+# Bytes a row takes besides its text: its numbers, and SQLite's own bookkeeping
+ROW_OVERHEAD = 64
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def is_cacheable(step):
+    """Only steps that declare their outputs can be skipped, like a make target."""
+    return bool(step.options.get("outputs"))
+
+
+def _expand(patterns, cwd):
+    """Expand globs into a sorted list of absolute file paths; directories stand for every file below them."""
+    paths = set()
+    for pattern in patterns:
+        pattern = os.path.join(cwd, os.path.expanduser(pattern))
+        for match in glob.glob(pattern, recursive=True):
+            if os.path.isdir(match):
+                for root, _, files in os.walk(match):
+                    paths.update(os.path.join(root, name) for name in files)
+            else:
+                paths.add(match)
+    return sorted(paths)
+
+
+def _row_size(*texts):
+    return ROW_OVERHEAD + sum(len(text.encode()) for text in texts)
+
+
+def _file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class StepCache:
+    """Remembers which steps succeeded for a given key, so unchanged steps can be skipped.
+
+    A step's key hashes its expanded command, the working directory, the `env=` variables
+    and the content of its `inputs=` files. A hit needs the `outputs=` to still be exactly
+    as that run left them. File digests are memoized by path, size, mtime and inode so
+    unchanged inputs are not re-read on every run.
+    """
+
+    def __init__(self, macro=None, reuse=True, path=CACHE_DB_FILE):
+        self.macro = macro
+        # With reuse off every step runs, but successful runs still refresh their entries
+        self.reuse = reuse
+        self.path = path
+        self.connection = sqlite3.connect(path, timeout=30, isolation_level=None)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self._create_schema()
+
+    @contextmanager
+    def _transaction(self):
+        self.connection.execute("BEGIN IMMEDIATE")
+        try:
+            yield self.connection
+        except BaseException:
+            self.connection.execute("ROLLBACK")
+            raise
+        self.connection.execute("COMMIT")
+
+    def _create_schema(self):
+        if self.connection.execute("PRAGMA user_version").fetchone()[0] >= SCHEMA_VERSION:
+            return
+        with self._transaction() as db:
+            version = db.execute("PRAGMA user_version").fetchone()[0]
+            for target in range(version + 1, SCHEMA_VERSION + 1):
+                getattr(self, f"_schema_v{target}")(db)
+            db.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+    def _schema_v1(self, db):
+        db.execute("""CREATE TABLE entries (
+                          key TEXT PRIMARY KEY,
+                          macro TEXT NOT NULL,
+                          step TEXT NOT NULL,
+                          command TEXT NOT NULL,
+                          outputs TEXT NOT NULL,
+                          created REAL NOT NULL,
+                          last_used REAL NOT NULL)""")
+        db.execute("CREATE INDEX entries_last_used ON entries (last_used)")
+        db.execute("""CREATE TABLE digests (
+                          path TEXT PRIMARY KEY,
+                          size INTEGER NOT NULL,
+                          mtime_ns INTEGER NOT NULL,
+                          inode INTEGER NOT NULL,
+                          digest TEXT NOT NULL,
+                          last_used REAL NOT NULL)""")
+        db.execute("CREATE INDEX digests_last_used ON digests (last_used)")
+
+    def _schema_v2(self, db):
+        # The bytes each row takes, which eviction sums instead of counting rows
+        for table, texts in (("entries", "key || macro || step || command || outputs"), ("digests", "path || digest")):
+            db.execute(f"ALTER TABLE {table} ADD COLUMN row_bytes INTEGER NOT NULL DEFAULT 0")
+            db.execute(f"UPDATE {table} SET row_bytes = ? + length(CAST({texts} AS BLOB))", (ROW_OVERHEAD,))
+
+    def _digest(self, path, stat):
+        row = self.connection.execute("SELECT size, mtime_ns, inode, digest FROM digests WHERE path = ?",
+                                      (path,)).fetchone()
+        if row and tuple(row[:3]) == (stat.st_size, stat.st_mtime_ns, stat.st_ino):
+            return row[3]
+        digest = _file_digest(path)
+        self.connection.execute(
+            "INSERT INTO digests (path, size, mtime_ns, inode, digest, last_used, row_bytes) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT (path) DO UPDATE SET size = excluded.size, mtime_ns = excluded.mtime_ns, "
+            "inode = excluded.inode, digest = excluded.digest, last_used = excluded.last_used, "
+            "row_bytes = excluded.row_bytes",
+            (path, stat.st_size, stat.st_mtime_ns, stat.st_ino, digest, time.time(), _row_size(path, digest)))
+        return digest
+
+    def key(self, step, command, cwd):
+        """Hash everything the step's result depends on. Call it right before the step runs."""
+        key = hashlib.sha256()
+        key.update(f"command\0{command}\0cwd\0{cwd}\0".encode())
+        for name in sorted(step.options.get("env", [])):
+            key.update(f"env\0{name}\0{os.environ.get(name, '')}\0".encode())
+        for pattern in sorted(step.options.get("inputs", [])):
+            key.update(f"pattern\0{pattern}\0".encode())
+        for path in _expand(step.options.get("inputs", []), cwd):
+            key.update(f"input\0{path}\0{self._digest(path, os.stat(path))}\0".encode())
+        return key.hexdigest()
+
+    @staticmethod
+    def _outputs_state(step, cwd):
+        """Size and mtime of every output file, or None when an output is missing."""
+        state = []
+        for pattern in step.options["outputs"]:
+            paths = _expand([pattern], cwd)
+            if not paths:
+                return None
+            for path in paths:
+                stat = os.stat(path)
+                state.append([path, stat.st_size, stat.st_mtime_ns])
+        return state
+
+    def lookup(self, step, command, cwd=None):
+        """Return (key, hit) for a step about to run in cwd; the key is None when it cannot be cached."""
+        if not is_cacheable(step):
+            return None, False
+        cwd = cwd or os.getcwd()
+        try:
+            key = self.key(step, command, cwd)
+            return key, self.reuse and self.hit(key, step, cwd)
+        except OSError:
+            # An input or output vanished while it was being looked at
+            return None, False
+
+    def hit(self, key, step, cwd):
+        """Return True if the step already ran with this key and its outputs are untouched."""
+        row = self.connection.execute("SELECT outputs FROM entries WHERE key = ?", (key,)).fetchone()
+        if row is None or json.loads(row[0]) != self._outputs_state(step, cwd):
+            return False
+        self.connection.execute("UPDATE entries SET last_used = ? WHERE key = ?", (time.time(), key))
+        return True
+
+    def store(self, key, step, command, cwd=None):
+        """Record a successful run of the step. Steps that left an output missing are not cached.
+
+        cwd is where the step started, which is where its outputs are looked up.
+        """
+        try:
+            outputs = self._outputs_state(step, cwd or os.getcwd())
+        except OSError:
+            return
+        if outputs is None:
+            return
+        now = time.time()
+        with self._transaction() as db:
+            outputs = json.dumps(outputs)
+            db.execute("INSERT INTO entries (key, macro, step, command, outputs, created, last_used, row_bytes) "
+                       "VALUES (?, ?, ?, ?, ?, ?, ?, ?) "
+                       "ON CONFLICT (key) DO UPDATE SET macro = excluded.macro, step = excluded.step, "
+                       "outputs = excluded.outputs, last_used = excluded.last_used, row_bytes = excluded.row_bytes",
+                       (key, self.macro or "", step.id, command, outputs, now, now,
+                        _row_size(key, self.macro or "", step.id, command, outputs)))
+            self._evict(db)
+
+    @staticmethod
+    def _evict(db):
+        for table, column in (("entries", "key"), ("digests", "path")):
+            if db.execute(f"SELECT COALESCE(SUM(row_bytes), 0) FROM {table}").fetchone()[0] <= MAX_BYTES:
+                continue
+            # The most recently used rows are kept up to the budget, and the rest dropped
+            db.execute(f"DELETE FROM {table} WHERE {column} IN (SELECT {column} FROM ("
+                       f"SELECT {column}, SUM(row_bytes) OVER (ORDER BY last_used DESC, {column}) AS kept "
+                       f"FROM {table}) WHERE kept > ?)", (MAX_BYTES,))
+
+    def entries(self, macro=None):
+        """Yield (key, macro, step, command, output count, last used) rows, most recently used first."""
+        query = "SELECT key, macro, step, command, outputs, last_used FROM entries"
+        args = ()
+        if macro is not None:
+            query += " WHERE macro = ?"
+            args = (macro,)
+        for key, macro_name, step, command, outputs, last_used in self.connection.execute(
+                query + " ORDER BY last_used DESC", args):
+            yield key, macro_name, step, command, len(json.loads(outputs)), last_used
+
+    def clear(self, macro=None):
+        """Drop every entry, or only those of one macro, and return how many were removed."""
+        with self._transaction() as db:
+            if macro is None:
+                db.execute("DELETE FROM digests")
+                return db.execute("DELETE FROM entries").rowcount
+            return db.execute("DELETE FROM entries WHERE macro = ?", (macro,)).rowcount
@@ -0,0 +1,187 @@
+import heapq
+import re
+
+from app.utils.templates import resolve_values
+from app.utils.timeouts import DEFAULT_BACKOFF, parse_duration
+
+# Steps may carry options in a trailing shell comment, e.g. `make lint  #tm: id=lint needs=fetch`.
+# Being a comment, the annotation is harmless if the line is ever run by a plain shell.
+ANNOTATION_PATTERN = re.compile(r"(?:^|\s)#tm:(.*)$")
+
+LIST_OPTIONS = {"needs", "inputs", "outputs", "env"}
+# Stands in for placeholder number N while a template's annotation is split off
+PLACEHOLDER_MASK = re.compile("\0(\\d+)\0")
+
+
+class StepError(ValueError):
+    """Raised when step annotations do not form a valid plan."""
+
+
+class Step:
+    """A single macro command together with the options from its `#tm:` annotation."""
+
+    def __init__(self, index, command, options=None):
+        self.index = index
+        self.command = command
+        self.options = options or {}
+        self.id = self.options.get("id", str(index + 1))
+        self.group = self.options.get("group")
+        # None means "not declared", an empty list means "no dependencies"
+        self.needs = self.options.get("needs")
+        self.deps = []
+        try:
+            self.timeout = parse_duration(self.options["timeout"]) if "timeout" in self.options else None
+            self.backoff = parse_duration(self.options["backoff"]) if "backoff" in self.options else DEFAULT_BACKOFF
+        except ValueError as e:
+            raise StepError(f"Step '{self.id}': {e}")
+        retries = self.options.get("retries", "0")
+        if not retries.isdigit():
+            raise StepError(f"Step '{self.id}': retries must be a whole number, got '{retries}'")
+        self.retries = int(retries)
+
+    def __repr__(self):
+        return f"Step({self.id!r}, {self.command!r})"
+
+
+class StepResult:
+    """Outcome of running one step: status is ok, cached, resumed, failed, timeout, cancelled or skipped."""
+
+    def __init__(self, step, status, returncode=None, wall=0.0, cpu=None, attempts=1):
+        self.step = step
+        self.status = status
+        self.returncode = returncode
+        # Wall time across every attempt, including the waits between them
+        self.wall = wall
+        # (user, system) CPU seconds used by the step's processes, when known
+        self.cpu = cpu
+        self.attempts = attempts
+
+    @property
+    def succeeded(self):
+        return self.status in ("ok", "cached", "resumed")
+
+
+def parse_annotation(text):
+    options = {}
+    for token in text.split():
+        key, _, value = token.partition("=")
+        if key in LIST_OPTIONS:
+            options[key] = [item for item in value.split(",") if item]
+        else:
+            options[key] = value
+    return options
+
+
+def split_annotation(line):
+    """Split a macro line into the shell command and its annotation options."""
+    match = ANNOTATION_PATTERN.search(line)
+    if not match:
+        return line, {}
+    return line[:match.start()].rstrip(), parse_annotation(match.group(1))
+
+
+def split_template(template, values):
+    """Split a compiled macro line into its command and annotation options, filled in with values.
+
+    The annotation is found in the macro's own text, with its placeholders masked, so a
+    parameter value can neither add nor hide one; values land in option values whole.
+    """
+    if template.text is not None:
+        return split_annotation(template.text)
+    masked = "".join(segment if isinstance(segment, str) else f"\0{number}\0"
+                     for number, segment in enumerate(template.segments))
+    command, options = split_annotation(masked)
+
+    def fill(text):
+        return PLACEHOLDER_MASK.sub(lambda match: values.get(*template.segments[int(match.group(1))]), text)
+
+    options = {key: [fill(item) for item in value] if isinstance(value, list) else fill(value)
+               for key, value in options.items()}
+    return fill(command), options
+
+
+def expand_steps(templates, values):
+    """Expand a compiled macro with parameter values into steps, as parse_steps does for plain lines."""
+    values = resolve_values(templates, values)
+    return _link([Step(index, *split_template(template, values)) for index, template in enumerate(templates)])
+
+
+def parse_steps(lines):
+    """Parse macro lines into steps and resolve their dependencies."""
+    return _link([Step(index, *split_annotation(line)) for index, line in enumerate(lines)])
+
+
+def _link(steps):
+    """Resolve the steps' dependencies.
+
+    Without annotations every step depends on the one before it. Consecutive steps in the
+    same `group=` share their predecessors, and the step after a group waits for all of it.
+    `needs=a,b` overrides the default with explicit step ids.
+    """
+    previous = []
+    group_name, group_deps, group_members = None, [], []
+
+    for step in steps:
+        if step.group is not None and step.group == group_name:
+            default_deps = group_deps
+        else:
+            if group_name is not None:
+                previous = group_members
+            group_name, group_deps, group_members = step.group, previous, []
+            default_deps = previous
+
+        step.deps = list(step.needs) if step.needs is not None else list(default_deps)
+
+        if step.group is not None:
+            group_members.append(step.id)
+        else:
+            previous = [step.id]
+            group_name = None
+
+    _validate(steps)
+    return steps
+
+
+def _validate(steps):
+    by_id = {}
+    for step in steps:
+        if step.id in by_id:
+            raise StepError(f"Duplicate step id '{step.id}'")
+        by_id[step.id] = step
+
+    for step in steps:
+        for dep in step.deps:
+            if dep not in by_id:
+                raise StepError(f"Step '{step.id}' needs unknown step '{dep}'")
+
+    order = run_order(steps)
+    if len(order) < len(steps):
+        ordered = {step.id for step in order}
+        cyclic = [step.id for step in steps if step.id not in ordered]
+        raise StepError(f"Steps {', '.join(cyclic)} have circular dependencies")
+
+
+def run_order(steps):
+    """Order steps for running one at a time: every step after the steps it needs, and
+    otherwise in macro order, so `needs=` may name a later step.
+
+    Steps that are part of a dependency cycle are left out.
+    """
+    # Kahn's algorithm, always taking the earliest ready step
+    position = {step.id: number for number, step in enumerate(steps)}
+    remaining = {step.id: len(step.deps) for step in steps}
+    dependants = {step.id: [] for step in steps}
+    for step in steps:
+        for dep in step.deps:
+            dependants[dep].append(step.id)
+    ready = [position[step.id] for step in steps if not step.deps]
+    heapq.heapify(ready)
+    order = []
+    while ready:
+        step = steps[heapq.heappop(ready)]
+        order.append(step)
+        for dependant in dependants[step.id]:
+            remaining[dependant] -= 1
+            if remaining[dependant] == 0:
+                heapq.heappush(ready, position[dependant])
+    return order
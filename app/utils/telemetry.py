@@ -0,0 +1,107 @@
+import json
+import os
+import resource
+import sys
+import time
+
+from app.utils.config_utils import MACRO_DIR
+
+RUN_LOG = MACRO_DIR / "runs.log"
+MAX_LOG_BYTES = 4 * 1024 * 1024
+ROTATED_LOGS = 3
+COMMAND_CHARS = 80
+
+
+def telemetry_enabled():
+    return os.environ.get("TERMO_TELEMETRY", "1") != "0"
+
+
+def children_usage():
+    """Snapshot resource usage of every child process waited for so far."""
+    return resource.getrusage(resource.RUSAGE_CHILDREN)
+
+
+def _max_rss_kb(usage):
+    # ru_maxrss is in kilobytes on Linux but in bytes on macOS
+    return usage.ru_maxrss // 1024 if sys.platform == "darwin" else usage.ru_maxrss
+
+
+def _rotate():
+    for index in range(ROTATED_LOGS - 1, 0, -1):
+        older = RUN_LOG.with_name(f"{RUN_LOG.name}.{index}")
+        if older.exists():
+            older.replace(RUN_LOG.with_name(f"{RUN_LOG.name}.{index + 1}"))
+    RUN_LOG.replace(RUN_LOG.with_name(f"{RUN_LOG.name}.1"))
+
+
+def record_run(name, started_at, wall, results, usage_before):
+    """Append one compact line describing a finished run to the run log.
+
+    Each step is stored as [id, wall seconds, exit status, user cpu, system cpu, command].
+    """
+    if not telemetry_enabled():
+        return
+    usage = children_usage()
+    record = {
+        "m": name,
+        "t": round(started_at, 3),
+        "w": round(wall, 4),
+        "s": [[result.step.id,
+               round(result.wall, 4),
+               result.returncode,
+               round(result.cpu[0], 3) if result.cpu else None,
+               round(result.cpu[1], 3) if result.cpu else None,
+               result.step.command[:COMMAND_CHARS]]
+              for result in results],
+        "r": {
+            "utime": round(usage.ru_utime - usage_before.ru_utime, 3),
+            "stime": round(usage.ru_stime - usage_before.ru_stime, 3),
+            "maxrss_kb": _max_rss_kb(usage),
+            "inblock": usage.ru_inblock - usage_before.ru_inblock,
+            "oublock": usage.ru_oublock - usage_before.ru_oublock,
+        },
+    }
+    try:
+        if RUN_LOG.exists() and RUN_LOG.stat().st_size > MAX_LOG_BYTES:
+            _rotate()
+        # A single O_APPEND write keeps lines from concurrent runs intact
+        with open(RUN_LOG, "a") as file:
+            file.write(json.dumps(record, separators=(",", ":")) + "\n")
+    except OSError:
+        pass
+
+
+def read_runs(name=None):
+    """Yield recorded runs oldest first, optionally only those of one macro."""
+    paths = [RUN_LOG.with_name(f"{RUN_LOG.name}.{index}") for index in range(ROTATED_LOGS, 0, -1)] + [RUN_LOG]
+    for path in paths:
+        if not path.exists():
+            continue
+        with open(path, "r") as file:
+            for line in file:
+                if name is not None and f'"m":{json.dumps(name)},' not in line:
+                    continue
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    continue
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    if not ordered:
+        return None
+    index = min(len(ordered) - 1, max(0, round(fraction * (len(ordered) - 1))))
+    return ordered[index]
+
+
+class RunTimer:
+    """Collects what record_run needs around a macro run."""
+
+    def __init__(self):
+        self.started_at = time.time()
+        self.started = time.monotonic()
+        self.usage_before = children_usage()
+
+    def record(self, name, results):
+        record_run(name, self.started_at, time.monotonic() - self.started, results, self.usage_before)
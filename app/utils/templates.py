@@ -0,0 +1,119 @@
+import re
+
+# Positional parameters are `{1}` or `{1:default}`; named ones use double braces, `{{env}}` or
+# `{{env:prod}}`, so shell and awk/jq snippets like `{print}` or `{name}` are left alone.
+PLACEHOLDER_PATTERN = re.compile(r"\{\{([A-Za-z_]\w*)(?::([^{}]*))?\}\}|\{(\d+)(?::([^{}]*))?\}")
+
+
+class TemplateError(ValueError):
+    """Raised when a macro cannot be expanded with the given parameters."""
+
+
+def placeholder_label(key):
+    return f"{{{key}}}" if key.isdigit() else f"{{{{{key}}}}}"
+
+
+class Template:
+    """A command compiled into literal text and (name, default) placeholder segments."""
+
+    __slots__ = ("segments", "text")
+
+    def __init__(self, segments):
+        self.segments = segments
+        # Commands without placeholders expand to themselves
+        self.text = segments[0] if len(segments) == 1 and isinstance(segments[0], str) else None
+
+    @classmethod
+    def compile(cls, command):
+        segments = []
+        position = 0
+        for match in PLACEHOLDER_PATTERN.finditer(command):
+            if match.start() > position:
+                segments.append(command[position:match.start()])
+            if match.group(1) is not None:
+                segments.append((match.group(1), match.group(2)))
+            else:
+                segments.append((match.group(3), match.group(4)))
+            position = match.end()
+        if position < len(command) or not segments:
+            segments.append(command[position:])
+        return cls(segments)
+
+    @classmethod
+    def from_json(cls, data):
+        return cls([segment if isinstance(segment, str) else tuple(segment) for segment in data])
+
+    def to_json(self):
+        return [segment if isinstance(segment, str) else list(segment) for segment in self.segments]
+
+    def placeholders(self):
+        return [segment for segment in self.segments if not isinstance(segment, str)]
+
+    def render(self, values):
+        if self.text is not None:
+            return self.text
+        return "".join(segment if isinstance(segment, str) else values.get(segment[0], segment[1])
+                       for segment in self.segments)
+
+
+def compile_commands(commands):
+    return [Template.compile(command) for command in commands]
+
+
+def bind_params(params=(), assignments=()):
+    """Build the parameter values from positional params and `name=value` assignments."""
+    values = {str(index + 1): value for index, value in enumerate(params)}
+    for assignment in assignments:
+        name, separator, value = assignment.partition("=")
+        if not separator or not name:
+            raise TemplateError(f"Expected name=value, got '{assignment}'")
+        values[name] = value
+    return values
+
+
+def collect_defaults(templates):
+    """A default given for a parameter in any command applies to the whole macro."""
+    defaults = {}
+    for template in templates:
+        for key, default in template.placeholders():
+            if default is not None:
+                defaults.setdefault(key, default)
+    return defaults
+
+
+def missing_params(templates, values):
+    """Return the labels of required placeholders that have no value, in order of appearance."""
+    missing = {}
+    for template in templates:
+        for key, default in template.placeholders():
+            if default is None and key not in values:
+                missing[placeholder_label(key)] = True
+    return list(missing)
+
+
+def resolve_values(templates, values):
+    """Add the macro's defaults to values, checking up front that every placeholder has one."""
+    values = {**collect_defaults(templates), **values}
+    missing = missing_params(templates, values)
+    if missing:
+        raise TemplateError(f"Missing value for parameter {', '.join(missing)}")
+    return values
+
+
+def expand(templates, values):
+    """Validate every placeholder up front, then expand all commands."""
+    values = resolve_values(templates, values)
+    return [template.render(values) for template in templates]
+
+
+def expand_many(templates, rows):
+    """Expand the same macro for many parameter sets, yielding one command list per row."""
+    defaults = collect_defaults(templates)
+    required = {key for template in templates for key, default in template.placeholders()
+                if default is None and key not in defaults}
+    for values in rows:
+        if not required.issubset(values):
+            yield expand(templates, values)
+        else:
+            values = {**defaults, **values} if defaults else values
+            yield [template.render(values) for template in templates]
@@ -0,0 +1,146 @@
+"""Time budgets for steps and whole runs, and retries of the steps that use them up.
+
+A step may declare `timeout=30s` and `retries=2` (optionally `backoff=5s`, the first
+retry's base delay) in its `#tm:` annotation, and `--timeout` limits the whole run.
+A step that runs out of time is killed along with every process it started: its process
+group is sent SIGTERM and, KILL_GRACE seconds later, SIGKILL.
+"""
+import os
+import re
+import signal
+import time
+
+import click
+
+from app.utils.env_utils import env_number
+
+DURATION_PATTERN = re.compile(r"^(\d+(?:\.\d+)?)(ms|s|m|h)?$")
+DURATION_UNITS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600, None: 1}
+# How long a timed-out step gets to exit after SIGTERM before it is sent SIGKILL
+KILL_GRACE = env_number("TERMO_KILL_GRACE", 5)
+# How often a process group is checked for having exited during that grace period
+GROUP_POLL_INTERVAL = 0.05
+DEFAULT_BACKOFF = 1.0
+MAX_BACKOFF = 60.0
+# The exit status `timeout(1)` uses for a command that ran out of time
+TIMEOUT_STATUS = 124
+
+
+def parse_duration(text):
+    """Parse 90, 90s, 1.5m, 2h or 500ms into seconds; raise ValueError otherwise."""
+    match = DURATION_PATTERN.match(text.strip())
+    if not match or float(match.group(1)) <= 0:
+        raise ValueError(f"Invalid duration '{text}', expected e.g. 30s, 5m or 1h")
+    return float(match.group(1)) * DURATION_UNITS[match.group(2)]
+
+
+def format_duration(seconds):
+    if seconds < 60:
+        return f"{seconds:g}s" if seconds == int(seconds) else f"{seconds:.1f}s"
+    minutes, seconds = divmod(int(round(seconds)), 60)
+    if minutes < 60:
+        return f"{minutes}m{seconds:02d}s" if seconds else f"{minutes}m"
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}h{minutes:02d}m" if minutes else f"{hours}h"
+
+
+class Deadline:
+    """The time budget of a whole run, counted from when it is created."""
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.expires = time.monotonic() + seconds
+
+    def remaining(self):
+        return max(0.0, self.expires - time.monotonic())
+
+    @property
+    def expired(self):
+        return time.monotonic() >= self.expires
+
+
+def step_limit(step, deadline=None):
+    """Seconds the step may run for: its own timeout, cut short by the run's budget, or None."""
+    limits = [step.timeout] if step.timeout is not None else []
+    if deadline is not None:
+        limits.append(deadline.remaining())
+    return min(limits) if limits else None
+
+
+def retry_delay(step, attempt, deadline=None):
+    """Seconds to wait before retrying a step that failed `attempt` times, or None to give up.
+
+    The delay doubles with every attempt, and half of it is random so steps that failed
+    together do not all retry at the same moment.
+    """
+    if attempt > step.retries:
+        return None
+    # Imported here as most runs never retry
+    import random
+    delay = min(MAX_BACKOFF, step.backoff * 2 ** (attempt - 1))
+    delay = delay / 2 + random.uniform(0, delay / 2)
+    if deadline is not None and delay >= deadline.remaining():
+        return None
+    return delay
+
+
+def signal_group(pgid, signum):
+    try:
+        os.killpg(pgid, signum)
+    except (ProcessLookupError, PermissionError):
+        pass
+
+
+def group_exists(pgid):
+    """Return True while any process is left in the process group."""
+    try:
+        os.killpg(pgid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # Its members run as another user, e.g. under sudo
+        pass
+    return True
+
+
+def stop_group(pgid, reap=None):
+    """SIGTERM a process group, then SIGKILL whatever is left of it KILL_GRACE seconds later.
+
+    The whole group is watched rather than its leader, as the processes a step started
+    may take longer to exit than the shell that started them. reap (e.g. Popen.poll)
+    collects the leader once it exits, so it does not linger in the group as a zombie.
+    """
+    signal_group(pgid, signal.SIGTERM)
+    expires = time.monotonic() + KILL_GRACE
+    while time.monotonic() < expires:
+        if reap is not None:
+            reap()
+        if not group_exists(pgid):
+            return
+        time.sleep(GROUP_POLL_INTERVAL)
+    signal_group(pgid, signal.SIGKILL)
+
+
+def echo_timing_summary(results, deadline=None):
+    """Print how the steps that timed out, were retried or never ran fared, if there are any."""
+    lines = []
+    for result in results:
+        if result.status == "timeout":
+            outcome = click.style("timed out", fg='red')
+        elif result.attempts > 1:
+            outcome = click.style(result.status, fg='green' if result.succeeded else 'red')
+        elif result.status == "skipped" and deadline is not None and deadline.expired:
+            lines.append(f"  {result.step.id}  not run")
+            continue
+        else:
+            continue
+        attempts = f" after {result.attempts} attempts" if result.attempts > 1 else ""
+        lines.append(f"  {result.step.id}  {outcome}{attempts}, {format_duration(result.wall)}")
+    if not lines:
+        return
+    click.echo(click.style("\nTiming:", fg='blue'))
+    for line in lines:
+        click.echo(line)
+    if deadline is not None and deadline.expired:
+        click.echo(click.style(f"The run's time budget of {format_duration(deadline.seconds)} was used up", fg='red'))
+
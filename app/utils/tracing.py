@@ -0,0 +1,168 @@
+"""Built-in hooks: OpenTelemetry trace export and profiling of termo itself."""
+import cProfile
+import json
+import secrets
+import threading
+import time
+
+import click
+
+# OTLP span kind and status codes
+SPAN_KIND_INTERNAL = 1
+STATUS_OK = 1
+STATUS_ERROR = 2
+
+
+def _attribute(key, value):
+    if isinstance(value, bool):
+        return {"key": key, "value": {"boolValue": value}}
+    if isinstance(value, int):
+        # OTLP/JSON writes 64-bit integers as strings
+        return {"key": key, "value": {"intValue": str(value)}}
+    if isinstance(value, float):
+        return {"key": key, "value": {"doubleValue": value}}
+    return {"key": key, "value": {"stringValue": str(value)}}
+
+
+class TraceHook:
+    """Writes every run as OpenTelemetry spans: one span per macro run and one per step.
+
+    Each finished trace is appended to the file as one OTLP/JSON ExportTraceServiceRequest
+    per line, the format of the OpenTelemetry Collector's file exporter, which its
+    otlpjsonfile receiver can read back to forward the traces to any backend.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.spans = {}
+        self.open_spans = {}
+        # (run id, step id) -> {attribute: bytes} of the output seen so far
+        self.output_bytes = {}
+
+    def _start(self, key, run, name, parent_id, attributes):
+        span = {"traceId": run.trace_id,
+                "spanId": run.id if key == run.id else secrets.token_hex(8),
+                "name": name,
+                "kind": SPAN_KIND_INTERNAL,
+                "startTimeUnixNano": str(time.time_ns()),
+                "attributes": attributes}
+        if parent_id:
+            span["parentSpanId"] = parent_id
+        with self.lock:
+            self.open_spans[key] = span
+            self.spans.setdefault(run.trace_id, []).append(span)
+
+    def _end(self, key, error=None, attributes=()):
+        with self.lock:
+            span = self.open_spans.pop(key, None)
+        if span is None:
+            return
+        span["endTimeUnixNano"] = str(time.time_ns())
+        span["attributes"].extend(attributes)
+        span["status"] = {"code": STATUS_ERROR, "message": error} if error else {"code": STATUS_OK}
+
+    def macro_start(self, run):
+        attributes = [_attribute("termo.macro", run.name)]
+        if run.host:
+            attributes.append(_attribute("server.address", run.host))
+        name = f"tm {run.name}" + (f" @ {run.host}" if run.host else "")
+        self._start(run.id, run, name, run.parent.id if run.parent else None, attributes)
+
+    def macro_end(self, run, results):
+        if results is None:
+            error = run.error or "interrupted"
+        else:
+            failed = [result.step.id for result in results if not result.succeeded]
+            error = run.error or (f"steps failed: {', '.join(failed)}" if failed else None)
+        self._end(run.id, error)
+        if run.parent is None:
+            self._write(run.trace_id)
+
+    def step_start(self, run, step):
+        self._start((run.id, step.id), run, f"step {step.id}", run.id,
+                    [_attribute("termo.step.id", step.id), _attribute("termo.step.command", step.command)])
+
+    def step_end(self, run, step, result):
+        attributes = [_attribute("termo.step.status", result.status)]
+        if result.returncode is not None:
+            attributes.append(_attribute("process.exit.code", result.returncode))
+        if result.cpu:
+            attributes += [_attribute("process.cpu.user_seconds", result.cpu[0]),
+                           _attribute("process.cpu.system_seconds", result.cpu[1])]
+        with self.lock:
+            counts = self.output_bytes.pop((run.id, step.id), {})
+        attributes += [_attribute(key, count) for key, count in counts.items()]
+        self._end((run.id, step.id), None if result.succeeded else f"step {result.status}", attributes)
+
+    def output(self, run, step, data, err):
+        if step is None:
+            return
+        key = "termo.step.stderr_bytes" if err else "termo.step.stdout_bytes"
+        with self.lock:
+            counts = self.output_bytes.setdefault((run.id, step.id), {})
+            counts[key] = counts.get(key, 0) + len(data)
+
+    def _write(self, trace_id):
+        with self.lock:
+            spans = self.spans.pop(trace_id, [])
+            # Steps cut short by an interruption never reported their end
+            for key, span in list(self.open_spans.items()):
+                if span["traceId"] == trace_id:
+                    del self.open_spans[key]
+                    span["endTimeUnixNano"] = str(time.time_ns())
+                    span["status"] = {"code": STATUS_ERROR, "message": "interrupted"}
+        request = {"resourceSpans": [{
+            "resource": {"attributes": [_attribute("service.name", "termo")]},
+            "scopeSpans": [{"scope": {"name": "termo"}, "spans": spans}]}]}
+        try:
+            with open(self.path, "a") as file:
+                file.write(json.dumps(request, separators=(",", ":")) + "\n")
+        except OSError as e:
+            click.echo(click.style(f"Could not write the trace to {self.path}: {e}", fg='yellow'), err=True)
+
+
+class SelfProfiler:
+    """Profiles termo's own work with cProfile: CLI dispatch, loading macros, templating.
+
+    Profiling pauses while steps run, so the profile shows termo's overhead rather than
+    the time spent in the commands of the macro.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.profile = cProfile.Profile()
+        self.thread = threading.get_ident()
+        self.running_steps = 0
+
+    def start(self):
+        self.started = time.perf_counter()
+        self.paused = 0.0
+        self.profile.enable()
+
+    def stop(self):
+        self.profile.disable()
+        own = time.perf_counter() - self.started - self.paused
+        try:
+            self.profile.dump_stats(self.path)
+        except OSError as e:
+            click.echo(click.style(f"Could not write the profile to {self.path}: {e}", fg='yellow'), err=True)
+            return
+        click.echo(click.style(f"termo itself took {own * 1000:.0f}ms; profile written to {self.path} "
+                               f"(inspect with `python -m pstats {self.path}`)", fg='blue'), err=True)
+
+    # Steps of parallel runs overlap, so profiling resumes once none is running. Only the
+    # profiled thread pauses; remote runs on several hosts work in threads of their own.
+    def step_start(self, run, step):
+        if threading.get_ident() == self.thread:
+            self.running_steps += 1
+            if self.running_steps == 1:
+                self.profile.disable()
+                self.paused_at = time.perf_counter()
+
+    def step_end(self, run, step, result):
+        if threading.get_ident() == self.thread and self.running_steps:
+            self.running_steps -= 1
+            if self.running_steps == 0:
+                self.paused += time.perf_counter() - self.paused_at
+                self.profile.enable()
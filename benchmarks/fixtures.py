@@ -0,0 +1,46 @@
+"""Synthetic data for the benchmark suite."""
+import random
+
+WORDS = ["git", "docker", "kubectl", "make", "build", "deploy", "npm", "pip", "install", "test",
+         "lint", "fetch", "aws", "s3", "sync", "terraform", "apply", "plan", "ssh", "rsync"]
+
+
+def make_macros(count, commands_per_macro=4, seed=0):
+    """Return a dict of `count` macros with short, realistic-looking commands."""
+    rng = random.Random(seed)
+    macros = {}
+    for index in range(count):
+        name = f"{rng.choice(WORDS)}-{rng.choice(WORDS)}-{index}"
+        macros[name] = [" ".join(rng.choices(WORDS, k=rng.randint(2, 6))) + f" --flag-{{1}} {index}"
+                        for _ in range(commands_per_macro)]
+    return macros
+
+
+def write_zsh_history(path, size_bytes, macro_name, recorded_commands=20, seed=0):
+    """Write an extended-format zsh history of roughly `size_bytes`, ending with a recording.
+
+    The recording (`tm new <macro_name>` ... `tm save`) sits at the end of the file, the way it
+    does when `tm save` runs, and includes a multi-line entry and a metafied byte.
+    """
+    rng = random.Random(seed)
+    timestamp = 1_600_000_000
+    written = 0
+    with open(path, "wb") as file:
+        buffer = []
+        while written < size_bytes:
+            timestamp += rng.randint(1, 30)
+            line = f": {timestamp}:0;{' '.join(rng.choices(WORDS, k=rng.randint(1, 8)))}\n".encode()
+            buffer.append(line)
+            written += len(line)
+            if len(buffer) >= 10_000:
+                file.writelines(buffer)
+                buffer = []
+        file.writelines(buffer)
+
+        file.write(f": {timestamp + 1}:0;tm new {macro_name}\n".encode())
+        for index in range(recorded_commands):
+            file.write(f": {timestamp + 2 + index}:0;echo step {index}\n".encode())
+        file.write(f": {timestamp + 100}:0;echo multi\\\nline\n".encode())
+        # "é" is c3 a9 in UTF-8; zsh metafies the a9 byte as 83 89
+        file.write(f": {timestamp + 101}:0;echo caf\xc3\x83\x89\n".encode("latin-1"))
+        file.write(f": {timestamp + 102}:0;tm save\n".encode())
@@ -0,0 +1,273 @@
+#!/usr/bin/env python3
+"""Benchmark suite for termo.
+
+Runs synthetic workloads against the macro store, history parsing, CLI startup, step
+execution and remote execution, and writes the results as JSON so runs can be compared
+across commits:
+
+    python benchmarks/run.py --quick --output bench.json
+    python benchmarks/run.py --only startup --startup-budget-ms 80
+
+Everything runs against a scratch HOME, so your own ~/.termo is never touched.
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_ROOT))
+
+from benchmarks.fixtures import make_macros, write_zsh_history  # noqa: E402
+
+SUITES = ["store", "history", "startup", "exec", "remote"]
+STARTUP_COMMANDS = [["ls"], ["desc", "noop"], ["find", "noop"], ["exec", "noop"], ["noop"], ["stats"]]
+
+
+def timed(function, repeat=1):
+    """Run function `repeat` times and return the median wall time in seconds."""
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function()
+        samples.append(time.perf_counter() - started)
+    return statistics.median(samples)
+
+
+def result(suite, name, seconds, **params):
+    return {"suite": suite, "name": name, "seconds": round(seconds, 6), "params": params}
+
+
+@contextlib.contextmanager
+def quiet():
+    with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+        yield
+
+
+def bench_store(workdir, quick):
+    from app.utils.macro_store import JsonMacroStore, SqliteMacroStore
+
+    results = []
+    for count in ([1_000, 10_000] if quick else [10_000, 100_000]):
+        macros = make_macros(count)
+        names = list(macros)
+        sample = random.Random(1).sample(names, 1000)
+
+        db_path = workdir / f"store-{count}.db"
+        for suffix in ("", "-wal", "-shm"):
+            Path(f"{db_path}{suffix}").unlink(missing_ok=True)
+        store = SqliteMacroStore(db_path)
+        results.append(result("store", "sqlite.put_many", timed(lambda: store.put_many(macros.items())),
+                              macros=count))
+        results.append(result("store", "sqlite.load_all", timed(lambda: dict(store.items()), 3), macros=count))
+        results.append(result("store", "sqlite.get", timed(lambda: [store.get(n) for n in sample]) / len(sample),
+                              macros=count))
+        results.append(result("store", "sqlite.put_one",
+                              timed(lambda: [store.put(n, macros[n]) for n in sample[:100]]) / 100, macros=count))
+        results.append(result("store", "sqlite.search",
+                              timed(lambda: [store.search(q) for q in ("deploy", "kubectl apply", "rsnyc")], 3) / 3,
+                              macros=count))
+        results.append(result("store", "sqlite.replace_all", timed(lambda: store.replace_all(macros)),
+                              macros=count))
+
+        json_store = JsonMacroStore(workdir / f"store-{count}.json")
+        results.append(result("store", "json.save_all", timed(lambda: json_store.replace_all(macros), 3),
+                              macros=count))
+        results.append(result("store", "json.load_all", timed(lambda: dict(json_store.items()), 3), macros=count))
+        results.append(result("store", "json.put_one",
+                              timed(lambda: [json_store.put(n, macros[n]) for n in sample[:10]]) / 10, macros=count))
+    return results
+
+
+def bench_history(workdir, quick):
+    from app.utils.history_utils import ZshHistoryParser, find_recorded_commands
+
+    results = []
+    for megabytes in ([10, 100] if quick else [100, 1024]):
+        path = workdir / f"zsh_history_{megabytes}MB"
+        if not path.exists():
+            write_zsh_history(path, megabytes * 1024 * 1024, "bench")
+        parser = ZshHistoryParser()
+        commands = []
+        seconds = timed(lambda: commands.extend(find_recorded_commands("bench", parser, path)), 3)
+
+        tracemalloc.start()
+        find_recorded_commands("bench", parser, path)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        results.append(result("history", "find_recorded_commands", seconds, megabytes=megabytes,
+                              recorded=len(commands) // 3, peak_python_bytes=peak))
+    return results
+
+
+def _import_time_ms(stderr):
+    """Sum the self times reported by `python -X importtime`."""
+    total = 0
+    for line in stderr.splitlines():
+        if line.startswith("import time:") and "|" in line:
+            self_time = line.split(":", 1)[1].split("|")[0].strip()
+            if self_time.isdigit():
+                total += int(self_time)
+    return total / 1000
+
+
+def bench_startup(workdir, quick, budget_ms):
+    env = dict(os.environ, HOME=str(workdir / "cli-home"), TERMO_TELEMETRY="0")
+    Path(env["HOME"]).mkdir(exist_ok=True)
+    termo = str(REPO_ROOT / "termo.py")
+
+    def tm(*args, importtime=False):
+        command = [sys.executable] + (["-X", "importtime"] if importtime else []) + [termo, *args]
+        return subprocess.run(command, env=env, cwd=REPO_ROOT, stdin=subprocess.DEVNULL,
+                              capture_output=True, text=True)
+
+    # The first run performs the first-run setup; make sure the noop macro exists
+    tm("ls")
+    setup = "from app.utils.config_utils import get_store; get_store().put('noop', ['true'])"
+    subprocess.run([sys.executable, "-c", setup], env=env, cwd=REPO_ROOT, check=True)
+
+    results, failures = [], []
+    for args in STARTUP_COMMANDS:
+        seconds = timed(lambda: tm(*args), 5 if quick else 15)
+        import_ms = _import_time_ms(tm(*args, importtime=True).stderr)
+        results.append(result("startup", "tm " + " ".join(args), seconds, import_ms=round(import_ms, 2)))
+        if args == ["ls"] and budget_ms is not None and import_ms > budget_ms:
+            failures.append(f"cold `tm ls` imports took {import_ms:.1f} ms, over the {budget_ms} ms budget")
+    return results, failures
+
+
+def bench_exec(workdir, quick):
+    from app.utils.dag_runner import DagRunner
+    from app.utils.runner import SequentialRunner
+    from app.utils.steps import parse_steps
+
+    count = 100 if quick else 500
+    steps = parse_steps(["true"] * count)
+    with quiet():
+        session_seconds = timed(lambda: SequentialRunner(steps).run())
+        system_seconds = timed(lambda: [os.system("true") for _ in range(count)])
+        parallel_steps = parse_steps(["true  #tm: group=all"] * count)
+        dag_seconds = timed(lambda: DagRunner(parallel_steps, [s.command for s in parallel_steps], 8).run())
+    return [
+        result("exec", "sequential.per_step", session_seconds / count, steps=count),
+        result("exec", "os_system.per_step", system_seconds / count, steps=count),
+        result("exec", "dag.per_step", dag_seconds / count, steps=count, jobs=8),
+    ]
+
+
+def bench_remote(workdir, quick):
+    try:
+        from benchmarks.ssh_server import SSHServerStandIn
+        from app.commands.remote import RemoteCommand
+    except ImportError as e:
+        print(f"skipping remote benchmarks: {e}", file=sys.stderr)
+        return []
+
+    steps = 10 if quick else 50
+    hosts = 8 if quick else 32
+    commands = ["true"] * steps
+    results = []
+    with SSHServerStandIn() as server, quiet():
+        target = f"bench@127.0.0.1:{server.port}"
+        remote = RemoteCommand()
+        for script in (False, True):
+            seconds = timed(lambda: remote._run_on_host("bench", target, commands, 22, None, "x", script,
+                                                        prefix=None), 3)
+            results.append(result("remote", "single_host.script" if script else "single_host.per_step",
+                                  seconds, steps=steps))
+
+        # Repeated runs against one host through the SSH broker, which keeps the connection
+        # open between them; the first run starts the broker and connects
+        os.environ["TERMO_SSH_TTL"] = "5"
+        remote._run_on_host("bench", target, commands, 22, None, "x", True, prefix=None, broker=True)
+        seconds = timed(lambda: remote._run_on_host("bench", target, commands, 22, None, "x", True,
+                                                    prefix=None, broker=True), 3)
+        results.append(result("remote", "single_host.script.broker", seconds, steps=steps))
+
+        def fan_out():
+            try:
+                remote._fan_out("bench", [target] * hosts, commands, 22, None, "x", True, 8)
+            except SystemExit:
+                pass
+        results.append(result("remote", "fan_out.script", timed(fan_out), steps=steps, hosts=hosts, workers=8))
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=REPO_ROOT, capture_output=True,
+                              text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the termo benchmark suite.")
+    parser.add_argument("--quick", action="store_true", help="Use small fixtures for a fast run.")
+    parser.add_argument("--only", default=",".join(SUITES), help=f"Comma-separated suites ({', '.join(SUITES)}).")
+    parser.add_argument("--output", default="-", help="Where to write the JSON results (default: stdout).")
+    parser.add_argument("--workdir", default=None, help="Directory for fixtures; reused between runs if given.")
+    parser.add_argument("--startup-budget-ms", type=float, default=None,
+                        help="Fail if cold `tm ls` spends longer than this importing modules.")
+    args = parser.parse_args()
+
+    workdir = Path(args.workdir or tempfile.mkdtemp(prefix="termo-bench-")).resolve()
+    workdir.mkdir(parents=True, exist_ok=True)
+    # Point termo at a scratch home before any app module is imported
+    os.environ["HOME"] = str(workdir / "home")
+    os.environ["TERMO_TELEMETRY"] = "0"
+    Path(os.environ["HOME"]).mkdir(exist_ok=True)
+
+    suites = [suite.strip() for suite in args.only.split(",") if suite.strip()]
+    results, failures = [], []
+    for suite in suites:
+        print(f"running {suite} benchmarks...", file=sys.stderr)
+        if suite == "store":
+            results += bench_store(workdir, args.quick)
+        elif suite == "history":
+            results += bench_history(workdir, args.quick)
+        elif suite == "startup":
+            startup_results, startup_failures = bench_startup(workdir, args.quick, args.startup_budget_ms)
+            results += startup_results
+            failures += startup_failures
+        elif suite == "exec":
+            results += bench_exec(workdir, args.quick)
+        elif suite == "remote":
+            results += bench_remote(workdir, args.quick)
+        else:
+            parser.error(f"unknown suite '{suite}'")
+
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "timestamp": time.time(),
+            "quick": args.quick,
+        },
+        "results": results,
+        "failures": failures,
+    }
+    output = json.dumps(report, indent=2)
+    if args.output == "-":
+        print(output)
+    else:
+        Path(args.output).write_text(output + "\n")
+
+    for failure in failures:
+        print(f"FAILED: {failure}", file=sys.stderr)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,82 @@
+"""A minimal in-process SSH server for benchmarking `tm remote` without a real host.
+
+It accepts any password, runs exec requests with the local shell and streams
+stdout, stderr and the exit status back over the channel.
+"""
+import socket
+import subprocess
+import threading
+
+import paramiko
+
+
+class _StandInServer(paramiko.ServerInterface):
+    def check_auth_password(self, username, password):
+        return paramiko.AUTH_SUCCESSFUL
+
+    def get_allowed_auths(self, username):
+        return "password"
+
+    def check_channel_request(self, kind, chanid):
+        return paramiko.OPEN_SUCCEEDED
+
+    def check_channel_exec_request(self, channel, command):
+        threading.Thread(target=_run_command, args=(channel, command.decode()), daemon=True).start()
+        return True
+
+
+def _run_command(channel, command):
+    process = subprocess.Popen(command, shell=True, stdin=subprocess.PIPE,
+                               stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+    def feed_stdin():
+        for data in iter(lambda: channel.recv(32768), b""):
+            process.stdin.write(data)
+            process.stdin.flush()
+        process.stdin.close()
+
+    def relay_stderr():
+        for data in iter(lambda: process.stderr.read1(32768), b""):
+            channel.sendall_stderr(data)
+
+    threading.Thread(target=feed_stdin, daemon=True).start()
+    stderr_thread = threading.Thread(target=relay_stderr, daemon=True)
+    stderr_thread.start()
+    for data in iter(lambda: process.stdout.read1(32768), b""):
+        channel.sendall(data)
+    stderr_thread.join()
+    channel.send_exit_status(process.wait())
+    channel.close()
+
+
+class SSHServerStandIn:
+    """Serves SSH on 127.0.0.1 from a background thread; use as a context manager."""
+
+    def __init__(self, port=0):
+        self.host_key = paramiko.RSAKey.generate(2048)
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.listener.bind(("127.0.0.1", port))
+        self.listener.listen(128)
+        self.port = self.listener.getsockname()[1]
+        self.transports = []
+
+    def __enter__(self):
+        threading.Thread(target=self._accept, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.listener.close()
+        for transport in self.transports:
+            transport.close()
+
+    def _accept(self):
+        while True:
+            try:
+                client, _ = self.listener.accept()
+            except OSError:
+                return
+            transport = paramiko.Transport(client)
+            transport.add_server_key(self.host_key)
+            transport.start_server(server=_StandInServer())
+            self.transports.append(transport)
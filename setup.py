@@ -16,8 +16,8 @@ setup(
     ],
     entry_points={
         "console_scripts": [
-            "tm=termo:cli",
-            "termo=termo:cli",
+            "tm=termo:main",
+            "termo=termo:main",
         ],
     },
     classifiers=[
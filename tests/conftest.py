@@ -0,0 +1,41 @@
+import json
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+@pytest.fixture
+def tm(tmp_path):
+    """Run `tm` in a fresh interpreter against a scratch HOME, without the daemon."""
+    home = tmp_path / "home"
+    home.mkdir()
+    base_env = dict(os.environ, HOME=str(home), TERMO_DAEMON="0")
+
+    def run(*args, timeout=60, env=None):
+        return subprocess.run([sys.executable, "-c", "from app.cli import cli; cli()", *args], cwd=ROOT,
+                              env=dict(base_env, **(env or {})), stdin=subprocess.DEVNULL, capture_output=True,
+                              text=True, timeout=timeout)
+
+    def add_macros(macros):
+        path = tmp_path / "macros.ndjson"
+        path.write_text("".join(json.dumps({"name": name, "commands": commands}) + "\n"
+                                for name, commands in macros.items()))
+        result = run("import", "--strategy", "overwrite", str(path))
+        assert result.returncode == 0, result.stdout + result.stderr
+
+    run.home = home
+    run.add_macros = add_macros
+    return run
+
+
+@pytest.fixture
+def ssh_server():
+    # Imported here so only the remote tests need paramiko
+    from benchmarks.ssh_server import SSHServerStandIn
+    with SSHServerStandIn() as server:
+        yield server
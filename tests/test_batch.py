@@ -0,0 +1,48 @@
+import time
+
+import click
+
+
+def _row_log(tm, row=1):
+    log, = tm.home.glob(f".termo/logs/*/{row}.log")
+    return click.unstyle(log.read_text())
+
+
+def test_a_step_that_runs_out_of_time_ends_its_row(tm):
+    tm.add_macros({"slow": ["sleep 30  #tm: timeout=0.5s", "echo after"]})
+    started = time.monotonic()
+    result = tm("exec", "slow", "--matrix", "x=1", env={"TERMO_KILL_GRACE": "1"})
+    assert time.monotonic() - started < 10
+    assert result.returncode == 1
+    assert "timed out after 0.5s" in click.unstyle(result.stdout)
+    assert "→ echo after" not in _row_log(tm)
+
+
+def test_a_failing_step_is_retried_within_its_row(tm, tmp_path):
+    marker = tmp_path / "tried"
+    tm.add_macros({"flaky": [f"test -e {marker} || {{ touch {marker}; false; }}  #tm: retries=2 backoff=0.1s",
+                             "echo done"]})
+    result = tm("exec", "flaky", "--matrix", "x=1")
+    assert result.returncode == 0, result.stdout
+    log = _row_log(tm)
+    assert log.count("↻ retrying in") == 1
+    assert "done" in log.splitlines()
+
+
+def test_steps_after_a_failed_step_are_skipped_and_state_carries_over(tm):
+    tm.add_macros({"broken": ["cd /tmp", "pwd", "false", "echo after", "echo independent  #tm: needs="]})
+    result = tm("exec", "broken", "--matrix", "x=1")
+    assert result.returncode == 1
+    lines = _row_log(tm).splitlines()
+    assert "/tmp" in lines
+    assert "[termo] step 3 exited with status 1" in lines
+    assert "[termo] step 4 skipped" in lines
+    assert "after" not in lines
+    assert "independent" in lines
+
+
+def test_timeout_limits_the_whole_row(tm):
+    tm.add_macros({"slow": ["sleep 0.2  #tm: timeout=5s", "sleep 30"]})
+    result = tm("exec", "slow", "--matrix", "x=1", "--timeout", "1s", env={"TERMO_KILL_GRACE": "1"})
+    assert result.returncode == 1
+    assert "timed out after 1s" in click.unstyle(result.stdout)
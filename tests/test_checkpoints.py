@@ -0,0 +1,85 @@
+import sqlite3
+import time
+
+import pytest
+
+from app.utils import checkpoints
+from app.utils.checkpoints import Checkpoint
+from app.utils.steps import StepResult, parse_steps
+
+STEPS = parse_steps(["echo one", "echo two", "echo three"])
+
+
+@pytest.fixture
+def path(tmp_path):
+    return tmp_path / "checkpoints.db"
+
+
+def _checkpoint(path, resume=False, name="deploy", version=1, steps=STEPS, cwd="/work"):
+    return Checkpoint(name, version, steps, resume, cwd=cwd, path=path)
+
+
+def _fail_after_first(checkpoint):
+    checkpoint.record(STEPS[0], "/work/sub")
+    checkpoint.finish([StepResult(STEPS[0], "ok", 0), StepResult(STEPS[1], "failed", 1),
+                       StepResult(STEPS[2], "skipped")])
+
+
+def _rows(path):
+    with sqlite3.connect(path) as connection:
+        return connection.execute("SELECT macro, version, steps FROM checkpoints ORDER BY macro, version").fetchall()
+
+
+def test_steps_are_not_written_until_the_run_ends(path):
+    checkpoint = _checkpoint(path)
+    checkpoint.record(STEPS[0])
+    checkpoint.record(STEPS[1])
+    assert not path.exists()
+    checkpoint.finish([StepResult(STEPS[0], "ok", 0), StepResult(STEPS[1], "ok", 0),
+                       StepResult(STEPS[2], "failed", 1)])
+    assert _rows(path) == [("deploy", 1, '["1", "2"]')]
+
+
+def test_a_resumed_run_skips_the_completed_steps_and_its_success_forgets_them(path):
+    _fail_after_first(_checkpoint(path))
+    resumed = _checkpoint(path, resume=True)
+    assert resumed.is_done(STEPS[0]) and not resumed.is_done(STEPS[1])
+    assert resumed.cwd == "/work/sub"
+    resumed.record(STEPS[1])
+    resumed.record(STEPS[2])
+    resumed.finish([StepResult(STEPS[0], "resumed", 0), StepResult(STEPS[1], "ok", 0),
+                    StepResult(STEPS[2], "ok", 0)])
+    assert _rows(path) == []
+    assert not _checkpoint(path, resume=True).resumed
+
+
+def test_a_checkpoint_only_resumes_the_same_params_and_directory(path):
+    _fail_after_first(_checkpoint(path))
+    assert not _checkpoint(path, resume=True, cwd="/elsewhere").resumed
+    assert not _checkpoint(path, resume=True, steps=parse_steps(["echo one", "echo 2", "echo three"])).resumed
+    assert not _checkpoint(path, resume=True, version=2).resumed
+
+
+def test_an_interrupted_run_is_saved_on_close(path):
+    checkpoint = _checkpoint(path)
+    checkpoint.record(STEPS[0])
+    checkpoint.close()
+    assert _checkpoint(path, resume=True).resumed == {"1"}
+
+
+def test_old_checkpoints_and_earlier_versions_are_dropped(path):
+    _fail_after_first(_checkpoint(path, name="old"))
+    _fail_after_first(_checkpoint(path, name="deploy", version=1))
+    _fail_after_first(_checkpoint(path, name="other", version=1))
+    with sqlite3.connect(path) as connection:
+        connection.execute("UPDATE checkpoints SET updated = ? WHERE macro = 'old'",
+                           (time.time() - (checkpoints.MAX_AGE_DAYS + 1) * 86400,))
+    _fail_after_first(_checkpoint(path, name="deploy", version=2))
+    assert _rows(path) == [("deploy", 2, '["1"]'), ("other", 1, '["1"]')]
+
+
+def test_checkpoints_beyond_the_cap_are_dropped_oldest_first(path, monkeypatch):
+    monkeypatch.setattr(checkpoints, "MAX_CHECKPOINTS", 2)
+    for name in ("first", "second", "third"):
+        _fail_after_first(_checkpoint(path, name=name))
+    assert [row[0] for row in _rows(path)] == ["second", "third"]
@@ -0,0 +1,27 @@
+from app import client
+from app.cli import COMMANDS
+
+
+def _forwards(monkeypatch, tmp_path, argv, tty):
+    socket_path = tmp_path / "daemon.sock"
+    socket_path.touch()
+    monkeypatch.setattr(client, "DAEMON_SOCKET", str(socket_path))
+    monkeypatch.delenv("TERMO_DAEMON", raising=False)
+    monkeypatch.setattr(client.os, "isatty", lambda fd: tty)
+    return client._should_forward(argv)
+
+
+def test_every_command_is_classified():
+    # Any command missing here would be taken for a macro name that runs steps
+    assert set(COMMANDS) - {"exec", "remote", "watch"} == client.LOCAL_COMMANDS | client.STEPLESS_COMMANDS
+
+
+def test_steps_run_from_a_terminal_stay_local(monkeypatch, tmp_path):
+    for argv in (["deploy"], ["exec", "deploy"], ["remote", "deploy", "-h", "host"], ["watch", "build"]):
+        assert not _forwards(monkeypatch, tmp_path, argv, tty=True)
+        assert _forwards(monkeypatch, tmp_path, argv, tty=False)
+
+
+def test_stepless_commands_are_forwarded_from_a_terminal(monkeypatch, tmp_path):
+    assert _forwards(monkeypatch, tmp_path, ["ls"], tty=True)
+    assert not _forwards(monkeypatch, tmp_path, ["edit", "deploy"], tty=True)
@@ -0,0 +1,35 @@
+from app.utils.completion import DESCRIPTION_CHARS, write_completion_cache
+
+
+class _Store:
+    def __init__(self, macros):
+        self.macros = macros
+
+    def get(self, name):
+        return self.macros.get(name)
+
+    def summaries(self):
+        return [(name, commands[0]) for name, commands in self.macros.items()]
+
+
+def _entries(path):
+    return dict(line.rstrip("\n").split("\t") for line in path.read_text().splitlines())
+
+
+def test_long_names_are_written_whole_and_only_descriptions_are_shortened(tmp_path):
+    path = tmp_path / "completions.txt"
+    long_name = "deploy-" + "x" * DESCRIPTION_CHARS
+    store = _Store({long_name: ["echo " + "y" * 100], long_name + "-staging": ["echo  staging"]})
+    write_completion_cache(store, path)
+    entries = _entries(path)
+    assert set(entries) == {long_name, long_name + "-staging"}
+    assert entries[long_name] == ("echo " + "y" * 100)[:DESCRIPTION_CHARS]
+    assert entries[long_name + "-staging"] == "echo staging"
+
+    # Patching one of two names sharing their first DESCRIPTION_CHARS characters leaves the other
+    store.macros[long_name] = ["echo changed"]
+    write_completion_cache(store, path, [long_name])
+    assert _entries(path) == {long_name: "echo changed", long_name + "-staging": "echo staging"}
+    del store.macros[long_name]
+    write_completion_cache(store, path, [long_name])
+    assert _entries(path) == {long_name + "-staging": "echo staging"}
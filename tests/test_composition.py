@@ -0,0 +1,67 @@
+import pytest
+
+from app.utils.composition import CompositionError, MissingMacroError, flatten
+from app.utils.macro_store import SqliteMacroStore
+
+
+def test_child_steps_replace_the_reference_with_arguments_bound():
+    macros = {"build": ["make {1} TARGET={2:all}", "echo {{env:dev}} {{tag}}"]}
+    assert flatten("release", ["@build api", "@build web dist env=prod", "echo done"], macros.get) == [
+        "make api TARGET=all", "echo {{env:dev}} {{tag}}",
+        "make web TARGET=dist", "echo prod {{tag}}",
+        "echo done"]
+
+
+def test_arguments_can_hold_the_parents_own_placeholders():
+    macros = {"build": ["make {1}"]}
+    assert flatten("release", ["@build {1:api}", "@build {{service}}"], macros.get) == ["make {1:api}",
+                                                                                       "make {{service}}"]
+
+
+def test_a_required_positional_parameter_without_an_argument_is_rejected():
+    with pytest.raises(CompositionError, match="'@build' needs a value"):
+        flatten("release", ["@build"], {"build": ["make {1}"]}.get)
+
+
+def test_grandchildren_are_flattened_and_scoped_options_dropped():
+    macros = {"fetch": ["git fetch  #tm: id=fetch retries=2"],
+              "build": ["@fetch", "make {1}  #tm: needs=fetch timeout=5m"]}
+    assert flatten("release", ["@build api"], macros.get) == ["git fetch  #tm: retries=2",
+                                                             "make api  #tm: timeout=5m"]
+
+
+@pytest.mark.parametrize("macros, message", [
+    ({}, "release → release"),
+    ({"build": ["@release"]}, "release → build → release"),
+    ({"build": ["@test"], "test": ["echo ok", "@build"]}, "release → build → test → build"),
+])
+def test_cycles_are_rejected(macros, message):
+    macros = dict(macros)
+    macros.setdefault("release", ["@build" if "build" in macros else "@release"])
+    with pytest.raises(CompositionError, match=message):
+        flatten("release", macros["release"], macros.get)
+
+
+def test_a_missing_child_is_reported_as_such():
+    with pytest.raises(MissingMacroError, match="uses macro 'build', which does not exist"):
+        flatten("release", ["@build"], {}.get)
+
+
+def test_annotations_on_a_reference_are_rejected():
+    with pytest.raises(CompositionError, match="not supported"):
+        flatten("release", ["@build  #tm: timeout=5s"], {"build": ["make"]}.get)
+
+
+def test_the_store_rejects_a_cycle_and_keeps_plans_current(tmp_path):
+    store = SqliteMacroStore(tmp_path / "macros.db")
+    # A macro may be saved before the macros it uses
+    store.put("release", ["@build {1}", "echo released {1}"])
+    store.put("build", ["make {1}"])
+    assert [template.text for template in store.get_templates("release")] == [None, None]
+    assert [template.segments for template in store.get_templates("release")][0] == ["make ", ("1", None)]
+    with pytest.raises(CompositionError, match="cycle"):
+        store.put("build", ["@release {1}"])
+    assert store.get("build") == ["make {1}"]
+    store.put("build", ["make -j4 {1}"])
+    assert store.get_templates("release")[0].segments == ["make -j4 ", ("1", None)]
+    store.close()
@@ -0,0 +1,12 @@
+import json
+
+
+def test_migrating_macros_json_refreshes_completions(tm):
+    termo_dir = tm.home / ".termo"
+    termo_dir.mkdir()
+    (termo_dir / ".config.json").write_text(json.dumps({"first_run": False}))
+    (termo_dir / "macros.json").write_text(json.dumps({"legacy": ["echo legacy"]}))
+    result = tm("ls")
+    assert result.returncode == 0, result.stderr
+    assert (termo_dir / "macros.json.migrated").exists()
+    assert "legacy" in (termo_dir / "completions.txt").read_text().split()
@@ -0,0 +1,26 @@
+import socket
+import time
+
+from app import daemon
+from app.client import HEADER
+
+
+def _listener(tmp_path):
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    listener.bind(str(tmp_path / "daemon.sock"))
+    listener.listen(1)
+    return listener
+
+
+def test_a_client_that_never_sends_its_request_does_not_block_the_daemon(tmp_path, monkeypatch, capsys):
+    monkeypatch.setattr(daemon, "REQUEST_TIMEOUT", 0.2)
+    server = daemon.Daemon()
+    server.store = None
+    with _listener(tmp_path) as listener, socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.connect(str(tmp_path / "daemon.sock"))
+        client.sendall(HEADER.pack(100))
+        started = time.monotonic()
+        server._handle(listener)
+        assert time.monotonic() - started < 2
+    assert not server.children
+    assert "Bad request" in capsys.readouterr().err
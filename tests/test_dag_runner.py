@@ -0,0 +1,8 @@
+def test_a_line_longer_than_the_stream_limit_is_printed_whole(tm):
+    tm.add_macros({"long": ["python3 -c \"print('x' * 200000)\"", "echo done"]})
+    result = tm("exec", "long", "-j", "2")
+    assert result.returncode == 0, result.stderr
+    lines = result.stdout.splitlines()
+    assert any(line.endswith("x" * 200000) for line in lines)
+    assert any(line.endswith("done") for line in lines)
+    assert "Traceback" not in result.stderr
@@ -0,0 +1,19 @@
+from app.utils.env_utils import env_number
+
+
+def test_env_number_reads_valid_values(monkeypatch):
+    monkeypatch.setenv("TERMO_TEST_NUMBER", "2.5")
+    assert env_number("TERMO_TEST_NUMBER", 5) == 2.5
+    monkeypatch.setenv("TERMO_TEST_NUMBER", "300")
+    assert env_number("TERMO_TEST_NUMBER", 2000, int) == 300
+
+
+def test_env_number_falls_back_to_the_default(monkeypatch, capsys):
+    monkeypatch.delenv("TERMO_TEST_NUMBER", raising=False)
+    assert env_number("TERMO_TEST_NUMBER", 5) == 5
+    for text in ("", "soon", "-1", "nan", "inf"):
+        monkeypatch.setenv("TERMO_TEST_NUMBER", text)
+        assert env_number("TERMO_TEST_NUMBER", 5) == 5
+    monkeypatch.setenv("TERMO_TEST_NUMBER", "1.5")
+    assert env_number("TERMO_TEST_NUMBER", 2000, int) == 2000
+    assert "expected a whole number" in capsys.readouterr().err
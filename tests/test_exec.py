@@ -0,0 +1,41 @@
+import pytest
+
+
+@pytest.mark.parametrize("jobs", ["1", "2"])
+def test_a_failed_step_skips_the_steps_after_it_and_fails_the_run(tm, jobs):
+    tm.add_macros({"broken": ["echo first", "false", "echo after"]})
+    result = tm("exec", "broken", "-j", jobs)
+    assert result.returncode == 1
+    assert "first" in result.stdout
+    assert "after" not in result.stdout.replace("→ echo after", "")
+    # With -j the failure cancels the rest before they are reached
+    assert "- 3: skipped" in result.stdout or "- 3: cancelled" in result.stdout
+
+
+def test_a_step_that_does_not_need_the_failed_one_still_runs(tm):
+    tm.add_macros({"partial": ["false  #tm: id=a needs=", "echo independent  #tm: needs=", "echo b  #tm: needs=a"]})
+    result = tm("exec", "partial")
+    assert result.returncode == 1
+    assert "independent" in result.stdout
+    assert "- a: failed" in result.stdout
+    assert "- 3: skipped" in result.stdout
+
+
+def test_a_run_where_every_step_succeeds_exits_zero(tm):
+    tm.add_macros({"fine": ["echo one", "echo two"]})
+    assert tm("exec", "fine").returncode == 0
+
+
+@pytest.mark.parametrize("jobs", ["1", "2"])
+def test_resume_continues_from_the_first_incomplete_step(tm, jobs):
+    tm.add_macros({"flaky": ["echo one", 'test -f "$HOME/ready"', "echo three"]})
+    first = tm("exec", "flaky", "-j", jobs)
+    assert first.returncode == 1
+    assert "--resume" in first.stdout
+    (tm.home / "ready").touch()
+    resumed = tm("exec", "flaky", "-j", jobs, "--resume")
+    assert resumed.returncode == 0, resumed.stdout + resumed.stderr
+    assert "echo one (done in previous run)" in resumed.stdout
+    assert "three" in resumed.stdout
+    again = tm("exec", "flaky", "-j", jobs, "--resume")
+    assert "No checkpoint to resume from" in again.stdout
@@ -0,0 +1,75 @@
+import pytest
+
+from app.utils import history_utils
+from app.utils.history_utils import (BashHistoryParser, FishHistoryParser, HistoryMarkerError, ZshHistoryParser,
+                                     find_recorded_commands, read_lines_reversed)
+
+
+def _history(tmp_path, lines):
+    path = tmp_path / "bash_history"
+    path.write_text("".join(line + "\n" for line in lines))
+    return path
+
+
+def test_returns_the_commands_between_new_and_the_save_after_it(tmp_path):
+    path = _history(tmp_path, ["ls", "tm new build", "make", "", "make test", "tm save", "echo later", "tm save"])
+    assert find_recorded_commands("build", BashHistoryParser(), path) == ["make", "make test"]
+
+
+def test_a_missing_save_is_reported(tmp_path):
+    path = _history(tmp_path, ["tm new build", "make"])
+    with pytest.raises(HistoryMarkerError, match="No 'save'"):
+        find_recorded_commands("build", BashHistoryParser(), path)
+
+
+def test_gives_up_on_a_missing_start_marker_after_max_entries(tmp_path):
+    path = _history(tmp_path, ["tm new other"] + [f"echo {number}" for number in range(50)] + ["tm save"])
+    with pytest.raises(HistoryMarkerError, match="within 10 commands"):
+        find_recorded_commands("build", BashHistoryParser(), path, max_entries=10)
+    with pytest.raises(HistoryMarkerError, match="No 'new build' found in bash"):
+        find_recorded_commands("build", BashHistoryParser(), path)
+
+
+@pytest.mark.parametrize("chunk_size", [1, 3, 7, 64 * 1024])
+def test_reversed_lines_are_whole_whatever_the_block_size(tmp_path, chunk_size):
+    path = tmp_path / "history"
+    path.write_bytes(b"first\n\nthird line\n" + b"x" * 20 + b"\nno newline")
+    assert list(read_lines_reversed(path, chunk_size)) == [b"no newline", b"x" * 20, b"third line", b"", b"first"]
+
+
+def test_zsh_extended_history_with_metafied_bytes_and_multi_line_entries(tmp_path):
+    path = tmp_path / "zsh_history"
+    # zsh stores the em dash's last byte 0x94 as META followed by 0x94 ^ 0x20
+    path.write_bytes(b": 1700000000:0;tm new build\n"
+                     b": 1700000001:0;echo \xe2\x80\x83\xb4 done\n"
+                     b": 1700000002:3;for x in 1 2; do\\\n  echo $x\\\ndone\n"
+                     b"plain; command\n"
+                     b": 1700000003:0;tm save\n")
+    assert find_recorded_commands("build", ZshHistoryParser(), path) == [
+        "echo \u2014 done", "for x in 1 2; do\n  echo $x\ndone", "plain; command"]
+
+
+def test_fish_history_records(tmp_path):
+    path = tmp_path / "fish_history"
+    path.write_text("- cmd: tm new build\n  when: 1700000000\n"
+                    "- cmd: echo one\\ntwo\n  when: 1700000001\n  paths:\n    - one\n"
+                    "- cmd: echo back\\\\slash\n  when: 1700000002\n"
+                    "- cmd: tm save\n  when: 1700000003\n")
+    assert find_recorded_commands("build", FishHistoryParser(), path) == ["echo one\ntwo", "echo back\\slash"]
+
+
+def test_the_scan_stops_reading_once_max_entries_is_passed(tmp_path, monkeypatch):
+    path = _history(tmp_path, ["tm new build"] + [f"echo {number}" for number in range(5000)] + ["tm save"])
+    read = []
+
+    def small_blocks(path):
+        for line in read_lines_reversed(path, chunk_size=16):
+            read.append(line)
+            yield line
+
+    monkeypatch.setattr(history_utils, "read_lines_reversed", small_blocks)
+    with pytest.raises(HistoryMarkerError, match="within 100 commands"):
+        find_recorded_commands("build", BashHistoryParser(), path, max_entries=100)
+    # The save, the 101 commands past the limit and the empty piece after the last newline
+    assert len(read) == 103
+    assert read[-1] == b"echo 4899"
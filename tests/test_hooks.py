@@ -0,0 +1,66 @@
+import json
+
+import pytest
+
+RECORDER = (
+    "import json, os\n"
+    "class Recorder:\n"
+    "    def _write(self, *event):\n"
+    "        with open(os.environ['RECORD'], 'a') as file:\n"
+    "            file.write(json.dumps(event) + '\\n')\n"
+    "    def step_start(self, run, step):\n"
+    "        self._write('step_start', step.id)\n"
+    "    def step_end(self, run, step, result):\n"
+    "        self._write('step_end', step.id, result.status)\n"
+    "    def output(self, run, step, data, err):\n"
+    "        self._write('output', step.id, data.decode(), err)\n")
+
+
+@pytest.fixture
+def record(tm, tmp_path):
+    (tmp_path / "recorder.py").write_text(RECORDER)
+    path = tmp_path / "record.jsonl"
+
+    def run(*args):
+        result = tm(*args, env={"TERMO_HOOKS": "recorder:Recorder", "PYTHONPATH": str(tmp_path),
+                                "RECORD": str(path)})
+        return result, [json.loads(line) for line in path.read_text().splitlines()]
+    return run
+
+
+@pytest.mark.parametrize("jobs", ["1", "2"])
+def test_every_step_end_follows_a_step_start(tm, record, jobs):
+    tm.add_macros({"broken": ["echo first", "false", "echo after", "echo independent  #tm: needs="]})
+    result, events = record("exec", "broken", "-j", jobs)
+    assert result.returncode == 1
+    started = []
+    for event in events:
+        if event[0] == "step_start":
+            started.append(event[1])
+        elif event[0] == "step_end":
+            assert event[1] in started
+            started.remove(event[1])
+    assert started == []
+    ends = {event[1]: event[2] for event in events if event[0] == "step_end"}
+    assert set(ends) == {"1", "2", "3", "4"}
+    assert ends["2"] == "failed"
+    assert ends["3"] in ("skipped", "cancelled")
+
+
+@pytest.mark.parametrize("jobs", ["1", "2"])
+def test_output_events_are_sent_for_parallel_and_sequential_steps(tm, record, jobs):
+    tm.add_macros({"talk": ["echo hello", "echo oops >&2"]})
+    result, events = record("exec", "talk", "-j", jobs)
+    assert result.returncode == 0, result.stdout + result.stderr
+    output = [event[1:] for event in events if event[0] == "output"]
+    assert output == [["1", "hello\n", False], ["2", "oops\n", True]]
+    assert "hello" in result.stdout
+    assert "oops" in result.stderr
+
+
+def test_a_step_skipped_past_the_deadline_is_started_and_ended(tm, record):
+    tm.add_macros({"slow": ["sleep 1", "echo late"]})
+    result, events = record("exec", "slow", "--timeout", "0.5s")
+    assert result.returncode == 1
+    assert ["step_start", "2"] in events
+    assert ["step_end", "2", "skipped"] in events
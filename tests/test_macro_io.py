@@ -0,0 +1,33 @@
+from app.utils.macro_io import ImportPlan
+
+
+class _Store:
+    def __init__(self, macros):
+        self.macros = macros
+
+    def get_many(self, names):
+        return {name: self.macros[name] for name in names if name in self.macros}
+
+    def contains(self, name):
+        return name in self.macros
+
+
+def _actions(strategy, store, items):
+    plan = ImportPlan(_Store(store), strategy)
+    actions = []
+    for batch in plan.batches(items, lambda action, name, target, current, commands: actions.append(
+            (action, target))):
+        pass
+    return actions, plan
+
+
+def test_duplicates_in_the_file_are_resolved_against_each_other():
+    items = [("a", ["echo 1"]), ("a", ["echo 1"]), ("a", ["echo 2"]), ("b", ["echo b"])]
+    actions, _ = _actions("rename", {"b": ["echo b"]}, items)
+    assert actions == [("add", "a"), ("unchanged", "a"), ("rename", "a-2"), ("unchanged", "b")]
+
+
+def test_claimed_names_keep_a_hash_not_the_commands():
+    _, plan = _actions("overwrite", {}, [("a", ["echo " + "x" * 1000])])
+    assert list(plan.claimed) == ["a"]
+    assert isinstance(plan.claimed["a"], bytes) and len(plan.claimed["a"]) < 100
@@ -0,0 +1,120 @@
+import json
+import multiprocessing
+import sqlite3
+
+import pytest
+
+from app.utils.macro_store import SCHEMA_VERSION, SnapshotMacroStore, SqliteMacroStore
+
+
+def test_current_version_counts_every_save(tmp_path):
+    store = SqliteMacroStore(tmp_path / "macros.db")
+    store.put("deploy", ["make"])
+    store.put("deploy", ["make", "make install"])
+    assert store.current_version("deploy") == 2
+    assert store.current_version("missing") is None
+    store.close()
+
+
+def test_snapshot_answers_current_version_from_memory(tmp_path):
+    store = SqliteMacroStore(tmp_path / "macros.db")
+    store.put("deploy", ["make"])
+    store.put("deploy", ["make", "make install"])
+    store.close()
+    snapshot = SnapshotMacroStore(tmp_path / "macros.db")
+    assert snapshot.current_version("deploy") == 2
+    # The database connection forked request processes would otherwise open
+    assert snapshot._backing is None
+
+
+def test_put_many_writes_every_macro_or_none(tmp_path):
+    store = SqliteMacroStore(tmp_path / "macros.db")
+    store.put("deploy", ["make"])
+    with pytest.raises(TypeError):
+        # The second macro cannot be encoded, after the first was written in the same transaction
+        store.put_many([("deploy", ["make", "make install"]), ("broken", [object()])])
+    assert store.get("deploy") == ["make"]
+    assert store.current_version("deploy") == 1
+    assert not store.contains("broken")
+    assert store.search("install") == []
+    store.close()
+
+
+def _write_macros(path, writer, count):
+    store = SqliteMacroStore(path)
+    for number in range(count):
+        store.put(f"{writer}-{number}", [f"echo {writer} {number}"])
+        store.put("shared", [f"echo {writer} {number}"])
+    store.close()
+
+
+def test_concurrent_writers_lose_no_updates(tmp_path):
+    path = tmp_path / "macros.db"
+    SqliteMacroStore(path).close()
+    context = multiprocessing.get_context("fork")
+    writers = [context.Process(target=_write_macros, args=(path, writer, 25)) for writer in range(4)]
+    for process in writers:
+        process.start()
+    for process in writers:
+        process.join(60)
+        assert process.exitcode == 0
+    store = SqliteMacroStore(path)
+    assert len(store.names()) == 4 * 25 + 1
+    assert store.current_version("shared") == 4 * 25
+    assert len(store.versions("shared")) == 4 * 25
+    assert [name for name, _ in store.search("echo 3 24")][:1] == ["3-24"]
+    store.close()
+
+
+def test_a_version_1_database_is_migrated_to_the_current_schema(tmp_path):
+    path = tmp_path / "macros.db"
+    db = sqlite3.connect(path)
+    db.execute("CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT)")
+    db.execute("CREATE TABLE macros (name TEXT PRIMARY KEY, commands TEXT NOT NULL)")
+    db.executemany("INSERT INTO macros (name, commands) VALUES (?, ?)",
+                   [("build", json.dumps(["make {1:all}"])), ("release", json.dumps(["@build dist", "echo done"]))])
+    db.execute("PRAGMA user_version = 1")
+    db.commit()
+    db.close()
+
+    store = SqliteMacroStore(path)
+    assert store.connection.execute("PRAGMA user_version").fetchone()[0] == SCHEMA_VERSION
+    assert [name for name, _ in store.search("make all")] == ["build"]
+    assert [template.text for template in store.get_templates("release")] == ["make dist", "echo done"]
+    assert store.dependants("build") == ["release"]
+    assert store.current_version("release") == 1
+    store.put("build", ["make {1:all} -j4"])
+    assert [version.commands for version in store.versions("build")] == [["make {1:all}"], ["make {1:all} -j4"]]
+    store.close()
+
+
+def test_macros_json_is_imported_once_and_moved_aside(tmp_path):
+    legacy = tmp_path / "macros.json"
+    legacy.write_text(json.dumps({"deploy": ["make", "make install"]}))
+    store = SqliteMacroStore(tmp_path / "macros.db", legacy)
+    assert store.migrated_json
+    assert store.get("deploy") == ["make", "make install"]
+    assert not legacy.exists()
+    assert json.loads((tmp_path / "macros.json.migrated").read_text()) == {"deploy": ["make", "make install"]}
+    store.close()
+
+    # A macros.json written later, e.g. by an older termo, is not imported over the database
+    legacy.write_text(json.dumps({"deploy": ["echo stale"]}))
+    store = SqliteMacroStore(tmp_path / "macros.db", legacy)
+    assert not store.migrated_json
+    assert store.get("deploy") == ["make", "make install"]
+    assert legacy.exists()
+    store.close()
+
+
+def test_short_queries_match_command_text_not_its_json(tmp_path):
+    store = SqliteMacroStore(tmp_path / "macros.db")
+    store.put_many([("list", ["ls -la"]), ("names", ["echo a_b"]), ("accent", ["echo café"])])
+    # Every command is stored quoted, and "é" escaped, in the JSON column
+    assert store.search('"') == []
+    assert store.search("u0") == []
+    assert [name for name, _ in store.search("é")] == ["accent"]
+    # LIKE wildcards in the query are matched literally
+    assert [name for name, _ in store.search("_")] == ["names"]
+    assert [name for name, _ in store.search("%")] == []
+    store.close()
@@ -0,0 +1,124 @@
+import json
+import os
+import threading
+
+from app.commands.remote import _stream_channel
+
+
+def test_fan_out_reports_a_malformed_target_as_a_failed_host(tm, ssh_server):
+    tm.add_macros({"hello": ["echo hello from $((40 + 2))"]})
+    good = f"u@127.0.0.1:{ssh_server.port}"
+    result = tm("remote", "hello", "--hosts", f"{good},u@127.0.0.1:notaport", "-P", "x", "--no-broker")
+    assert result.returncode == 1
+    assert f"[{good}] hello from 42" in result.stdout
+    assert "1 succeeded, 1 failed" in result.stdout
+    assert "invalid port 'notaport'" in result.stdout
+
+
+def test_fan_out_runs_every_step_on_every_host(tm, ssh_server):
+    tm.add_macros({"steps": ["echo one", "false", "echo three"]})
+    targets = [f"user{index}@127.0.0.1:{ssh_server.port}" for index in range(3)]
+    result = tm("remote", "steps", "--hosts", ",".join(targets), "-P", "x", "--no-broker")
+    assert result.returncode == 1
+    for target in targets:
+        assert f"[{target}] one" in result.stdout
+        assert f"[{target}] three" in result.stdout
+    assert "0 succeeded, 3 failed" in result.stdout
+
+
+def test_script_mode_reads_output_while_sending_a_large_script(tm, ssh_server):
+    # The first step writes more than the channel window holds before the shell has read
+    # the rest of a script that is itself larger than the window
+    padding = ": " + "x" * 1000
+    tm.add_macros({"big": ["head -c 5000000 /dev/zero | tr '\\0' x; echo"] + [padding] * 3000 + ["echo done"]})
+    result = tm("remote", "big", "-h", f"u@127.0.0.1:{ssh_server.port}", "-P", "x", "--no-broker", "--script")
+    assert result.returncode == 0, result.stderr
+    assert "done" in result.stdout.splitlines()
+
+
+class _Collector:
+    def __init__(self):
+        self.data = b""
+
+    def write(self, data, final=False):
+        self.data += data
+
+    def close(self):
+        pass
+
+
+class _LateOutputChannel:
+    """A channel whose exit status arrives before its last output and EOF, as some servers send them."""
+
+    def __init__(self):
+        self.reader, self.writer = os.pipe()
+        self.stdout = bytearray()
+        self.eof_received = False
+        self.closed = False
+        threading.Timer(0.3, self._finish).start()
+
+    def _finish(self):
+        self.stdout += b"late output\n"
+        self.eof_received = True
+
+    def fileno(self):
+        return self.reader
+
+    def recv_ready(self):
+        return bool(self.stdout)
+
+    def recv(self, size):
+        data = bytes(self.stdout[:size])
+        del self.stdout[:size]
+        return data
+
+    def recv_stderr_ready(self):
+        return False
+
+    def exit_status_ready(self):
+        return True
+
+    def recv_exit_status(self):
+        return 0
+
+
+def test_stream_channel_reads_output_that_follows_the_exit_status():
+    channel = _LateOutputChannel()
+    stdout, stderr = _Collector(), _Collector()
+    try:
+        assert _stream_channel(channel, stdout, stderr) == 0
+    finally:
+        os.close(channel.reader)
+        os.close(channel.writer)
+    assert stdout.data == b"late output\n"
+
+
+def test_fan_out_sends_every_host_s_step_results_to_macro_end(tm, ssh_server, tmp_path):
+    (tmp_path / "recorder.py").write_text(
+        "import json, os\n"
+        "class Recorder:\n"
+        "    def macro_end(self, run, results):\n"
+        "        with open(os.environ['RECORD'], 'a') as file:\n"
+        "            file.write(json.dumps([run.host or '', [result.status for result in results]]) + '\\n')\n")
+    record = tmp_path / "record.jsonl"
+    tm.add_macros({"two": ["true", "true"]})
+    targets = [f"user{index}@127.0.0.1:{ssh_server.port}" for index in range(2)]
+    result = tm("remote", "two", "--hosts", ",".join(targets), "-P", "x", "--no-broker",
+                env={"TERMO_HOOKS": "recorder:Recorder", "PYTHONPATH": str(tmp_path), "RECORD": str(record)})
+    assert result.returncode == 0, result.stdout + result.stderr
+    ends = [json.loads(line) for line in record.read_text().splitlines()]
+    assert sorted(ends) == sorted([[targets[0], ["ok", "ok"]], [targets[1], ["ok", "ok"]], ["", ["ok"] * 4]])
+
+
+def test_single_host_run_exits_non_zero_when_a_step_fails(tm, ssh_server):
+    tm.add_macros({"steps": ["echo one", "false"]})
+    result = tm("remote", "steps", "-h", f"u@127.0.0.1:{ssh_server.port}", "-P", "x", "--no-broker")
+    assert result.returncode == 1
+    assert "one" in result.stdout.splitlines()
+
+
+def test_single_host_run_exits_non_zero_when_it_cannot_connect(tm):
+    tm.add_macros({"hello": ["echo hello"]})
+    result = tm("remote", "hello", "-h", "u@127.0.0.1:notaport", "-P", "x", "--no-broker")
+    assert result.returncode == 1
+    assert "Unable to connect or execute commands" in result.stdout
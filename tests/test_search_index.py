@@ -0,0 +1,13 @@
+import click
+
+from app.utils.search_index import highlight
+
+
+def test_highlight_styles_every_word_of_the_query():
+    assert highlight("git push origin", "ORIGIN push") == (
+        f"git {click.style('push', fg='yellow', bold=True)} {click.style('origin', fg='yellow', bold=True)}")
+
+
+def test_highlight_leaves_text_alone_for_a_blank_query():
+    assert highlight("git push", "") == "git push"
+    assert highlight("git push", "   ") == "git push"
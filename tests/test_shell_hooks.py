@@ -0,0 +1,81 @@
+import os
+import pty
+import select
+import shutil
+
+import pytest
+
+from app.utils import shell_hooks
+from app.utils.macro_store import SqliteMacroStore
+from app.utils.shell_hooks import hook_script, read_journal
+
+SHELLS = {"bash": ["bash", "--norc", "--noprofile", "-i"], "zsh": ["zsh", "-f", "-i"]}
+
+
+def _interactive(argv, home, lines):
+    """Type lines into an interactive shell on a pseudo-terminal; return the shell's pid once it exits."""
+    pid, fd = pty.fork()
+    if pid == 0:
+        os.environ["HOME"] = str(home)
+        os.execvp(argv[0], argv)
+    os.write(fd, "".join(line + "\n" for line in lines).encode())
+    while select.select([fd], [], [], 10)[0]:
+        try:
+            if not os.read(fd, 4096):
+                break
+        except OSError:
+            break
+    os.waitpid(pid, 0)
+    os.close(fd)
+    return pid
+
+
+@pytest.mark.parametrize("shell", [pytest.param(name, marks=pytest.mark.skipif(
+    shutil.which(name) is None, reason=f"{name} is not installed")) for name in SHELLS])
+def test_hooks_journal_each_command_with_its_exit_code(tmp_path, monkeypatch, shell):
+    home = tmp_path / "home"
+    (home / ".termo").mkdir(parents=True)
+    (home / ".termo" / "HEAD").write_text("build")
+    (tmp_path / "hook").write_text(hook_script(shell))
+    monkeypatch.setattr(shell_hooks, "JOURNAL_DIR", home / ".termo" / "journal")
+    session = _interactive(SHELLS[shell], home, [
+        f"source {tmp_path / 'hook'}", "echo one", "false", "printf 'a\\tb\\n'", "tm save", "exit"])
+    entries = read_journal(str(session))
+    assert [(entry.command, entry.returncode) for entry in entries] == [
+        ("echo one", 0), ("false", 1), ("printf 'a\\tb\\n'", 0)]
+    assert all(entry.duration is not None and entry.duration >= 0 for entry in entries)
+
+
+def test_journal_records_keep_tabs_and_newlines_in_commands(tmp_path, monkeypatch):
+    monkeypatch.setattr(shell_hooks, "JOURNAL_DIR", tmp_path)
+    (tmp_path / "7").write_bytes(
+        b"0\t1.5\t2.0\tprintf 'a\tb'\0"
+        b"2\t1,5\t4,5\tfor x in 1 2; do\n  echo $x\ndone\0"
+        b"0\t1\t2\ttm new other\0"
+        b"not a record\0"
+        b"0\t1\t2\t  \0"
+        b"130\t\t\tcat \xff\xfe\0")
+    entries = read_journal("7")
+    assert [(entry.command, entry.returncode, entry.duration) for entry in entries] == [
+        ("printf 'a\tb'", 0, 0.5),
+        ("for x in 1 2; do\n  echo $x\ndone", 2, 3.0),
+        ("cat ��", 130, None)]
+    assert [entry.failed for entry in entries] == [False, True, True]
+
+
+@pytest.mark.parametrize("drop_failed, expected", [(True, ["make", "make install"]),
+                                                   (False, ["make", "make test", "make install"])])
+def test_save_uses_the_journal_and_can_drop_failed_commands(tm, drop_failed, expected):
+    termo = tm.home / ".termo"
+    (termo / "journal").mkdir(parents=True)
+    (termo / "HEAD").write_text("build")
+    (termo / "journal" / "4242").write_bytes(b"0\t1\t2\tmake\0" b"2\t2\t3\tmake test\0" b"0\t3\t4\tmake install\0")
+    result = tm("save", *(["--drop-failed"] if drop_failed else []), env={"TERMO_SESSION": "4242"})
+    assert result.returncode == 0, result.stderr
+    assert "Macro 'build' saved." in result.stdout
+    assert f"{'Dropped' if drop_failed else 'Kept'} 1 failed command(s): make test" in result.stdout
+    assert not (termo / "journal" / "4242").exists()
+    assert not (termo / "HEAD").exists()
+    store = SqliteMacroStore(termo / "macros.db")
+    assert store.get("build") == expected
+    store.close()
@@ -0,0 +1,78 @@
+import shutil
+
+import pytest
+
+from app.utils.shell_session import ShellSession, default_shell
+from app.utils.timeouts import TIMEOUT_STATUS
+
+SHELLS = [pytest.param(name, marks=pytest.mark.skipif(shutil.which(name) is None, reason=f"{name} is not installed"))
+          for name in ("bash", "zsh", "sh")]
+
+
+@pytest.fixture(params=SHELLS)
+def session(request, tmp_path):
+    with ShellSession(shell=shutil.which(request.param), cwd=str(tmp_path)) as session:
+        yield session
+
+
+def test_directory_and_variables_carry_over_between_steps(session, tmp_path, capfd):
+    (tmp_path / "sub").mkdir()
+    assert session.run("cd sub") == 0
+    assert session.run("export GREETING=hello; unexported=there") == 0
+    assert session.run('echo "$GREETING $unexported"; sh -c \'echo "$GREETING"\'; pwd') == 0
+    assert capfd.readouterr().out.splitlines() == ["hello there", "hello", str(tmp_path / "sub")]
+    assert session.cwd == str(tmp_path / "sub")
+
+
+def test_exit_status_of_each_step_is_reported(session):
+    assert session.run("true") == 0
+    assert session.run("false") == 1
+    assert session.run("sh -c 'exit 42'") == 42
+    # A step that ends the shell gets its status, and the next step a new shell
+    assert session.run("exit 7") == 7
+    assert session.run("true") == 0
+
+
+def test_output_that_looks_like_the_sentinel_does_not_end_a_step(session, capfd):
+    token = session.token
+    assert session.run(f"echo '{token} 0 /'; printf 'no newline'") == 0
+    assert session.run(f"echo '{token} 3 /elsewhere' >&2; false") == 1
+    assert session.cwd != "/elsewhere"
+    captured = capfd.readouterr()
+    assert captured.out == f"{token} 0 /\nno newline"
+    assert captured.err == f"{token} 3 /elsewhere\n"
+
+
+def test_a_step_past_its_timeout_is_killed_and_the_next_runs_in_its_directory(session, tmp_path, monkeypatch):
+    monkeypatch.setattr("app.utils.timeouts.KILL_GRACE", 1)
+    (tmp_path / "sub").mkdir()
+    session.run("cd sub")
+    assert session.run("sleep 30", timeout=0.3) == TIMEOUT_STATUS
+    assert session.timed_out
+    assert session.run("test \"$PWD\" = " + str(tmp_path / "sub")) == 0
+    assert not session.timed_out
+
+
+@pytest.mark.parametrize("shell", SHELLS)
+def test_output_is_relayed_to_the_callback_and_to_ours(shell, tmp_path, capfd, monkeypatch):
+    monkeypatch.setattr("app.utils.timeouts.KILL_GRACE", 1)
+    chunks = []
+    with ShellSession(shell=shutil.which(shell), cwd=str(tmp_path),
+                      output=lambda data, err: chunks.append((data, err))) as session:
+        assert session.run("echo out; echo err >&2; cd /") == 0
+        assert session.run("printf partial; sleep 30", timeout=0.3) == TIMEOUT_STATUS
+        assert session.run("test \"$PWD\" = /; exit 3") == 3
+        assert session.run("head -c 200000 /dev/zero | tr '\\0' x") == 0
+    stdout = b"".join(data for data, err in chunks if not err)
+    assert stdout == b"out\npartial" + b"x" * 200000
+    assert b"".join(data for data, err in chunks if err) == b"err\n"
+    captured = capfd.readouterr()
+    assert captured.out == stdout.decode()
+    assert captured.err == "err\n"
+
+
+@pytest.mark.parametrize("shell, expected", [("/bin/bash", "/bin/bash"), ("/usr/bin/zsh", "/usr/bin/zsh"),
+                                             ("/usr/bin/fish", "/bin/sh"), ("", "/bin/sh")])
+def test_shells_without_source_fall_back_to_sh(monkeypatch, shell, expected):
+    monkeypatch.setenv("SHELL", shell)
+    assert default_shell() == expected
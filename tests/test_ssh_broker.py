@@ -0,0 +1,49 @@
+import threading
+import time
+
+from app.utils.ssh_broker import Broker
+
+
+def _request(server):
+    return {"user": "u", "host": "127.0.0.1", "port": server.port, "key": None, "password": "x"}
+
+
+def test_broker_reuses_a_transport_for_the_same_login(ssh_server):
+    broker = Broker()
+    entry = broker._acquire(_request(ssh_server))
+    try:
+        assert broker._acquire(_request(ssh_server)) is entry
+        assert entry.channels == 2
+    finally:
+        entry.client.close()
+
+
+def test_broker_closes_idle_transports_on_a_timer(ssh_server):
+    broker = Broker(ttl=0.2)
+    entry = broker._acquire(_request(ssh_server))
+    broker._release(entry)
+    stop = threading.Event()
+    threading.Thread(target=broker._expire_periodically, args=(stop,), daemon=True).start()
+    try:
+        assert stop.wait(5)
+    finally:
+        stop.set()
+    assert not broker.pool
+    assert not entry.transport.is_active()
+
+
+def test_remote_runs_through_the_broker(tm, ssh_server):
+    tm.add_macros({"hello": ["echo hello", "echo again >&2"]})
+    target = f"u@127.0.0.1:{ssh_server.port}"
+    for _ in range(2):
+        result = tm("remote", "hello", "-h", target, "-P", "x", "--broker", env={"TERMO_SSH_TTL": "1"})
+        assert result.returncode == 0, result.stderr
+        assert "hello" in result.stdout.splitlines()
+        assert "again" in result.stderr.splitlines()
+    assert (tm.home / ".termo" / "ssh-broker.lock").exists()
+    # Idle, it closes the connection and exits
+    socket_path = tm.home / ".termo" / "ssh-broker.sock"
+    deadline = time.monotonic() + 10
+    while socket_path.exists() and time.monotonic() < deadline:
+        time.sleep(0.1)
+    assert not socket_path.exists()
@@ -0,0 +1,68 @@
+import json
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+from app.cli import COMMANDS
+from benchmarks.run import _import_time_ms
+
+ROOT = Path(__file__).resolve().parent.parent
+# Every `tm` call imports app.cli; these are only for the commands that need them
+HEAVY_MODULES = ["paramiko", "sqlite3", "asyncio", "concurrent.futures"]
+# Every `tm` call pays for importing click, so how long a cold `tm ls` may spend importing
+# is measured against that rather than in milliseconds, which depend on the machine; the
+# 80 ms budget in DEVELOPING.md is about twice click's import time on a typical laptop.
+# TERMO_STARTUP_BUDGET_MS sets a budget in milliseconds instead.
+STARTUP_BUDGET_CLICK_IMPORTS = 2
+STARTUP_RUNS = 5
+
+
+def _modules_after_import(module):
+    # A fresh interpreter, as this one has imported whatever earlier tests needed
+    code = f"import json, sys; import {module}; print(json.dumps(sorted(sys.modules)))"
+    output = subprocess.run([sys.executable, "-c", code], cwd=ROOT, capture_output=True, text=True, check=True)
+    return set(json.loads(output.stdout))
+
+
+def test_cli_import_stays_light():
+    modules = _modules_after_import("app.cli")
+    assert not [name for name in HEAVY_MODULES if name in modules]
+    command_modules = {target.partition(":")[0] for target in COMMANDS.values()}
+    assert not command_modules & modules
+
+
+def test_client_uses_only_the_standard_library():
+    modules = _modules_after_import("app.client")
+    assert {name for name in modules if name.startswith("app.")} == {"app.client"}
+    assert "click" not in modules
+
+
+def _least_import_ms(tmp_path, commands):
+    """The least time, over a few runs, a fresh interpreter spends importing for each command.
+
+    The commands take turns, so a busy machine slows all of them alike.
+    """
+    (tmp_path / "home").mkdir(exist_ok=True)
+    env = dict(os.environ, HOME=str(tmp_path / "home"), TERMO_DAEMON="0", TERMO_TELEMETRY="0")
+    # Stale bytecode would be compiled on every run and counted as import time
+    env.pop("PYTHONDONTWRITEBYTECODE", None)
+
+    def run(args, *options):
+        return subprocess.run([sys.executable, *options, *args], cwd=ROOT, env=env, stdin=subprocess.DEVNULL,
+                              capture_output=True, text=True)
+
+    for args in commands:
+        run(args)
+    samples = [[_import_time_ms(run(args, "-X", "importtime").stderr) for args in commands]
+               for _ in range(STARTUP_RUNS)]
+    return [min(times) for times in zip(*samples)]
+
+
+def test_cold_ls_imports_within_the_startup_budget(tmp_path):
+    import_ms, click_ms = _least_import_ms(tmp_path, [["termo.py", "ls"], ["-c", "import click"]])
+    if "TERMO_STARTUP_BUDGET_MS" in os.environ:
+        budget_ms = float(os.environ["TERMO_STARTUP_BUDGET_MS"])
+    else:
+        budget_ms = STARTUP_BUDGET_CLICK_IMPORTS * click_ms
+    assert import_ms <= budget_ms, f"cold `tm ls` imports took {import_ms:.1f} ms, over the {budget_ms:.1f} ms budget"
@@ -0,0 +1,102 @@
+import os
+
+import pytest
+
+from app.utils import step_cache
+from app.utils.step_cache import StepCache
+from app.utils.steps import parse_steps
+
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = StepCache("build", path=tmp_path / "cache.db")
+    yield cache
+    cache.connection.close()
+
+
+@pytest.fixture
+def project(tmp_path):
+    project = tmp_path / "project"
+    (project / "src").mkdir(parents=True)
+    (project / "src" / "main.c").write_text("int main() { return 0; }\n")
+    return project
+
+
+def _step(line):
+    step, = parse_steps([line])
+    return step
+
+
+def _build(cache, project, step):
+    """Look the step up, and if it misses, run it (touch its output) and store it; return whether it hit."""
+    key, hit = cache.lookup(step, step.command, str(project))
+    if not hit:
+        (project / "app").write_text("built")
+        cache.store(key, step, step.command, str(project))
+    return hit
+
+
+def test_an_unchanged_step_hits(cache, project):
+    step = _step("cc -o app src/main.c  #tm: inputs=src outputs=app")
+    assert not _build(cache, project, step)
+    assert _build(cache, project, step)
+
+
+def test_a_changed_input_file_misses(cache, project):
+    step = _step("cc -o app src/main.c  #tm: inputs=src outputs=app")
+    _build(cache, project, step)
+    (project / "src" / "main.c").write_text("int main() { return 1; }\n")
+    assert not _build(cache, project, step)
+    assert _build(cache, project, step)
+
+
+def test_a_new_input_file_misses(cache, project):
+    step = _step("cc -o app src/*.c  #tm: inputs=src outputs=app")
+    _build(cache, project, step)
+    (project / "src" / "util.c").write_text("int util;\n")
+    assert not _build(cache, project, step)
+
+
+def test_an_input_touched_without_changes_still_hits(cache, project):
+    step = _step("cc -o app src/main.c  #tm: inputs=src outputs=app")
+    _build(cache, project, step)
+    os.utime(project / "src" / "main.c", ns=(1, 1))
+    assert _build(cache, project, step)
+
+
+def test_a_changed_or_missing_output_is_invalidated(cache, project):
+    step = _step("cc -o app src/main.c  #tm: inputs=src outputs=app")
+    _build(cache, project, step)
+    (project / "app").write_text("edited by hand")
+    assert cache.lookup(step, step.command, str(project))[1] is False
+    _build(cache, project, step)
+    (project / "app").unlink()
+    assert cache.lookup(step, step.command, str(project))[1] is False
+
+
+def test_a_changed_env_variable_misses(cache, project, monkeypatch):
+    step = _step("cc -o app src/main.c  #tm: inputs=src outputs=app env=CFLAGS")
+    monkeypatch.setenv("CFLAGS", "-O0")
+    _build(cache, project, step)
+    monkeypatch.setenv("CFLAGS", "-O2")
+    assert not _build(cache, project, step)
+
+
+def test_no_reuse_misses_but_refreshes_the_entry(tmp_path, cache, project):
+    step = _step("cc -o app src/main.c  #tm: inputs=src outputs=app")
+    no_cache = StepCache("build", reuse=False, path=tmp_path / "cache.db")
+    assert not _build(no_cache, project, step)
+    assert not _build(no_cache, project, step)
+    no_cache.connection.close()
+    assert _build(cache, project, step)
+
+
+def test_least_recently_used_entries_are_evicted_past_the_byte_budget(cache, project, monkeypatch):
+    steps = [_step(f"echo {'x' * 1000} {number}  #tm: outputs=app") for number in range(10)]
+    monkeypatch.setattr(step_cache, "MAX_BYTES", 5000)
+    for step in steps:
+        _build(cache, project, step)
+    kept = {command for _, _, _, command, _, _ in cache.entries()}
+    assert kept == {step.command for step in steps[-4:]}
+    total = cache.connection.execute("SELECT SUM(row_bytes) FROM entries").fetchone()[0]
+    assert total <= 5000
@@ -0,0 +1,38 @@
+import pytest
+
+from app.utils.steps import StepError, expand_steps, parse_steps, run_order
+from app.utils.templates import compile_commands
+
+
+def _ids(steps):
+    return [step.id for step in steps]
+
+
+def test_run_order_keeps_macro_order_without_annotations():
+    steps = parse_steps(["echo a", "echo b", "echo c"])
+    assert _ids(run_order(steps)) == ["1", "2", "3"]
+
+
+def test_run_order_puts_a_step_after_a_later_step_it_needs():
+    steps = parse_steps(["make test  #tm: needs=build", "make lint  #tm: needs=", "make  #tm: id=build needs="])
+    assert _ids(run_order(steps)) == ["2", "build", "1"]
+
+
+def test_circular_needs_are_rejected():
+    with pytest.raises(StepError, match="circular"):
+        parse_steps(["echo a  #tm: id=a needs=b", "echo b  #tm: id=b needs=a"])
+
+
+def test_parameter_values_cannot_add_annotations():
+    steps = expand_steps(compile_commands(["echo {1}", "make  #tm: id=build"]), {"1": "hi #tm: id=build timeout=1s"})
+    assert steps[0].command == "echo hi #tm: id=build timeout=1s"
+    assert steps[0].options == {} and steps[0].timeout is None
+    assert _ids(steps) == ["1", "build"]
+
+
+def test_parameter_values_fill_annotation_options_whole():
+    templates = compile_commands(["tar czf {1}.tgz src  #tm: outputs={1}.tgz timeout={{limit:30s}}"])
+    step, = expand_steps(templates, {"1": "a b needs=x"})
+    assert step.command == "tar czf a b needs=x.tgz src"
+    assert step.options == {"outputs": ["a b needs=x.tgz"], "timeout": "30s"}
+    assert step.timeout == 30
@@ -0,0 +1,80 @@
+import json
+
+import click
+
+from app.commands import stats
+from app.utils import telemetry
+from app.utils.steps import Step, StepResult
+from app.utils.telemetry import percentile, read_runs, record_run
+
+
+def _record(name, wall, returncode=0):
+    step = Step(0, "make")
+    record_run(name, 0, wall, [StepResult(step, "ok" if returncode == 0 else "failed", returncode, wall)],
+               telemetry.children_usage())
+
+
+def test_the_run_log_rotates_past_its_size_keeping_the_newest_runs(tmp_path, monkeypatch):
+    monkeypatch.setattr(telemetry, "RUN_LOG", tmp_path / "runs.log")
+    monkeypatch.setattr(telemetry, "MAX_LOG_BYTES", 1000)
+    for number in range(100):
+        _record("build", number)
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["runs.log", "runs.log.1", "runs.log.2",
+                                                                "runs.log.3"]
+    assert all(path.stat().st_size <= 1000 + 400 for path in tmp_path.iterdir())
+    walls = [run["w"] for run in read_runs()]
+    # Oldest first, ending with the latest run, with the oldest rotated out
+    assert walls == sorted(walls) and walls[-1] == 99 and walls[0] > 0
+
+
+def test_the_default_log_size_is_4_mib():
+    assert telemetry.MAX_LOG_BYTES == 4 * 1024 * 1024
+
+
+def test_runs_can_be_read_for_one_macro(tmp_path, monkeypatch):
+    monkeypatch.setattr(telemetry, "RUN_LOG", tmp_path / "runs.log")
+    _record("build", 1)
+    _record("build-all", 2)
+    _record("build", 3)
+    assert [run["w"] for run in read_runs("build")] == [1, 3]
+
+
+def test_nothing_is_recorded_with_telemetry_off(tmp_path, monkeypatch):
+    monkeypatch.setattr(telemetry, "RUN_LOG", tmp_path / "runs.log")
+    monkeypatch.setenv("TERMO_TELEMETRY", "0")
+    _record("build", 1)
+    assert not (tmp_path / "runs.log").exists()
+
+
+def test_percentile():
+    assert percentile([], 0.5) is None
+    assert percentile([3, 1, 2], 0.5) == 2
+    assert percentile(range(1, 101), 0.95) == 95
+
+
+def test_table_columns_line_up_around_styled_cells(capsys):
+    stats._table(["macro", "flag", "runs"], [["build", click.style("slower", fg="red"), 12],
+                                              ["deploy-all", "", 3]])
+    assert click.unstyle(capsys.readouterr().out).splitlines() == ["macro       flag    runs",
+                                                                   "build       slower  12  ",
+                                                                   "deploy-all          3   "]
+
+
+def test_stats_aggregates_recorded_runs(tm):
+    tm.add_macros({"fine": ["echo ok"], "flaky": ["test -e {1}"]})
+    for _ in range(3):
+        assert tm("exec", "fine").returncode == 0
+    tm("exec", "flaky", "/")
+    tm("exec", "flaky", "/nonexistent")
+    overview = click.unstyle(tm("stats").stdout).splitlines()
+    assert overview[0].split() == ["macro", "runs", "failed", "p50", "p95", "max"]
+    assert overview[1].split()[:3] == ["fine", "3", "0"]
+    assert overview[2].split()[:3] == ["flaky", "2", "1"]
+
+    steps = click.unstyle(tm("stats", "flaky").stdout).splitlines()
+    assert steps[0] == "Step timings for macro 'flaky':"
+    assert steps[2].split()[:3] == ["1", "2", "1"]
+    assert "test -e /nonexistent" in steps[2]
+    assert steps[-1].startswith("Last run: ")
+    runs = [json.loads(line) for line in (tm.home / ".termo" / "runs.log").read_text().splitlines()]
+    assert [run["m"] for run in runs] == ["fine"] * 3 + ["flaky"] * 2
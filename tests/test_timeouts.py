@@ -0,0 +1,165 @@
+import os
+import random
+import re
+import subprocess
+import time
+
+import click
+import pytest
+
+from app.utils import timeouts
+from app.utils.steps import Step, StepResult
+from app.utils.timeouts import (Deadline, echo_timing_summary, parse_duration, retry_delay, step_limit,
+                                stop_group)
+
+
+@pytest.mark.parametrize("text, seconds", [("90", 90), ("90s", 90), ("1.5m", 90), ("2h", 7200), ("500ms", 0.5),
+                                           (" 30s ", 30)])
+def test_parse_duration(text, seconds):
+    assert parse_duration(text) == seconds
+
+
+@pytest.mark.parametrize("text", ["", "0", "0s", "-5s", "5d", "1m30s", "s", "1.s"])
+def test_parse_duration_rejects(text):
+    with pytest.raises(ValueError, match="Invalid duration"):
+        parse_duration(text)
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = _Clock()
+    monkeypatch.setattr(timeouts.time, "monotonic", clock)
+    return clock
+
+
+def test_deadline_counts_down_from_its_creation(clock):
+    deadline = Deadline(10)
+    clock.now += 4
+    assert deadline.remaining() == 6 and not deadline.expired
+    clock.now += 6
+    assert deadline.remaining() == 0 and deadline.expired
+    clock.now += 1
+    assert deadline.remaining() == 0
+
+
+def test_step_limit_is_the_tighter_of_the_step_timeout_and_the_deadline(clock):
+    assert step_limit(Step(0, "make")) is None
+    assert step_limit(Step(0, "make", {"timeout": "30s"})) == 30
+    deadline = Deadline(60)
+    assert step_limit(Step(0, "make"), deadline) == 60
+    clock.now += 45
+    assert step_limit(Step(0, "make", {"timeout": "30s"}), deadline) == 15
+
+
+@pytest.mark.parametrize("share", [0.0, 1.0])
+def test_retry_delays_double_with_up_to_half_of_each_random(monkeypatch, share):
+    monkeypatch.setattr(random, "uniform", lambda low, high: low + share * (high - low))
+    step = Step(0, "curl", {"retries": "8", "backoff": "2s"})
+    delays = [retry_delay(step, attempt) for attempt in range(1, 9)]
+    full = [2, 4, 8, 16, 32, 60, 60, 60]
+    assert delays == [delay / 2 + share * delay / 2 for delay in full]
+    assert retry_delay(step, 9) is None
+
+
+def test_retry_delay_gives_up_when_the_wait_would_outlast_the_deadline(clock):
+    step = Step(0, "curl", {"retries": "3", "backoff": "10s"})
+    assert retry_delay(step, 1, Deadline(60)) is not None
+    assert retry_delay(step, 1, Deadline(4)) is None
+    assert retry_delay(Step(0, "curl"), 1) is None
+
+
+def _gone(pid):
+    """Whether the process has exited, counting a zombie nobody has reaped yet."""
+    try:
+        with open(f"/proc/{pid}/stat") as file:
+            return file.read().rsplit(")", 1)[1].split()[0] == "Z"
+    except FileNotFoundError:
+        return True
+
+
+def _wait_gone(pid, seconds=5):
+    expires = time.monotonic() + seconds
+    while time.monotonic() < expires:
+        if _gone(pid):
+            return True
+        time.sleep(0.05)
+    return False
+
+
+@pytest.mark.parametrize("ignore_term", [False, True])
+def test_stop_group_stops_every_process_in_the_group(tmp_path, monkeypatch, ignore_term):
+    monkeypatch.setattr(timeouts, "KILL_GRACE", 0.5)
+    pidfile = tmp_path / "pid"
+    trap = "trap '' TERM; " if ignore_term else ""
+    process = subprocess.Popen(["sh", "-c", f"{trap}sleep 30 & echo $! > {pidfile}; wait"], process_group=0)
+    while not pidfile.exists() or not pidfile.read_text().strip():
+        time.sleep(0.01)
+    background = int(pidfile.read_text())
+
+    started = time.monotonic()
+    stop_group(process.pid, process.poll)
+    process.wait()
+    if ignore_term:
+        # A group that ignores SIGTERM is only killed once the grace period is over
+        assert time.monotonic() - started >= 0.5
+    assert _wait_gone(background)
+
+
+def _result(step_id, status, attempts=1, wall=1.0):
+    return StepResult(Step(0, "make", {"id": step_id}), status, 0, wall, attempts=attempts)
+
+
+def test_timing_summary_lists_timed_out_retried_and_unrun_steps(capsys, clock):
+    deadline = Deadline(60)
+    clock.now += 61
+    echo_timing_summary([_result("build", "ok"), _result("fetch", "ok", attempts=3, wall=7),
+                         _result("test", "timeout", wall=30), _result("lint", "failed", attempts=2),
+                         StepResult(Step(0, "deploy", {"id": "deploy"}), "skipped")], deadline)
+    assert click.unstyle(capsys.readouterr().out).splitlines() == [
+        "", "Timing:",
+        "  fetch  ok after 3 attempts, 7s",
+        "  test  timed out, 30s",
+        "  lint  failed after 2 attempts, 1s",
+        "  deploy  not run",
+        "The run's time budget of 1m was used up"]
+
+
+def test_timing_summary_is_silent_when_nothing_timed_out_or_retried(capsys):
+    echo_timing_summary([_result("build", "ok"), _result("test", "failed")])
+    assert capsys.readouterr().out == ""
+
+
+@pytest.mark.parametrize("jobs", ["1", "2"])
+def test_a_step_is_stopped_with_its_processes_at_its_timeout(tm, tmp_path, jobs):
+    pidfile = tmp_path / "pid"
+    tm.add_macros({"slow": [f"sleep 30 & echo $! > {pidfile}; wait  #tm: timeout=0.5s", "echo after"]})
+    started = time.monotonic()
+    result = tm("exec", "slow", "-j", jobs, env={"TERMO_KILL_GRACE": "1"})
+    assert time.monotonic() - started < 10
+    assert result.returncode == 1
+    assert "timed out after 0.5s" in click.unstyle(result.stdout + result.stderr)
+    assert _wait_gone(int(pidfile.read_text()))
+
+
+@pytest.mark.parametrize("jobs", ["1", "2"])
+def test_a_failing_step_is_retried_with_growing_delays(tm, jobs):
+    tm.add_macros({"flaky": ["false  #tm: retries=2 backoff=0.2s"]})
+    started = time.monotonic()
+    result = tm("exec", "flaky", "-j", jobs)
+    elapsed = time.monotonic() - started
+    assert result.returncode == 1
+    output = click.unstyle(result.stdout)
+    delays = [float(delay) for delay in re.findall(r"retrying in ([\d.]+)s", output)]
+    assert len(delays) == 2
+    # Each wait is between half and all of its backoff: 0.2s, then 0.4s
+    assert 0.1 <= delays[0] <= 0.2 and 0.2 <= delays[1] <= 0.4
+    assert elapsed >= 0.3
+    assert "failed after 3 attempts" in output
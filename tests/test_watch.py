@@ -0,0 +1,141 @@
+import os
+import signal
+import subprocess
+import sys
+import time
+
+import pytest
+
+from app.commands.watch import affected_steps
+from app.utils import fs_watch
+from app.utils.fs_watch import FindWatcher, InotifyWatcher, PollingWatcher, create_watcher
+from app.utils.steps import parse_steps
+from tests.conftest import ROOT
+
+needs_inotify = pytest.mark.skipif(fs_watch._inotify_libc() is None, reason="inotify is not available")
+
+
+@pytest.fixture
+def tree(tmp_path):
+    (tmp_path / "src" / "pkg").mkdir(parents=True)
+    (tmp_path / "node_modules").mkdir()
+    (tmp_path / "src" / "main.py").write_text("")
+    return tmp_path
+
+
+def _changes(watcher, seconds=2):
+    """Collect changes until some arrive, for watchers that report them asynchronously."""
+    expires = time.monotonic() + seconds
+    while True:
+        changes = watcher.changes()
+        if changes or time.monotonic() > expires:
+            return changes
+        time.sleep(0.02)
+
+
+@needs_inotify
+def test_inotify_reports_changes_in_the_tree_and_new_directories(tree):
+    watcher = InotifyWatcher([tree], recursive=True, ignore=fs_watch.DEFAULT_IGNORE)
+    try:
+        (tree / "src" / "pkg" / "mod.py").write_text("x = 1")
+        assert str(tree / "src" / "pkg" / "mod.py") in _changes(watcher)
+        (tree / "node_modules" / "dep.js").write_text("")
+        (tree / "src" / "new").mkdir()
+        assert _changes(watcher) == {str(tree / "src" / "new")}
+        (tree / "src" / "new" / "late.py").write_text("")
+        assert _changes(watcher) == {str(tree / "src" / "new" / "late.py")}
+    finally:
+        watcher.close()
+
+
+def test_polling_reports_written_created_and_deleted_files(tree):
+    watcher = PollingWatcher([tree / "src"])
+    time.sleep(0.01)
+    (tree / "src" / "main.py").write_text("changed")
+    (tree / "src" / "other.py").write_text("")
+    assert watcher.changes() == {str(tree / "src" / "main.py"), str(tree / "src" / "other.py")}
+    (tree / "src" / "other.py").unlink()
+    assert watcher.changes() == {str(tree / "src" / "other.py")}
+    assert watcher.changes() == set()
+
+
+def test_find_reports_files_changed_below_the_tree_except_ignored(tree):
+    watcher = FindWatcher([tree], ignore=fs_watch.DEFAULT_IGNORE)
+    try:
+        time.sleep(0.01)
+        (tree / "src" / "pkg" / "mod.py").write_text("")
+        (tree / "node_modules" / "dep.js").write_text("")
+        changes = watcher.changes()
+        assert str(tree / "src" / "pkg" / "mod.py") in changes
+        assert not any("node_modules" in path for path in changes)
+        assert watcher.changes() == set()
+    finally:
+        watcher.close()
+    assert not os.path.exists(watcher.marker)
+
+
+@pytest.mark.parametrize("recursive, kind", [(True, FindWatcher), (False, PollingWatcher)])
+def test_without_inotify_trees_are_watched_with_find_and_directories_polled(tree, monkeypatch, recursive, kind):
+    monkeypatch.setattr(fs_watch, "_inotify_libc", lambda: None)
+    watcher = create_watcher([tree], recursive=recursive)
+    assert isinstance(watcher, kind)
+    watcher.close()
+
+
+def _macro():
+    return parse_steps(["pip install -r requirements.txt  #tm: id=deps inputs=requirements.txt",
+                        "ruff check src  #tm: id=lint needs= inputs=src",
+                        "pytest tests  #tm: id=test needs=deps inputs=src/**/*.py,tests",
+                        "echo done  #tm: id=report needs=test",
+                        "date  #tm: needs="])
+
+
+@pytest.mark.parametrize("changed, expected", [
+    ("requirements.txt", ["deps", "test", "report", "5"]),
+    ("src/pkg/mod.py", ["lint", "test", "report", "5"]),
+    ("tests/test_mod.py", ["test", "report", "5"]),
+    # Steps without inputs= may read anything, so they always run
+    ("README.md", ["report", "5"]),
+])
+def test_affected_selects_steps_whose_inputs_changed_and_their_dependants(tmp_path, changed, expected):
+    selected = affected_steps(_macro(), {str(tmp_path / changed)}, str(tmp_path))
+    assert [step.id for step in selected] == expected
+    # The selection runs on its own: renumbered, and needing only selected steps
+    assert [step.index for step in selected] == list(range(len(expected)))
+    assert all(set(step.deps) <= set(expected) for step in selected)
+
+
+def test_a_changed_directory_reruns_everything(tmp_path):
+    (tmp_path / "docs").mkdir()
+    steps = _macro()
+    assert affected_steps(steps, {str(tmp_path / "docs")}, str(tmp_path)) == steps
+
+
+def test_watch_reruns_only_the_affected_steps(tm, tmp_path):
+    tm.add_macros({"check": ["echo built  #tm: id=build inputs=src",
+                             "echo documented  #tm: id=docs needs= inputs=docs"]})
+    project = tmp_path / "project"
+    (project / "src").mkdir(parents=True)
+    (project / "docs").mkdir()
+    env = dict(os.environ, HOME=str(tm.home), TERMO_DAEMON="0", PYTHONPATH=str(ROOT))
+    process = subprocess.Popen([sys.executable, "-c", "from app.cli import cli; cli()", "watch", "check", "--affected",
+                                "--debounce", "50"], cwd=project, env=env, stdin=subprocess.DEVNULL,
+                               stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+    try:
+        lines = []
+
+        def wait_for(text):
+            for line in process.stdout:
+                lines.append(line)
+                if text in line:
+                    return
+            pytest.fail("".join(lines))
+
+        wait_for("watching for changes")
+        (project / "src" / "app.c").write_text("")
+        wait_for("watching for changes")
+        rerun = "".join(lines[lines.index(next(line for line in lines if "Changed:" in line)):])
+        assert "built" in rerun and "documented" not in rerun
+    finally:
+        process.send_signal(signal.SIGINT)
+        process.wait(10)